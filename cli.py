@@ -0,0 +1,360 @@
+# Copyright 2024 Fondazione Bruno Kessler
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Headless command-line runner of the PILLAR analyses, for batch jobs. It runs
+the same analysis functions as the Streamlit tabs, without starting
+Streamlit. For example:
+
+    python cli.py --description examples/app-description.txt \\
+        --dfd examples/dfd_authentication.csv \\
+        --analyses simple linddun_go linddun_pro --assess linddun_pro \\
+        --output results.json --report report.pdf
+
+The API key is read from --api-key or from the environment variable of the
+provider (OPENAI_API_KEY, GOOGLE_API_KEY or MISTRAL_API_KEY).
+"""
+import argparse
+import datetime
+import json
+import os
+import sys
+from llms.prompts import THREAT_MODEL_USER_PROMPT
+from llms.simple import stream_threat_model, parse_threat_model
+from llms.linddun_go import get_linddun_go, get_deck
+from llms.linddun_pro import iter_linddun_pro_full, LINDDUN_CATEGORIES
+from llms.risk_assessment import iter_assessments, iter_control_measures, linddun_pro_to_assess, is_threat
+from misc.utils import DEFAULT_BOUNDARIES, add_missing_boundaries, parse_dfd_csv
+from misc.report import PDF_ENGINES
+from misc.export import EXPORT_FORMATS, export_format, export_report
+
+PROVIDERS = ["OpenAI API", "Google AI API", "Mistral API", "Ollama", "Local LM Studio"]
+# The same default models as the sidebar
+DEFAULT_MODELS = {
+    "OpenAI API": "gpt-4o-mini",
+    "Google AI API": "gemini-1.5-pro-latest",
+    "Mistral API": "mistral-large-latest",
+}
+API_KEY_VARIABLES = {
+    "OpenAI API": "OPENAI_API_KEY",
+    "Google AI API": "GOOGLE_API_KEY",
+    "Mistral API": "MISTRAL_API_KEY",
+}
+ANALYSES = ["simple", "linddun_go", "linddun_pro"]
+# The name of each analysis as threat source in the report
+THREAT_SOURCES = {
+    "simple": "threat_model",
+    "linddun_go": "linddun_go",
+    "linddun_pro": "linddun_pro",
+}
+
+
+def parse_arguments(argv=None):
+    """
+    This function parses the command-line arguments.
+
+    Args:
+        argv (list): The arguments, without the program name. If None, sys.argv is used.
+
+    Returns:
+        argparse.Namespace: The parsed arguments.
+    """
+    parser = argparse.ArgumentParser(
+        description="Run the PILLAR privacy threat modeling analyses without the web interface.",
+    )
+    parser.add_argument("--description", help="Text file with the description of the application.")
+    parser.add_argument("--dfd", help="CSV file with the Data Flow Diagram, in the format of examples/dfd_authentication.csv.")
+    parser.add_argument("--boundaries", help="JSON file with the trust boundaries, a list of objects with the keys id, name, description and color. Boundaries used by the DFD and missing from the file are added with default values.")
+    parser.add_argument("--app-type", default="", help="The type of the application, e.g. 'Mobile application'.")
+    parser.add_argument("--types-of-data", default="", help="Comma-separated list of the types of data collected by the application.")
+    parser.add_argument("--data-policy", default="", help="The data retention and deletion policy of the application.")
+    parser.add_argument("--user-data-control", default="", help="The actions the user can perform on their data.")
+    parser.add_argument("--dfd-only", action="store_true", help="Describe the application with the DFD only, ignoring the description.")
+
+    parser.add_argument("--provider", choices=PROVIDERS, default="OpenAI API", help="The LLM provider to use.")
+    parser.add_argument("--model", help="The model to use. Defaults to the default model of the provider in the web interface.")
+    parser.add_argument("--api-key", help="The API key of the provider. Defaults to the provider environment variable.")
+    parser.add_argument("--temperature", type=float, default=0.7, help="The temperature of the model.")
+    parser.add_argument("--max-workers", type=int, help="The maximum number of requests in flight at the same time.")
+    parser.add_argument("--no-cache", action="store_true", help="Do not read or write the cache of the LLM responses.")
+
+    parser.add_argument("--analyses", nargs="+", choices=ANALYSES, default=["simple"], help="The analyses to run.")
+    parser.add_argument("--cards", type=int, help="The number of LINDDUN GO cards to analyze. Defaults to the whole deck.")
+    parser.add_argument("--cards-per-request", type=int, default=1, help="The number of LINDDUN GO cards analyzed by a single request.")
+    parser.add_argument("--assess", choices=ANALYSES, help="Assess the impact of the threats found by this analysis, which must also be run.")
+    parser.add_argument("--controls", action="store_true", help="Also suggest control measures for the assessed threats. Only supported with the OpenAI API.")
+
+    parser.add_argument("--output", help="JSON file where the results of all the analyses are written.")
+    parser.add_argument("--report", help="File where the report of the assessed threats is written, in the format given by its extension: .pdf, .html, .md, .json, .sarif or .xlsx.")
+    parser.add_argument("--pdf-engine", choices=PDF_ENGINES, default="Built-in", help="The engine of the PDF report. The built-in one needs no external program, wkhtmltopdf also draws the graph of the DFD.")
+    parser.add_argument("--app-name", help="The name of the application in the report. Defaults to the name of the description or DFD file.")
+    parser.add_argument("--app-version", default="1.0", help="The version of the application in the report.")
+    parser.add_argument("--author", default="PILLAR", help="The author of the report.")
+
+    args = parser.parse_args(argv)
+    if not args.dfd_only and not args.description:
+        parser.error("--description is required, unless --dfd-only is given")
+    if args.dfd_only and not args.dfd:
+        parser.error("--dfd is required with --dfd-only")
+    if args.assess and args.assess not in args.analyses:
+        parser.error("--assess must be one of the analyses to run")
+    if args.controls and not args.assess:
+        parser.error("--controls requires --assess")
+    if args.controls and args.provider != "OpenAI API":
+        parser.error("--controls is only supported with the OpenAI API")
+    if "linddun_pro" in args.analyses and not args.dfd:
+        parser.error("the linddun_pro analysis requires --dfd")
+    if args.report and not args.assess:
+        parser.error("--report requires --assess, which selects the threats to report")
+    return args
+
+
+def load_inputs(args):
+    """
+    This function builds the inputs of the analyses from the files given on
+    the command line, with the same keys as the "input" session state.
+
+    Args:
+        args (argparse.Namespace): The parsed arguments.
+
+    Returns:
+        dict: The inputs of the application, including the "boundaries" key.
+    """
+    description = ""
+    if args.description:
+        with open(args.description, "r", encoding="utf-8") as f:
+            description = f.read()
+
+    dfd = []
+    if args.dfd:
+        with open(args.dfd, "r", encoding="utf-8-sig") as f:
+            dfd = parse_dfd_csv(f.read())
+
+    boundaries = DEFAULT_BOUNDARIES
+    if args.boundaries:
+        with open(args.boundaries, "r", encoding="utf-8") as f:
+            boundaries = json.load(f)
+
+    return {
+        "app_description": description,
+        "app_type": args.app_type,
+        "types_of_data": [t.strip() for t in args.types_of_data.split(",") if t.strip()],
+        "has_database": False,
+        "database": [],
+        "data_policy": args.data_policy,
+        "user_data_control": args.user_data_control,
+        "dfd": dfd,
+        "use_dfd": bool(dfd),
+        "dfd_only": args.dfd_only,
+        "boundaries": add_missing_boundaries(dfd, boundaries),
+    }
+
+
+def cache_choice(args):
+    """Returns the use_cache argument of the LLM calls: False with --no-cache, otherwise None to follow CACHE_CONFIG."""
+    return False if args.no_cache else None
+
+
+def run_simple(args, api_key, model, inputs):
+    """Runs the SIMPLE threat model, returning the list of threats."""
+    print("Running SIMPLE threat model...")
+    response_text = "".join(stream_threat_model(
+        args.provider,
+        api_key,
+        model,
+        THREAT_MODEL_USER_PROMPT(inputs),
+        args.temperature,
+        use_cache=cache_choice(args),
+    ))
+    threats = parse_threat_model(response_text).get("threat_model", [])
+    print(f"SIMPLE threat model found {len(threats)} threats")
+    return threats
+
+
+def run_linddun_go(args, api_key, model, inputs):
+    """Runs the single-agent LINDDUN GO simulation, returning the verdict on each card."""
+    cards = args.cards if args.cards else len(get_deck())
+    print(f"Running LINDDUN GO on {cards} cards...")
+    threats = get_linddun_go(
+        api_key,
+        model,
+        inputs,
+        cards,
+        args.temperature,
+        provider=args.provider,
+        max_workers=args.max_workers,
+        cards_per_request=args.cards_per_request,
+        use_cache=cache_choice(args),
+    )
+    print(f"LINDDUN GO found {sum(1 for threat in threats if threat.get('reply'))} threats in {len(threats)} cards")
+    return threats
+
+
+def run_linddun_pro(args, api_key, model, inputs):
+    """
+    Runs LINDDUN PRO for every edge of the DFD and every category, returning
+    the threats of each edge in the same form as the "linddun_pro_threats"
+    session state. The pairs whose call failed are left out.
+    """
+    dfd = inputs["dfd"]
+    print(f"Running LINDDUN PRO on {len(dfd)} edges...")
+    threats = [{} for _ in dfd]
+    failed = 0
+    for (edge_num, category, threat, error) in iter_linddun_pro_full(
+        args.provider,
+        api_key,
+        model,
+        dfd,
+        inputs["boundaries"],
+        args.temperature,
+        max_workers=args.max_workers,
+        use_cache=cache_choice(args),
+    ):
+        if error is not None:
+            failed += 1
+            print(f"Error for edge {edge_num}, category {category}: {error}", file=sys.stderr)
+        else:
+            threats[edge_num][category] = threat
+    print(f"LINDDUN PRO completed, {failed} edge-category pairs failed")
+    # The threats of each edge in the order of the categories, as in the tab
+    return [
+        [edge[category] for category in LINDDUN_CATEGORIES if category in edge]
+        for edge in threats
+    ]
+
+
+def run_risk_assessment(args, api_key, model, inputs, threats):
+    """
+    This function assesses the impact of the threats and, if requested,
+    suggests their control measures, with the requests in parallel.
+
+    Returns:
+        tuple: The assessments and the control measures of each threat, in the same order as the threats.
+    """
+    assessments = [{"impact": ""} for _ in threats]
+    control_measures = [[] for _ in threats]
+    print(f"Assessing {len(threats)} threats...")
+    for (index, assessment, error) in iter_assessments(api_key, model, threats, inputs, args.temperature, args.provider, args.max_workers, use_cache=cache_choice(args)):
+        if error is not None:
+            print(f"Error assessing threat {index}: {error}", file=sys.stderr)
+        else:
+            assessments[index] = assessment
+
+    if args.controls:
+        print(f"Suggesting control measures for {len(threats)} threats...")
+        for (index, measures, error) in iter_control_measures(api_key, model, threats, inputs, args.temperature, args.provider, args.max_workers, use_cache=cache_choice(args)):
+            if error is not None:
+                print(f"Error suggesting control measures for threat {index}: {error}", file=sys.stderr)
+            else:
+                control_measures[index] = measures
+    return assessments, control_measures
+
+
+def write_report(args, inputs, source, threats, assessments, control_measures):
+    """
+    This function writes the report of the assessed threats, with the same
+    content as the one downloaded from the Report tab.
+    """
+    default_name = os.path.splitext(os.path.basename(args.description or args.dfd))[0]
+    state = {
+        "app_name": args.app_name or default_name,
+        "app_version": args.app_version,
+        "author": args.author,
+        "date": datetime.date.today(),
+        "high_level_description": "",
+        "include_graph": bool(inputs["dfd"]),
+        "graph_seed": "0",
+        "font": "Arial",
+        "font_size": 16,
+        "pdf_engine": args.pdf_engine,
+        "input": inputs,
+        "threat_source": THREAT_SOURCES[source],
+        "to_assess": threats,
+        "to_report": [True for _ in threats],
+        "assessments": assessments,
+        "control_measures": control_measures,
+    }
+    # Files with an unknown extension get the PDF report
+    export = export_format(args.report) or "PDF"
+    if EXPORT_FORMATS[export]["binary"]:
+        f = open(args.report, "wb")
+    else:
+        f = open(args.report, "w", encoding="utf-8")
+    with f:
+        export_report(state, export, f)
+    print(f"Report written to {args.report}")
+
+
+def main(argv=None):
+    """
+    This function runs the analyses requested on the command line.
+
+    Args:
+        argv (list): The arguments, without the program name. If None, sys.argv is used.
+
+    Returns:
+        int: The exit code, 0 if all the analyses completed, 1 otherwise.
+    """
+    args = parse_arguments(argv)
+    api_key = args.api_key or os.environ.get(API_KEY_VARIABLES.get(args.provider, ""), "")
+    if args.provider in API_KEY_VARIABLES and not api_key:
+        print(f"No API key for {args.provider}, use --api-key or set {API_KEY_VARIABLES[args.provider]}", file=sys.stderr)
+        return 1
+    model = args.model or DEFAULT_MODELS.get(args.provider)
+    if not model:
+        print(f"--model is required with {args.provider}", file=sys.stderr)
+        return 1
+
+    inputs = load_inputs(args)
+    results = {"provider": args.provider, "model": model}
+    runners = {
+        "simple": run_simple,
+        "linddun_go": run_linddun_go,
+        "linddun_pro": run_linddun_pro,
+    }
+    exit_code = 0
+    for analysis in args.analyses:
+        try:
+            results[analysis] = runners[analysis](args, api_key, model, inputs)
+        except Exception as e:
+            print(f"Error running {analysis}: {e}", file=sys.stderr)
+            exit_code = 1
+
+    if args.assess and args.assess in results:
+        threats = results[args.assess]
+        if args.assess == "linddun_pro":
+            threats = linddun_pro_to_assess(threats)
+        threats = [threat for threat in threats if is_threat(args.assess, threat)]
+        assessments, control_measures = run_risk_assessment(args, api_key, model, inputs, threats)
+        results["risk_assessment"] = {
+            "source": args.assess,
+            "threats": threats,
+            "assessments": assessments,
+            "control_measures": control_measures,
+        }
+        if args.report:
+            try:
+                write_report(args, inputs, args.assess, threats, assessments, control_measures)
+            except Exception as e:
+                print(f"Error writing the report: {e}", file=sys.stderr)
+                exit_code = 1
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, default=str)
+        print(f"Results written to {args.output}")
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,368 @@
+# Copyright 2024 Fondazione Bruno Kessler
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from llms.config import CACHE_CONFIG, OLLAMA_CONFIG, LMSTUDIO_CONFIG
+
+# SQLite connections are opened per operation, the lock only serializes writes
+cache_lock = threading.Lock()
+
+
+class IncompleteResponse(str):
+    """
+    The text of a response which the model did not finish on its own, for
+    instance because it hit the token limit. It is returned to the caller as
+    any other text, but it is never cached. See checked_text.
+    """
+
+
+def response_finished(finish_reason):
+    """
+    This function tells whether the finish reason of a response of OpenAI (and
+    the compatible local servers), Mistral or Google AI means that the model
+    ended the response on its own.
+
+    Args:
+        finish_reason: The finish reason of the response, a string or an enum. None if the provider does not give one.
+
+    Returns:
+        bool: Whether the response is complete. Responses without a finish reason are considered complete.
+    """
+    if finish_reason is None:
+        return True
+    return str(getattr(finish_reason, "name", finish_reason)).lower() == "stop"
+
+
+def checked_text(text, finish_reason):
+    """
+    This function marks the text of a response as an IncompleteResponse if its
+    finish reason tells that it was cut, such as "length", so that it is not
+    cached. Streams yield checked_text("", finish_reason) after the last piece.
+
+    Args:
+        text (str): The text of the response.
+        finish_reason: The finish reason of the response, see response_finished.
+
+    Returns:
+        str: The text, as an IncompleteResponse if the response is not complete.
+    """
+    if text is None or response_finished(finish_reason):
+        return text
+    return IncompleteResponse(text)
+
+
+def contains_json(content):
+    """
+    This function is the validator of the responses which are parsed as JSON
+    without a JSON response format: the content must be JSON, or have a JSON
+    object or array in it, as extracted by the parsers of those responses.
+
+    Args:
+        content (str): The content of the response.
+
+    Returns:
+        bool: Whether the content has JSON in it.
+    """
+    candidates = [content]
+    for (start, end) in (("{", "}"), ("[", "]")):
+        (i, j) = (content.find(start), content.rfind(end))
+        if i != -1 and j > i:
+            candidates.append(content[i:j + 1])
+    for candidate in candidates:
+        try:
+            json.loads(candidate)
+            return True
+        except ValueError:
+            pass
+    return False
+
+
+def provider_base_url(provider):
+    """Returns the configured endpoint of the local providers, which can serve different models under the same name, or None for the others."""
+    if provider == "Ollama":
+        return OLLAMA_CONFIG["base_url"]
+    if provider == "Local LM Studio":
+        return LMSTUDIO_CONFIG["base_url"]
+    return None
+
+
+def cache_key(provider, model, messages, temperature, schema=None):
+    """
+    This function computes the key of a request in the response cache, as a
+    hash of everything that determines the response of the model, including
+    the endpoint of the local providers (see provider_base_url).
+
+    Args:
+        provider (str): The provider of the model, such as "OpenAI API".
+        model (str): The model to use.
+        messages (list): The messages sent to the model, in the format of the provider.
+        temperature (float): The temperature to use for the model.
+        schema (str): The name or description of the response format requested, if any.
+
+    Returns:
+        str: The hex digest of the key.
+    """
+    request = json.dumps(
+        [provider, provider_base_url(provider), model, messages, temperature, schema],
+        sort_keys=True,
+        default=str,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(request.encode("utf-8")).hexdigest()
+
+
+def should_use_cache(temperature, use_cache=None):
+    """
+    This function tells whether the cache should be used for a request. With
+    temperature 0 the response is (almost) deterministic, so the cache is used
+    whenever it is enabled. With a higher temperature the user has to opt in,
+    since a new call could give a different answer.
+
+    Args:
+        temperature (float): The temperature of the request.
+        use_cache (bool): The choice of the user for this request: True to use the cache also with a
+            temperature above 0, False to never use it, None to follow CACHE_CONFIG.
+
+    Returns:
+        bool: Whether the cache should be used.
+    """
+    if not CACHE_CONFIG["enabled"] or use_cache is False:
+        return False
+    if use_cache:
+        return True
+    return not temperature or CACHE_CONFIG["use_with_temperature"]
+
+
+def connect():
+    """Opens a connection to the cache database, creating it if needed."""
+    path = CACHE_CONFIG["path"]
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    connection = sqlite3.connect(path, timeout=30)
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, content TEXT NOT NULL, created_at REAL NOT NULL)"
+    )
+    connection.execute("CREATE INDEX IF NOT EXISTS responses_created_at ON responses (created_at)")
+    return connection
+
+
+def get_cached_response(key):
+    """
+    This function returns the cached content of a request, if present and not expired.
+
+    Args:
+        key (str): The key of the request, as returned by cache_key.
+
+    Returns:
+        str: The cached content, or None if there is no valid entry.
+    """
+    connection = connect()
+    try:
+        row = connection.execute(
+            "SELECT content, created_at FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+    finally:
+        connection.close()
+    if row is None or time.time() - row[1] > CACHE_CONFIG["ttl"]:
+        return None
+    return row[0]
+
+
+def store_response(key, content):
+    """
+    This function stores the content of a response in the cache, evicting the
+    expired entries and the oldest ones if the cache is over its size limit.
+
+    Args:
+        key (str): The key of the request, as returned by cache_key.
+        content (str): The content of the response.
+    """
+    now = time.time()
+    with cache_lock:
+        connection = connect()
+        try:
+            with connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO responses (key, content, created_at) VALUES (?, ?, ?)",
+                    (key, content, now),
+                )
+                connection.execute("DELETE FROM responses WHERE created_at < ?", (now - CACHE_CONFIG["ttl"],))
+                connection.execute(
+                    "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                    (CACHE_CONFIG["max_entries"],),
+                )
+        finally:
+            connection.close()
+
+
+def remove_response(key):
+    """Removes the entry of a request from the cache, if present."""
+    with cache_lock:
+        connection = connect()
+        try:
+            with connection:
+                connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+        finally:
+            connection.close()
+
+
+def is_valid(content, validate):
+    """
+    This function tells whether the content of a response passes the
+    validator of the caller. The validator can return False or raise an
+    exception, such as json.loads on a content which is not JSON.
+    """
+    if validate is None:
+        return True
+    try:
+        return validate(content) is not False
+    except Exception:
+        return False
+
+
+def read_cache(key, validate):
+    """
+    This function returns the cached content of a request, as get_cached_response.
+    An entry which does not pass the validator, stored before it was checked,
+    is removed, so that the request is sent again.
+    """
+    try:
+        content = get_cached_response(key)
+        if content is not None and not is_valid(content, validate):
+            print("Removing an invalid response from the LLM response cache")
+            remove_response(key)
+            content = None
+    except sqlite3.Error as e:
+        print(f"Error reading the LLM response cache: {e}")
+        content = None
+    return content
+
+
+def write_cache(key, content, validate):
+    """
+    This function stores the content of a response, as store_response, only if
+    it is complete (see IncompleteResponse) and it passes the validator.
+    """
+    if not content or isinstance(content, IncompleteResponse) or not is_valid(content, validate):
+        return
+    try:
+        store_response(key, content)
+    except sqlite3.Error as e:
+        print(f"Error writing the LLM response cache: {e}")
+
+
+def default_validator(schema):
+    """Returns the validator of the responses with the given response format: a JSON schema or object needs valid JSON."""
+    return json.loads if schema is not None else None
+
+
+def cached_completion(provider, model, messages, temperature, request, schema=None, use_cache=None, validate=None):
+    """
+    This function returns the content of a model response, calling the
+    provider only if the same request is not already in the cache. Only the
+    raw text of successful responses is cached, so that parsing and error
+    handling still happen on every call. Responses which the model did not
+    finish (see checked_text) or which do not pass the validator are not
+    cached, so that a later call asks the model again. Problems with the
+    cache itself never make the request fail.
+
+    Args:
+        provider (str): The provider of the model, such as "OpenAI API".
+        model (str): The model to use.
+        messages (list): The messages sent to the model, in the format of the provider.
+        temperature (float): The temperature to use for the model.
+        request (callable): The function making the actual request, returning the text content of the response.
+        schema (str): The name or description of the response format requested, if any.
+        use_cache (bool): Whether to use the cache for this request, see should_use_cache.
+        validate (callable): The check of the content before it is cached, such as json.loads or contains_json. It fails by returning False or raising an exception. If None, the content must be JSON when a schema is given.
+
+    Returns:
+        str: The text content of the response.
+    """
+    if not should_use_cache(temperature, use_cache):
+        return request()
+
+    if validate is None:
+        validate = default_validator(schema)
+    key = cache_key(provider, model, messages, temperature, schema)
+    content = read_cache(key, validate)
+    if content is not None:
+        return content
+
+    content = request()
+    write_cache(key, content, validate)
+    return content
+
+
+def cached_stream(provider, model, messages, temperature, stream, schema=None, use_cache=None, validate=None):
+    """
+    This function is the streaming version of cached_completion. If the
+    request is in the cache, the whole cached content is yielded at once.
+    Otherwise the pieces of the response are yielded as they arrive, and the
+    full content is cached when the stream ends, if it is complete and valid
+    as in cached_completion. A stream ends incomplete if it raises, if it is
+    not read to the end, or if it yields an empty IncompleteResponse. Streamed
+    and non-streamed requests share the same cache entries.
+
+    Args:
+        provider (str): The provider of the model, such as "OpenAI API".
+        model (str): The model to use.
+        messages (list): The messages sent to the model, in the format of the provider.
+        temperature (float): The temperature to use for the model.
+        stream (callable): The function making the actual request, returning an iterator over the text pieces of the response.
+        schema (str): The name or description of the response format requested, if any.
+        use_cache (bool): Whether to use the cache for this request, see should_use_cache.
+        validate (callable): The check of the full content before it is cached, see cached_completion.
+
+    Yields:
+        str: The text pieces of the response.
+    """
+    if not should_use_cache(temperature, use_cache):
+        yield from stream()
+        return
+
+    if validate is None:
+        validate = default_validator(schema)
+    key = cache_key(provider, model, messages, temperature, schema)
+    content = read_cache(key, validate)
+    if content is not None:
+        yield content
+        return
+
+    pieces = []
+    complete = True
+    for piece in stream():
+        if isinstance(piece, IncompleteResponse):
+            complete = False
+        if piece:
+            pieces.append(piece)
+            yield piece
+    if complete:
+        write_cache(key, "".join(pieces), validate)
+
+
+def clear_cache():
+    """Removes all the entries from the response cache."""
+    with cache_lock:
+        connection = connect()
+        try:
+            with connection:
+                connection.execute("DELETE FROM responses")
+        finally:
+            connection.close()
@@ -0,0 +1,144 @@
+# Copyright 2024 Fondazione Bruno Kessler
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import json
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from openai import OpenAI
+from mistralai import Mistral
+import google.generativeai as genai
+from llms.config import OLLAMA_CONFIG, LMSTUDIO_CONFIG, CONCURRENCY_CONFIG
+
+# Process-wide registry of the provider clients. Each client keeps its own
+# connection pool, so reusing it keeps the HTTP connections (and TLS sessions)
+# alive across requests, analyses and Streamlit reruns.
+clients = {}
+clients_lock = threading.Lock()
+# The Google SDK has a single, module-level configuration
+google_api_key = None
+session = None
+
+
+def get_client(key, factory):
+    """
+    This function returns the client registered under a key, creating it with
+    the factory the first time it is requested.
+
+    Args:
+        key (tuple): The key of the client, such as (provider, base_url, api_key).
+        factory (callable): The function creating the client.
+
+    Returns:
+        The client registered under the key.
+    """
+    with clients_lock:
+        if key not in clients:
+            clients[key] = factory()
+        return clients[key]
+
+
+def get_openai_client(api_key, base_url=None):
+    """
+    This function returns a long-lived OpenAI client, also used for the
+    OpenAI-compatible endpoints of Ollama and LM Studio.
+
+    Args:
+        api_key (str): The API key.
+        base_url (str): The base URL of the endpoint. If None, the OpenAI API is used.
+
+    Returns:
+        OpenAI: The client.
+    """
+    if base_url is None:
+        return get_client(("OpenAI API", None, api_key), lambda: OpenAI(api_key=api_key))
+    return get_client(("OpenAI API", base_url, api_key), lambda: OpenAI(base_url=base_url, api_key=api_key))
+
+
+def get_provider_client(provider, api_key=None):
+    """
+    This function returns the OpenAI-compatible client of a provider, using
+    the configured local endpoints for Ollama and LM Studio.
+
+    Args:
+        provider (str): The provider, such as "OpenAI API", "Ollama" or "Local LM Studio".
+        api_key (str): The API key, ignored for the local providers.
+
+    Returns:
+        OpenAI: The client.
+    """
+    if provider == "Ollama":
+        return get_openai_client(OLLAMA_CONFIG["api_key"], OLLAMA_CONFIG["base_url"])
+    if provider == "Local LM Studio":
+        return get_openai_client(LMSTUDIO_CONFIG["api_key"], LMSTUDIO_CONFIG["base_url"])
+    return get_openai_client(api_key)
+
+
+def get_mistral_client(api_key):
+    """
+    This function returns a long-lived Mistral client.
+
+    Args:
+        api_key (str): The Mistral API key.
+
+    Returns:
+        Mistral: The client.
+    """
+    return get_client(("Mistral API", None, api_key), lambda: Mistral(api_key=api_key))
+
+
+def get_google_model(api_key, model, generation_config=None):
+    """
+    This function returns a Google AI model object. The SDK is configured
+    again only when the API key changes, since configuring it replaces the
+    underlying client and its connections.
+
+    Args:
+        api_key (str): The Google AI API key.
+        model (str): The Google AI model to use.
+        generation_config (dict): The default generation config of the model, if any.
+
+    Returns:
+        genai.GenerativeModel: The model object.
+    """
+    global google_api_key
+    key = ("Google AI API", model, api_key, json.dumps(generation_config, sort_keys=True))
+    with clients_lock:
+        if google_api_key != api_key:
+            genai.configure(api_key=api_key)
+            google_api_key = api_key
+        if key not in clients:
+            if generation_config is None:
+                clients[key] = genai.GenerativeModel(model)
+            else:
+                clients[key] = genai.GenerativeModel(model, generation_config=generation_config)
+        return clients[key]
+
+
+def get_session():
+    """
+    This function returns the shared requests session, used for the plain
+    HTTP calls to the providers. Its connection pool is sized for the
+    maximum number of parallel requests.
+
+    Returns:
+        requests.Session: The session.
+    """
+    global session
+    with clients_lock:
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_maxsize=max(10, CONCURRENCY_CONFIG["max_workers"]))
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+        return session
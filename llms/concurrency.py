@@ -0,0 +1,212 @@
+# Copyright 2024 Fondazione Bruno Kessler
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import threading
+import time
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from llms.config import CONCURRENCY_CONFIG
+
+
+def get_max_workers(max_workers=None):
+    """
+    This function returns the number of requests that can be in flight at the same time.
+
+    Args:
+        max_workers (int): The requested number of parallel requests. If None, the default from CONCURRENCY_CONFIG is used.
+
+    Returns:
+        int: The number of parallel requests, at least 1.
+    """
+    if max_workers is None:
+        max_workers = CONCURRENCY_CONFIG["max_workers"]
+    return max(1, int(max_workers))
+
+
+def map_in_order(function, items, max_workers=None):
+    """
+    This function applies a function to every item with a bounded number of
+    parallel calls, and returns the results in the same order as the items.
+    LLM requests spend almost all their time waiting on the network, so
+    threads are enough to overlap them.
+
+    Args:
+        function (callable): The function to apply to each item.
+        items (list): The items to process.
+        max_workers (int): The maximum number of calls in flight at the same time.
+
+    Returns:
+        list: The results of the function, in the same order as the items.
+    """
+    items = list(items)
+    max_workers = get_max_workers(max_workers)
+    if max_workers == 1 or len(items) <= 1:
+        return [function(item) for item in items]
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        return list(executor.map(function, items))
+
+
+# The names of the exception classes of the provider SDKs and HTTP clients
+# which are transient without a status code: timeouts and connection errors
+# of openai, requests and httpx (used by the Mistral SDK), and the rate limit
+# and server errors of google.api_core. They are matched by name, so that
+# the SDKs of the providers which are not used do not need to be installed.
+TRANSIENT_ERROR_NAMES = {
+    "APITimeoutError",
+    "APIConnectionError",
+    "RateLimitError",
+    "InternalServerError",
+    "Timeout",
+    "ConnectionError",
+    "TimeoutException",
+    "NetworkError",
+    "RemoteProtocolError",
+    "ResourceExhausted",
+    "ServiceUnavailable",
+    "DeadlineExceeded",
+}
+
+
+def error_status_code(error):
+    """Returns the HTTP status code of an exception raised by a provider SDK or by requests, or None if it has none."""
+    status_code = getattr(error, "status_code", None)
+    if status_code is None:
+        # The errors of google.api_core have the HTTP status code as code
+        status_code = getattr(error, "code", None)
+    if status_code is None:
+        # The errors of requests and httpx have the response instead
+        status_code = getattr(getattr(error, "response", None), "status_code", None)
+    return status_code if isinstance(status_code, int) else None
+
+
+def is_transient_error(error):
+    """
+    This function tells whether an exception raised by a request to a
+    provider is transient, so that sending the same request again may
+    succeed: rate limits, timeouts, connection errors and server errors.
+    Other errors, such as invalid keys, bad requests or unparsable responses,
+    would fail again in the same way.
+
+    Args:
+        error (Exception): The exception raised by the request.
+
+    Returns:
+        bool: Whether the request should be retried.
+    """
+    status_code = error_status_code(error)
+    if status_code is not None:
+        return status_code in (408, 429) or status_code >= 500
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    return any(cls.__name__ in TRANSIENT_ERROR_NAMES for cls in type(error).__mro__)
+
+
+def call_with_retries(function, retries=None, backoff=None):
+    """
+    This function calls a function, calling it again if it raises a
+    transient error (see is_transient_error), with an exponential backoff
+    between the attempts. Any other exception is raised at once.
+
+    Args:
+        function (callable): The function to call, without arguments.
+        retries (int): The number of attempts after the first one. If None, the default from CONCURRENCY_CONFIG is used.
+        backoff (float): The seconds to wait before the first retry, doubled at each retry. If None, the default from CONCURRENCY_CONFIG is used.
+
+    Returns:
+        The value returned by the function. If all the attempts fail, or an error is not transient, the exception is raised.
+    """
+    if retries is None:
+        retries = CONCURRENCY_CONFIG["retries"]
+    if backoff is None:
+        backoff = CONCURRENCY_CONFIG["backoff"]
+    for attempt in range(retries + 1):
+        try:
+            return function()
+        except Exception as e:
+            if attempt == retries or not is_transient_error(e):
+                raise
+            print(f"Request failed ({str(e)}), retrying in {backoff * 2 ** attempt} seconds")
+            time.sleep(backoff * 2 ** attempt)
+
+
+def iter_as_completed(function, items, max_workers=None):
+    """
+    This function applies a function to every item with a bounded number of
+    parallel calls, and yields each result as soon as it is available. A
+    failing call does not stop the others: its exception is yielded instead
+    of the result, so that the caller can keep the partial results.
+
+    Args:
+        function (callable): The function to apply to each item.
+        items (list): The items to process.
+        max_workers (int): The maximum number of calls in flight at the same time.
+
+    Yields:
+        tuple: A tuple (index, result, error), where index is the position of
+            the item in items, result is the value returned by the function (None
+            if it failed) and error is the exception raised (None if it succeeded).
+    """
+    items = list(items)
+    if not items:
+        return
+    executor = ThreadPoolExecutor(max_workers=min(get_max_workers(max_workers), len(items)))
+    try:
+        futures = {executor.submit(function, item): index for index, item in enumerate(items)}
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result(), None
+            except Exception as e:
+                yield futures[future], None, e
+    finally:
+        # If the caller stops early (e.g. on a Streamlit rerun), do not wait
+        # for the calls that have not started yet
+        executor.shutdown(wait=False, cancel_futures=True)
+
+class RequestLimiter:
+    """
+    This class bounds the number of LLM requests in flight, both globally and
+    for each provider. It is shared by all the tasks of an analysis, so that
+    tasks in different stages (e.g. agents and judges of different cards) can
+    overlap without exceeding the rate limits of the providers.
+
+    Args:
+        max_workers (int): The maximum number of requests in flight overall. If None, the default from CONCURRENCY_CONFIG is used.
+        provider_limits (dict): The maximum number of requests in flight for each provider. If None, the default from CONCURRENCY_CONFIG is used.
+    """
+    def __init__(self, max_workers=None, provider_limits=None):
+        self.max_workers = get_max_workers(max_workers)
+        self.provider_limits = provider_limits if provider_limits is not None else CONCURRENCY_CONFIG["provider_limits"]
+        self.global_slots = threading.BoundedSemaphore(self.max_workers)
+        self.provider_slots = {}
+        self.lock = threading.Lock()
+
+    def provider_slot(self, provider):
+        """Returns the semaphore of a provider, creating it on first use."""
+        with self.lock:
+            if provider not in self.provider_slots:
+                limit = min(self.provider_limits.get(provider, self.max_workers), self.max_workers)
+                self.provider_slots[provider] = threading.BoundedSemaphore(max(1, limit))
+            return self.provider_slots[provider]
+
+    @contextmanager
+    def slot(self, provider):
+        """
+        Context manager that waits for a free slot for the provider and for
+        the whole analysis, and holds them while the request is running.
+        """
+        # The provider slot is taken first, so that a request waiting on a
+        # busy provider does not hold a global slot needed by other providers
+        with self.provider_slot(provider):
+            with self.global_slots:
+                yield
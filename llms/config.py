@@ -10,4 +10,52 @@ LMSTUDIO_CONFIG = {
     "base_url": "http://localhost:1234/v1",
     "api_key": "lmstudio",
     "port": 1234
-}
\ No newline at end of file
+}
+
+CONCURRENCY_CONFIG = {
+    "max_workers": 8,  # Maximum number of LLM requests in flight at the same time
+    "cards_in_flight": 4,  # Maximum number of LINDDUN GO cards discussed at the same time in multi-agent runs
+    "retries": 2,  # Number of times a failed request is retried in batch runs
+    "backoff": 2.0,  # Seconds to wait before the first retry, doubled at each retry
+    # Maximum number of requests in flight for each provider, on top of max_workers
+    "provider_limits": {
+        "OpenAI API": 8,
+        "Google AI API": 4,
+        "Mistral API": 4,
+        "Ollama": 2,
+        "Local LM Studio": 1,
+    },
+}
+
+CACHE_CONFIG = {
+    "enabled": True,
+    "path": ".cache/llm_responses.sqlite",  # SQLite database storing the cached LLM responses
+    "ttl": 7 * 24 * 60 * 60,  # Seconds after which a cached response expires
+    "max_entries": 10000,  # Maximum number of cached responses, the oldest are evicted first
+    "use_with_temperature": False,  # Whether to reuse cached responses also when the temperature is above 0
+}
+
+CONTROL_MEASURES_CONFIG = {
+    "top_k": 12,  # Number of privacy patterns, ranked locally against the threat, sent to the model to choose the control measures
+    "batch_size": 3,  # Maximum number of threats sharing the same patterns explained by a single request in bulk generation
+}
+
+JOURNAL_CONFIG = {
+    "enabled": True,
+    "directory": ".cache/runs",  # Directory of the journals of the long analyses, used to resume interrupted runs
+    "ttl": 7 * 24 * 60 * 60,  # Seconds after which the journal of an interrupted run is discarded
+}
+
+GRAPH_CACHE_CONFIG = {
+    "enabled": True,
+    "directory": ".cache/graphs",  # Directory of the rendered DFD graphs, one file per graph
+    "memory_entries": 32,  # Maximum number of built and rendered graphs kept in memory
+    "max_files": 200,  # Maximum number of rendered graphs kept on disk, the oldest are evicted first
+}
+
+THREAT_TREES_CONFIG = {
+    # Whether LINDDUN PRO may download the threat trees from the LINDDUN website
+    # when the pinned copy in the misc folder is missing. Off, so that the
+    # analyses run offline and always use the same version of the trees.
+    "download": False,
+}
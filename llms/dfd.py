@@ -14,6 +14,10 @@
 import json
 import requests
 from openai import OpenAI
+from llms.cache import cached_completion, checked_text
+from llms.clients import get_openai_client, get_session
+from misc.graph_cache import cached_graph
+from misc.utils import index_dfd, update_dfd_index, boundary_components
 from llms.prompts import (
     DFD_USER_PROMPT,
     DFD_SYSTEM_PROMPT,
@@ -22,7 +26,7 @@ from llms.prompts import (
 import streamlit as st
 import graphviz
 
-def get_dfd(api_key, model, temperature, inputs):
+def get_dfd(api_key, model, temperature, inputs, use_cache=None):
     """
     Generate DFD from application description.
     Returns a dictionary with 'dfd' edges and 'boundaries' definitions.
@@ -32,7 +36,7 @@ def get_dfd(api_key, model, temperature, inputs):
     progress_placeholder.info("Analyzing application description...")
     
     try:
-        client = OpenAI(api_key=api_key)
+        client = get_openai_client(api_key)
         
         # Enhanced system prompt with clearer instructions for dynamic boundaries
     
@@ -44,16 +48,18 @@ def get_dfd(api_key, model, temperature, inputs):
         progress_placeholder.info("Generating DFD with AI model...")
         
         # Use response_format to ensure we get JSON
-        response = client.chat.completions.create(
-            model=model,
-            messages=messages,
-            response_format={"type": "json_object"},
-            max_tokens=4096,
-            temperature=temperature,
-        )
+        def request():
+            response = client.chat.completions.create(
+                model=model,
+                messages=messages,
+                response_format={"type": "json_object"},
+                max_tokens=4096,
+                temperature=temperature,
+            )
+            return checked_text(response.choices[0].message.content, response.choices[0].finish_reason)
         
         # Parse the response content
-        content = response.choices[0].message.content
+        content = cached_completion("OpenAI API", model, messages, temperature, request, schema="json_object", use_cache=use_cache)
         print(f"Raw LLM response: {content}")
         
         try:
@@ -228,7 +234,7 @@ def get_image_analysis(api_key, model_name, base64_image):
     }
 
     try:
-        response = requests.post(
+        response = get_session().post(
             "https://api.openai.com/v1/chat/completions",
             headers=headers,
             json=payload
@@ -282,8 +288,154 @@ def get_node_shape(component_type):
         return "cylinder"
     return "rectangle"  # default shape
 
+def build_graph(dfd, boundaries, index=None):
+    """
+    This function builds the graph of the DFD, with the components grouped by
+    trust boundary and color-coded arrows for the trusted and untrusted flows.
+    It takes linear time in the number of edges.
+
+    Args:
+        dfd (list): The edges of the DFD, with the keys of the DFD tab.
+        boundaries (list): The trust boundaries, dictionaries with the keys id, name, color and description.
+        index (dict): The index of the DFD, as returned by index_dfd, or None to index it here.
+
+    Returns:
+        graphviz.Digraph: The graph of the DFD.
+    """
+    # Create a new graph
+    graph = graphviz.Digraph(engine='dot', format='svg')
+    graph.attr(
+        bgcolor='transparent',
+        overlap="false",
+        splines="ortho",
+        rankdir="TB",
+        concentrate="false",  # Keep this false to prevent edge concentration
+        fontname="Arial",
+        pad="0.5"
+    )
+    
+    print(f"Processing {len(boundaries)} boundaries")
+    
+    # Index the components, their types and boundaries in a single pass over the edges
+    if index is None:
+        index = index_dfd(dfd)
+    component_types = index["component_types"]
+    components_by_boundary = boundary_components(index)
+    
+    # Create subgraphs for each boundary with its components
+    for boundary in boundaries:
+        boundary_id = boundary["id"]
+        components = components_by_boundary.get(boundary_id, {})
+        
+        if not components:
+            print(f"Boundary {boundary_id} has no components, skipping")
+            continue
+            
+        print(f"Creating subgraph for boundary {boundary_id} with {len(components)} components")
+        
+        with graph.subgraph(name=f'cluster_{boundary_id}') as c:
+            c.attr(
+                label=boundary["name"],
+                style="dashed",
+                color=boundary["color"],
+                fontcolor=boundary["color"],
+                penwidth="2.0"
+            )
+            
+            # Add all components that belong to this boundary
+            for component in components:
+                component_type = component_types.get(component)
+                if component_type:
+                    shape = get_node_shape(component_type)
+                    node_color = "#555555"  # Default node color
+                    
+                    # Use different colors based on component type
+                    if component_type == "Entity":
+                        fillcolor = "#e1f5fe"  # Light blue for entities
+                    elif component_type == "Process":
+                        fillcolor = "#e8f5e9"  # Light green for processes
+                    elif component_type == "Data store":
+                        fillcolor = "#fff3e0"  # Light orange for data stores
+                    else:
+                        fillcolor = "#f5f5f5"  # Default light gray
+                    
+                    c.node(
+                        component, 
+                        shape=shape, 
+                        style="filled",
+                        fillcolor=fillcolor,
+                        color=node_color,
+                        fontcolor="#333333",
+                        fontsize="12",
+                        height="0.6",
+                        width="1.2"
+                    )
+    
+    # Track parallel edges between the same nodes
+    edge_counts = {}
+    
+    # Add all edges with color coding based on trusted value
+    for i, edge in enumerate(dfd):
+        from_component = edge["from"]
+        to_component = edge["to"]
+        
+        # Get the trusted value directly from the edge
+        is_trusted = edge.get("trusted", True)
+        
+        # Set edge styling based on trusted value
+        if not is_trusted:
+            # Red, dashed arrows for untrusted connections
+            edge_color = "#ff0000"  # Red
+            edge_style = "dashed"
+            edge_penwidth = "1.5"
+        else:
+            # White, solid arrows for trusted connections
+            edge_color = "#FFFFFF"  # White
+            edge_style = "solid"
+            edge_penwidth = "1.0"
+        
+        # Create a unique key for this edge pair
+        edge_key = (from_component, to_component)
+        
+        # Count parallel edges and adjust positioning
+        if edge_key in edge_counts:
+            edge_counts[edge_key] += 1
+            # Adjust the edge position for parallel edges
+            pos_attr = f"pos_{edge_counts[edge_key]}"
+        else:
+            edge_counts[edge_key] = 0
+            pos_attr = ""
+        
+        df_label = f"DF_{i}"
+        
+        
+        # Add the edge with appropriate styling and a unique constraint
+        graph.edge(
+            from_component,
+            to_component,
+            label=df_label,
+            style=edge_style,
+            color=edge_color,
+            penwidth=edge_penwidth,
+            fontcolor=edge_color,
+            fontsize="10",
+            arrowsize="0.8",
+            constraint="true",  # Ensure edge is drawn
+            # Add slight curve for parallel edges
+            pos=pos_attr,
+            # Add a unique ID to prevent merging
+            key=f"edge_{i}"
+        )
+
+    return graph
+
+
 def update_graph():
-    """Updates the DFD visualization with color-coded arrows for trust boundaries."""
+    """
+    Updates the DFD visualization with color-coded arrows for trust boundaries.
+    The graph is only built again if the DFD or the boundaries have changed
+    since it was last built.
+    """
     if "input" not in st.session_state or "dfd" not in st.session_state["input"]:
         print("No DFD data found in session state")
         return
@@ -291,18 +443,6 @@ def update_graph():
     try:
         print(f"Updating graph with {len(st.session_state['input']['dfd'])} edges")
         
-        # Create a new graph
-        graph = graphviz.Digraph(engine='dot', format='svg')
-        graph.attr(
-            bgcolor='transparent',
-            overlap="false",
-            splines="ortho",
-            rankdir="TB",
-            concentrate="false",  # Keep this false to prevent edge concentration
-            fontname="Arial",
-            pad="0.5"
-        )
-        
         # Get boundaries from session state
         boundaries = st.session_state.get("boundaries", [
             {
@@ -313,156 +453,14 @@ def update_graph():
             }
         ])
         
-        print(f"Processing {len(boundaries)} boundaries")
-        
-        # First, organize components by boundary
-        boundary_components = {}
-        for boundary in boundaries:
-            boundary_components[boundary["id"]] = set()
-        
-        # Map to track component types and their boundaries
-        component_types = {}
-        component_boundaries = {}
-        
-        # Collect all components and their types
-        for edge in st.session_state["input"]["dfd"]:
-            from_component = edge["from"]
-            to_component = edge["to"]
-            from_type = edge["typefrom"]
-            to_type = edge["typeto"]
-            
-            # Record component types - ensure we record BOTH from and to types
-            component_types[from_component] = from_type
-            component_types[to_component] = to_type
-            
-            # Record component boundaries
-            if from_component not in component_boundaries:
-                component_boundaries[from_component] = edge["boundary"]
-            
-            # For destination, we need to determine its boundary
-            # First check if it's already assigned to a boundary
-            if to_component not in component_boundaries:
-                # Look for this component as source in other edges
-                for other_edge in st.session_state["input"]["dfd"]:
-                    if other_edge["from"] == to_component:
-                        component_boundaries[to_component] = other_edge.get("boundary", "boundary_1")
-                        break
-                else:
-                    # If not found as source, assign to the same boundary as the source of this edge
-                    component_boundaries[to_component] = edge["boundary"]
-            
-            # Add components to their boundaries
-            if edge["boundary"] in boundary_components:
-                boundary_components[edge["boundary"]].add(from_component)
-            
-            to_boundary = component_boundaries[to_component]
-            if to_boundary in boundary_components:
-                boundary_components[to_boundary].add(to_component)
-        
-        # Create subgraphs for each boundary with its components
-        for boundary in boundaries:
-            boundary_id = boundary["id"]
-            components = boundary_components.get(boundary_id, set())
-            
-            if not components:
-                print(f"Boundary {boundary_id} has no components, skipping")
-                continue
-                
-            print(f"Creating subgraph for boundary {boundary_id} with {len(components)} components")
-            
-            with graph.subgraph(name=f'cluster_{boundary_id}') as c:
-                c.attr(
-                    label=boundary["name"],
-                    style="dashed",
-                    color=boundary["color"],
-                    fontcolor=boundary["color"],
-                    penwidth="2.0"
-                )
-                
-                # Add all components that belong to this boundary
-                for component in components:
-                    component_type = component_types.get(component)
-                    if component_type:
-                        shape = get_node_shape(component_type)
-                        node_color = "#555555"  # Default node color
-                        
-                        # Use different colors based on component type
-                        if component_type == "Entity":
-                            fillcolor = "#e1f5fe"  # Light blue for entities
-                        elif component_type == "Process":
-                            fillcolor = "#e8f5e9"  # Light green for processes
-                        elif component_type == "Data store":
-                            fillcolor = "#fff3e0"  # Light orange for data stores
-                        else:
-                            fillcolor = "#f5f5f5"  # Default light gray
-                        
-                        c.node(
-                            component, 
-                            shape=shape, 
-                            style="filled",
-                            fillcolor=fillcolor,
-                            color=node_color,
-                            fontcolor="#333333",
-                            fontsize="12",
-                            height="0.6",
-                            width="1.2"
-                        )
-        
-        # Track parallel edges between the same nodes
-        edge_counts = {}
-        
-        # Add all edges with color coding based on trusted value
-        for i, edge in enumerate(st.session_state["input"]["dfd"]):
-            from_component = edge["from"]
-            to_component = edge["to"]
-            
-            # Get the trusted value directly from the edge
-            is_trusted = edge.get("trusted", True)
-            
-            # Set edge styling based on trusted value
-            if not is_trusted:
-                # Red, dashed arrows for untrusted connections
-                edge_color = "#ff0000"  # Red
-                edge_style = "dashed"
-                edge_penwidth = "1.5"
-            else:
-                # White, solid arrows for trusted connections
-                edge_color = "#FFFFFF"  # White
-                edge_style = "solid"
-                edge_penwidth = "1.0"
-            
-            # Create a unique key for this edge pair
-            edge_key = (from_component, to_component)
-            
-            # Count parallel edges and adjust positioning
-            if edge_key in edge_counts:
-                edge_counts[edge_key] += 1
-                # Adjust the edge position for parallel edges
-                pos_attr = f"pos_{edge_counts[edge_key]}"
-            else:
-                edge_counts[edge_key] = 0
-                pos_attr = ""
-            
-            df_label = f"DF_{i}"
-            
-            
-            # Add the edge with appropriate styling and a unique constraint
-            graph.edge(
-                from_component,
-                to_component,
-                label=df_label,
-                style=edge_style,
-                color=edge_color,
-                penwidth=edge_penwidth,
-                fontcolor=edge_color,
-                fontsize="10",
-                arrowsize="0.8",
-                constraint="true",  # Ensure edge is drawn
-                # Add slight curve for parallel edges
-                pos=pos_attr,
-                # Add a unique ID to prevent merging
-                key=f"edge_{i}"
-            )
+        # Keep the index of the DFD between the updates, so that only the
+        # edges added at the end of the table have to be indexed again
+        def build(dfd, boundaries):
+            index = update_dfd_index(st.session_state.get("dfd_index"), dfd)
+            st.session_state["dfd_index"] = index
+            return build_graph(dfd, boundaries, index)
+
+        graph = cached_graph(build, st.session_state["input"]["dfd"], boundaries)
         
         # Store the graph in session state
         st.session_state["input"]["graph"] = graph
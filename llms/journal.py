@@ -0,0 +1,208 @@
+# Copyright 2024 Fondazione Bruno Kessler
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import hashlib
+import json
+import os
+import threading
+import time
+from llms.config import JOURNAL_CONFIG
+
+# The cancellation flags of the running analyses, by run key. A Streamlit
+# rerun starts a new script run, which can only reach the worker threads of
+# the previous one through this registry.
+cancel_events = {}
+cancel_lock = threading.Lock()
+
+
+class RunCancelled(Exception):
+    """Raised in the workers of an analysis which has been cancelled."""
+
+
+def run_key(kind, *params):
+    """
+    This function computes the key of an analysis run, as a hash of its kind
+    and of everything that determines its results.
+
+    Args:
+        kind (str): The kind of analysis, such as "linddun_go" or "linddun_pro".
+        *params: The parameters of the analysis, which must be serializable to JSON.
+
+    Returns:
+        str: The hex digest of the key.
+    """
+    run = json.dumps([kind, params], sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(run.encode("utf-8")).hexdigest()
+
+
+def cancel_run(key):
+    """
+    This function asks the running analysis with the given key to stop. The
+    workers stop before their next request, the completed work items stay
+    in the journal. It is meant as the callback of a Streamlit button: the
+    click reruns the script, which already ends the loop of the previous
+    run, so nothing is reported there and a stopped run continues by being
+    started again with the same parameters, resuming from the journal.
+
+    Args:
+        key (str): The key of the run, as returned by run_key.
+    """
+    with cancel_lock:
+        event = cancel_events.get(key)
+    if event is not None:
+        event.set()
+
+
+def prune_journals():
+    """Removes the journals of the interrupted runs older than the configured ttl."""
+    directory = JOURNAL_CONFIG["directory"]
+    if not os.path.isdir(directory):
+        return
+    now = time.time()
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        try:
+            if name.endswith(".jsonl") and now - os.path.getmtime(path) > JOURNAL_CONFIG["ttl"]:
+                os.remove(path)
+        except OSError as e:
+            print(f"Error removing the run journal {path}: {e}")
+
+
+class RunJournal:
+    """
+    This class records each work item of a long analysis (e.g. a card, an
+    agent reply or an edge-category pair) to a local JSONL file as soon as it
+    is completed. If the run is interrupted, e.g. by a Streamlit rerun or a
+    browser refresh, starting it again with the same parameters reads the
+    journal back and only the missing work items are requested.
+
+    The journal also carries the cancellation flag of the run, checked by
+    remember before every work item.
+
+    Args:
+        kind (str): The kind of analysis, such as "linddun_go" or "linddun_pro".
+        *params: The parameters of the analysis, as accepted by run_key.
+    """
+    def __init__(self, kind, *params):
+        self.key = run_key(kind, *params)
+        self.path = os.path.join(JOURNAL_CONFIG["directory"], f"{kind}-{self.key[:16]}.jsonl")
+        self.lock = threading.Lock()
+        self.entries = {}
+        if JOURNAL_CONFIG["enabled"]:
+            prune_journals()
+            self.entries = self.load()
+        # Every run gets its own flag, so that cancelling a run does not stop
+        # a later run with the same parameters
+        self.cancelled = threading.Event()
+        with cancel_lock:
+            cancel_events[self.key] = self.cancelled
+
+    def load(self):
+        """Reads the completed work items from the journal file, if any."""
+        entries = {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        entries[entry["item"]] = entry["value"]
+                    except (json.JSONDecodeError, KeyError, TypeError):
+                        # The last line may have been cut by the interruption
+                        continue
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Error reading the run journal {self.path}: {e}")
+        return entries
+
+    def __contains__(self, item):
+        return item in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, item, default=None):
+        """Returns the recorded value of a work item, or default if it has not been completed."""
+        return self.entries.get(item, default)
+
+    def record(self, item, value):
+        """
+        This function records a completed work item, both in memory and in the
+        journal file. Problems with the file never make the analysis fail.
+
+        Args:
+            item (str): The key of the work item, unique within the run.
+            value: The result of the work item, which must be serializable to JSON.
+        """
+        with self.lock:
+            self.entries[item] = value
+            if not JOURNAL_CONFIG["enabled"]:
+                return
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps({"item": item, "value": value}, ensure_ascii=False) + "\n")
+            except (OSError, TypeError, ValueError) as e:
+                print(f"Error writing the run journal {self.path}: {e}")
+
+    def check_cancelled(self):
+        """Raises RunCancelled if the run has been cancelled."""
+        if self.cancelled.is_set():
+            raise RunCancelled("The analysis has been cancelled.")
+
+    def cancel(self):
+        """Asks the run to stop, see cancel_run."""
+        self.cancelled.set()
+
+    def clear(self):
+        """Discards the completed work items, so that the run starts from scratch."""
+        with self.lock:
+            self.entries = {}
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"Error removing the run journal {self.path}: {e}")
+
+    def finish(self):
+        """Removes the journal of a run which has completed, since there is nothing left to resume."""
+        self.clear()
+        with cancel_lock:
+            if cancel_events.get(self.key) is self.cancelled:
+                del cancel_events[self.key]
+
+
+def remember(journal, item, function):
+    """
+    This function returns the result of a work item, from the journal if it
+    has already been completed, or calling the function and recording its
+    result otherwise. Failed work items are not recorded, so they are tried
+    again when the run is resumed.
+
+    Args:
+        journal (RunJournal): The journal of the run, or None to always call the function.
+        item (str): The key of the work item, unique within the run.
+        function (callable): The function computing the result, without arguments.
+
+    Returns:
+        The result of the work item.
+    """
+    if journal is None:
+        return function()
+    if item in journal:
+        return journal.get(item)
+    journal.check_cancelled()
+    value = function()
+    journal.record(item, value)
+    return value
@@ -17,6 +17,11 @@ import streamlit as st
 from openai import OpenAI
 import google.generativeai as genai
 # from mistralai import Mistral
+from llms.config import CONCURRENCY_CONFIG
+from llms.concurrency import map_in_order, iter_as_completed, RequestLimiter
+from llms.journal import remember
+from llms.cache import cached_completion, checked_text
+from llms.clients import get_openai_client, get_google_model
 from misc.utils import (
     match_number_color,
     match_letter,
@@ -24,6 +29,8 @@ from misc.utils import (
 from llms.prompts import (
     LINDDUN_GO_SYSTEM_PROMPT,
     LINDDUN_GO_USER_PROMPT,
+    LINDDUN_GO_PACKED_SYSTEM_PROMPT,
+    LINDDUN_GO_PACKED_USER_PROMPT,
     LINDDUN_GO_SPECIFIC_PROMPTS,
     LINDDUN_GO_PREVIOUS_ANALYSIS_PROMPT,
     LINDDUN_GO_JUDGE_PROMPT,
@@ -82,101 +89,177 @@ def get_deck(shuffled=False, file="misc/deck.json"):
     return result
 
 
-def get_linddun_go_google(client, model_name, inputs, threats_to_analyze, temperature):
+def pick_cards(threats_to_analyze, journal=None):
     """
-    This function generates a single-agent LINDDUN threat model from the prompt using Google Gemini.
+    This function draws the cards to analyze from the shuffled deck. When
+    resuming an interrupted run, the cards drawn by that run are used again.
+
+    Args:
+        threats_to_analyze (int): The number of cards to draw.
+        journal (RunJournal): The journal of the run, if any.
+
+    Returns:
+        list: The cards to analyze, as returned by get_deck.
+    """
+    deck = get_deck(shuffled=True)[0:threats_to_analyze]
+    titles = remember(journal, "deck", lambda: [card["title"] for card in deck])
+    by_title = {card["title"]: card for card in get_deck()}
+    return [by_title[title] for title in titles]
+
+
+def iter_pending_cards(function, deck, max_workers, journal=None):
+    """
+    This function analyzes the cards with a bounded number of parallel calls,
+    yielding each verdict as soon as it is available. The verdicts already in
+    the journal are yielded first, without calling the function.
+
+    Args:
+        function (callable): The function analyzing a card, returning its verdict.
+        deck (list): The cards to analyze.
+        max_workers (int): The maximum number of calls in flight at the same time.
+        journal (RunJournal): The journal of the run, if any.
+
+    Yields:
+        tuple: A tuple (index, threat), where index is the position of the card in the deck.
+            If a card cannot be analyzed, the exception is raised and the cards still pending are not analyzed.
+    """
+    pending = []
+    for index, card in enumerate(deck):
+        if journal is not None and f"card:{card['title']}" in journal:
+            yield index, journal.get(f"card:{card['title']}")
+        else:
+            pending.append(index)
+
+    for position, threat, error in iter_as_completed(
+        lambda index: remember(journal, f"card:{deck[index]['title']}", lambda: function(deck[index])),
+        pending,
+        max_workers,
+    ):
+        if error is not None:
+            raise error
+        yield pending[position], threat
+
+
+def analyze_card_google(client, inputs, card, temperature, use_cache=None):
+    """
+    This function asks the questions of a single LINDDUN GO card to Google Gemini.
 
     Args:
         client (GenerativeModel): The Google Gemini client.
-        model_name (str): The Google model to use.
         inputs (dict): The inputs to the model, a dictionary with the same keys as the one in the Application Info tab.
-        threats_to_analyze (int): The number of threats to analyze.
+        card (dict): The card to analyze, with the same keys as the cards returned by get_deck.
         temperature (float): The temperature to use for the model.
-    
+        use_cache (bool): Whether to use the response cache, see should_use_cache in llms/cache.py.
+
     Returns:
-        list: The list of threats in the threat model. Each threat is a dictionary with the following keys:
-            - question: string. The questions on the card, asked to the LLM to elicit the threat.
-            - threat_title: string. The title of the threat.
-            - threat_description: string. The description of the threat.
-            - threat_type: int. The LINDDUN category of the threat, from 1 to 7.
-            - reply: boolean. Whether the threat was deemed present or not in the application by the LLM.
-            - reason: string. The reason for the detection or non-detection of the threat.
+        dict: The threat associated with the card, with the same keys as the threats returned by get_linddun_go_google.
     """
-    print(f"Starting Google Gemini analysis with model: {model_name}")
-    deck = get_deck(shuffled=True)
-    threats = []
+    question = "\n".join(card["questions"])
+    title = card["title"]
+    description = card["description"]
+    type = card["type"]
 
-    # For each card, ask the associated questions to the LLM
-    for card in deck[0:threats_to_analyze]:
-        question = "\n".join(card["questions"])
-        title = card["title"]
-        description = card["description"]
-        type = card["type"]
-        
-        print(f"Processing card: {title}")
+    print(f"Processing card: {title}")
 
-        system_prompt = LINDDUN_GO_SPECIFIC_PROMPTS[0] + LINDDUN_GO_SYSTEM_PROMPT
-        user_prompt = LINDDUN_GO_USER_PROMPT(inputs, question, title, description)
-        
-        messages = [
-            {
-                'role': 'user',
-                'parts': [{'text': system_prompt}],
-            },
-            {
-                'role': 'user',
-                'parts': [{'text': user_prompt}],
-            }
-        ]
-        
-        try:
-            print(f"Sending request to Google Gemini API")
-            response = client.generate_content(
-                messages,
-                generation_config=genai.types.GenerationConfig(
-                    response_mime_type="application/json",
-                    max_output_tokens=4096,
-                    temperature=temperature,
-                ),
-            )
-            
-            print(f"Received response from Google Gemini API")
-            if response and response.candidates and response.candidates[0].content and response.candidates[0].content.parts:
-                response_text = response.candidates[0].content.parts[0].text
-                print(f"Response text: {response_text[:100]}...")  # Print first 100 chars
-                response_content = json.loads(response_text)
-            else:
-                print("Empty or invalid response from Google Gemini API")
-                response_content = {"reply": False, "reason": "Google API response was empty or invalid."}
-        except Exception as e:
-            print(f"Error with Google Gemini API: {str(e)}")
-            response_content = {"reply": False, "reason": f"Error processing with Google API: {str(e)}"}
-        
-        response_content["question"] = question
-        response_content["threat_title"] = title
-        response_content["threat_description"] = description
-        response_content["threat_type"] = type
+    system_prompt = LINDDUN_GO_SYSTEM_PROMPT
+    user_prompt = LINDDUN_GO_USER_PROMPT(inputs, question, title, description, LINDDUN_GO_SPECIFIC_PROMPTS[0])
 
-        threats.append(response_content)
-        print(f"Completed card: {title}")
+    messages = [
+        {
+            'role': 'user',
+            'parts': [{'text': system_prompt}],
+        },
+        {
+            'role': 'user',
+            'parts': [{'text': user_prompt}],
+        }
+    ]
 
-    print(f"Completed Google Gemini analysis, processed {len(threats)} threats")
-    return threats
+    def request():
+        print(f"Sending request to Google Gemini API")
+        response = client.generate_content(
+            messages,
+            generation_config=genai.types.GenerationConfig(
+                response_mime_type="application/json",
+                max_output_tokens=4096,
+                temperature=temperature,
+            ),
+        )
+
+        print(f"Received response from Google Gemini API")
+        if response and response.candidates and response.candidates[0].content and response.candidates[0].content.parts:
+            return checked_text(response.candidates[0].content.parts[0].text, response.candidates[0].finish_reason)
+        return None
+
+    try:
+        response_text = cached_completion("Google AI API", client.model_name, messages, temperature, request, use_cache=use_cache, validate=json.loads)
+        if response_text:
+            print(f"Response text: {response_text[:100]}...")  # Print first 100 chars
+            response_content = json.loads(response_text)
+        else:
+            print("Empty or invalid response from Google Gemini API")
+            response_content = {"reply": False, "reason": "Google API response was empty or invalid."}
+    except Exception as e:
+        print(f"Error with Google Gemini API: {str(e)}")
+        response_content = {"reply": False, "reason": f"Error processing with Google API: {str(e)}"}
+
+    response_content["question"] = question
+    response_content["threat_title"] = title
+    response_content["threat_description"] = description
+    response_content["threat_type"] = type
 
+    print(f"Completed card: {title}")
+    return response_content
 
-def get_linddun_go(api_key, model_name, inputs, threats_to_analyze, temperature, provider=None):
+
+def iter_linddun_go_google(client, model_name, inputs, threats_to_analyze, temperature, max_workers=None, journal=None, use_cache=None):
     """
-    This function generates a single-agent LINDDUN threat model from the prompt.
+    This function generates a single-agent LINDDUN threat model from the prompt using Google Gemini,
+    yielding the verdict on each card as soon as it is available.
+    The cards are analyzed in parallel, with at most max_workers requests in flight.
 
     Args:
-        api_key (str): The OpenAI API key.
-        model_name (str): The OpenAI model to use.
+        client (GenerativeModel): The Google Gemini client.
+        model_name (str): The Google model to use.
+        inputs (dict): The inputs to the model, a dictionary with the same keys as the one in the Application Info tab.
+        threats_to_analyze (int): The number of threats to analyze.
+        temperature (float): The temperature to use for the model.
+        max_workers (int): The maximum number of parallel requests. If None, the default from the configuration is used.
+        journal (RunJournal): The journal of the run, to resume it if it has been interrupted. If None, nothing is recorded.
+        use_cache (bool): Whether to use the response cache, see should_use_cache in llms/cache.py.
+
+    Yields:
+        tuple: A tuple (index, threat), where index is the position of the card in the analyzed deck and threat is the verdict on it, as returned by get_linddun_go_google.
+            If a card cannot be analyzed, the exception is raised and the cards still pending are not analyzed.
+    """
+    print(f"Starting Google Gemini analysis with model: {model_name}")
+    deck = pick_cards(threats_to_analyze, journal)
+
+    # For each card, ask the associated questions to the LLM
+    yield from iter_pending_cards(
+        lambda card: analyze_card_google(client, inputs, card, temperature, use_cache),
+        deck,
+        max_workers,
+        journal,
+    )
+
+
+def get_linddun_go_google(client, model_name, inputs, threats_to_analyze, temperature, max_workers=None, use_cache=None):
+    """
+    This function generates a single-agent LINDDUN threat model from the prompt using Google Gemini.
+    The cards are analyzed in parallel, with at most max_workers requests in flight.
+
+    Args:
+        client (GenerativeModel): The Google Gemini client.
+        model_name (str): The Google model to use.
         inputs (dict): The inputs to the model, a dictionary with the same keys as the one in the Application Info tab.
         threats_to_analyze (int): The number of threats to analyze.
         temperature (float): The temperature to use for the model.
+        max_workers (int): The maximum number of parallel requests. If None, the default from the configuration is used.
+        use_cache (bool): Whether to use the response cache, see should_use_cache in llms/cache.py.
     
     Returns:
-        list: The list of threats in the threat model. Each threat is a dictionary with the following keys:
+        list: The list of threats in the threat model, in the same order as the deck. Each threat is a dictionary with the following keys:
             - question: string. The questions on the card, asked to the LLM to elicit the threat.
             - threat_title: string. The title of the threat.
             - threat_description: string. The description of the threat.
@@ -184,51 +267,47 @@ def get_linddun_go(api_key, model_name, inputs, threats_to_analyze, temperature,
             - reply: boolean. Whether the threat was deemed present or not in the application by the LLM.
             - reason: string. The reason for the detection or non-detection of the threat.
     """
-    if provider == "Ollama":
-        client = OpenAI(base_url="http://localhost:11434/v1", api_key="ollama")
-    elif provider == "Local LM Studio":
-        client = OpenAI(
-            base_url="http://localhost:1234/v1",
-            api_key="lmstudio"
-        )
-    elif provider == "Google AI API":
-        try:
-            import google.generativeai as genai
-            genai.configure(api_key=api_key)
-            google_client = genai.GenerativeModel(
-                model_name,
-                generation_config={"response_mime_type": "application/json"}
-            )
-            return get_linddun_go_google(google_client, model_name, inputs, threats_to_analyze, temperature)
-        except Exception as e:
-            print(f"Error initializing Google AI client: {str(e)}")
-            raise Exception(f"Error initializing Google AI client: {str(e)}")
-    elif provider == "Mistral API":
-        client = OpenAI(api_key=api_key)
-    else:
-        client = OpenAI(api_key=api_key)
-    deck = get_deck(shuffled=True)
+    results = iter_linddun_go_google(client, model_name, inputs, threats_to_analyze, temperature, max_workers, use_cache=use_cache)
+    threats = [threat for index, threat in sorted(results, key=lambda result: result[0])]
 
-    threats = []
+    print(f"Completed Google Gemini analysis, processed {len(threats)} threats")
+    return threats
 
-    # For each card, ask the associated questions to the LLM
-    for card in deck[0:threats_to_analyze]:
-        question = "\n".join(card["questions"])
-        title = card["title"]
-        description = card["description"]
-        type = card["type"]
 
-        messages=[
-            {
-                "role": "system",
-                "content": LINDDUN_GO_SPECIFIC_PROMPTS[0]+LINDDUN_GO_SYSTEM_PROMPT, # We use the first specific prompt for the system prompt, as it is the single agent simulation
-            }, 
-            {
-                "role": "user", 
-                "content": LINDDUN_GO_USER_PROMPT(inputs, question, title, description)
-            },
-        ]
-        
+def analyze_card(client, model_name, inputs, card, temperature, provider="OpenAI API", use_cache=None):
+    """
+    This function asks the questions of a single LINDDUN GO card to an OpenAI-compatible model.
+
+    Args:
+        client (OpenAI): The OpenAI/LM Studio/Ollama client.
+        model_name (str): The model to use.
+        inputs (dict): The inputs to the model, a dictionary with the same keys as the one in the Application Info tab.
+        card (dict): The card to analyze, with the same keys as the cards returned by get_deck.
+        temperature (float): The temperature to use for the model.
+        provider (str): The provider of the model, used to identify the request in the response cache.
+        use_cache (bool): Whether to use the response cache, see should_use_cache in llms/cache.py.
+
+    Returns:
+        dict: The threat associated with the card, with the same keys as the threats returned by get_linddun_go.
+    """
+    question = "\n".join(card["questions"])
+    title = card["title"]
+    description = card["description"]
+    type = card["type"]
+
+    messages=[
+        {
+            "role": "system",
+            "content": LINDDUN_GO_SYSTEM_PROMPT,
+        }, 
+        {
+            "role": "user", 
+            # We use the first specific prompt as the persona, as it is the single agent simulation
+            "content": LINDDUN_GO_USER_PROMPT(inputs, question, title, description, LINDDUN_GO_SPECIFIC_PROMPTS[0])
+        },
+    ]
+    
+    def request():
         if model_name in ["gpt-4o", "gpt-4o-mini"]:
             class Threat(BaseModel):
                 reason: str
@@ -248,33 +327,186 @@ def get_linddun_go(api_key, model_name, inputs, threats_to_analyze, temperature,
                 temperature=temperature,
                 max_tokens=4096,
             )
-        response_content = json.loads(response.choices[0].message.content)
-        response_content["question"] = question
-        response_content["threat_title"] = title
-        response_content["threat_description"] = description
-        response_content["threat_type"] = type
+        return checked_text(response.choices[0].message.content, response.choices[0].finish_reason)
 
-        threats.append(response_content)
+    response_content = json.loads(cached_completion(provider, model_name, messages, temperature, request, schema="reason/reply", use_cache=use_cache))
+    response_content["question"] = question
+    response_content["threat_title"] = title
+    response_content["threat_description"] = description
+    response_content["threat_type"] = type
+
+    return response_content
 
-    return threats
 
+def analyze_cards_packed(client, model_name, inputs, cards, temperature, provider="OpenAI API", use_cache=None):
+    """
+    This function asks the questions of several LINDDUN GO cards to an
+    OpenAI-compatible model with a single request, so that the application
+    description is sent only once. The cards whose answer is missing or
+    malformed are analyzed again one by one with analyze_card.
 
+    Args:
+        client (OpenAI): The OpenAI/LM Studio/Ollama client.
+        model_name (str): The model to use.
+        inputs (dict): The inputs to the model, a dictionary with the same keys as the one in the Application Info tab.
+        cards (list): The cards to analyze, with the same keys as the cards returned by get_deck.
+        temperature (float): The temperature to use for the model.
+        provider (str): The provider of the model, used to identify the request in the response cache.
+        use_cache (bool): Whether to use the response cache, see should_use_cache in llms/cache.py.
 
-def get_multiagent_linddun_go(keys, models, inputs, temperature, rounds, threats_to_analyze, llms_to_use, lmstudio=False, ollama=False):
+    Returns:
+        list: The threats associated with the cards, in the same order as the cards, with the same keys as the threats returned by get_linddun_go.
     """
-    This function generates a multi-agent LINDDUN threat model from the prompt.
-    
+    if len(cards) == 1:
+        return [analyze_card(client, model_name, inputs, cards[0], temperature, provider, use_cache)]
+
+    messages=[
+        {
+            "role": "system",
+            "content": LINDDUN_GO_PACKED_SYSTEM_PROMPT,
+        },
+        {
+            "role": "user",
+            "content": LINDDUN_GO_PACKED_USER_PROMPT(inputs, cards, LINDDUN_GO_SPECIFIC_PROMPTS[0])
+        },
+    ]
+
+    def request():
+        response = client.chat.completions.create(
+            model=model_name,
+            messages=messages,
+            response_format={"type": "json_object"},
+            temperature=temperature,
+            # Each card needs about as many tokens as a single analysis
+            max_tokens=min(16384, 1024 * len(cards) + 1024),
+        )
+        return checked_text(response.choices[0].message.content, response.choices[0].finish_reason)
+
+    replies = {}
+    try:
+        response_content = json.loads(cached_completion(provider, model_name, messages, temperature, request, schema="packed reason/reply", use_cache=use_cache))
+        for item in response_content.get("threats", []):
+            if isinstance(item, dict) and isinstance(item.get("reply"), bool) and isinstance(item.get("reason"), str):
+                replies[str(item.get("title", "")).strip().upper()] = item
+    except Exception as e:
+        print(f"Error in packed LINDDUN GO request, analyzing the cards one by one: {str(e)}")
+
+    threats = []
+    for card in cards:
+        item = replies.get(card["title"].strip().upper())
+        if item is None:
+            threats.append(analyze_card(client, model_name, inputs, card, temperature, provider, use_cache))
+            continue
+        threats.append({
+            "reason": item["reason"],
+            "reply": item["reply"],
+            "question": "\n".join(card["questions"]),
+            "threat_title": card["title"],
+            "threat_description": card["description"],
+            "threat_type": card["type"],
+        })
+    return threats
+
+
+def iter_linddun_go(api_key, model_name, inputs, threats_to_analyze, temperature, provider=None, max_workers=None, cards_per_request=1, journal=None, use_cache=None):
+    """
+    This function generates a single-agent LINDDUN threat model from the prompt,
+    yielding the verdict on each card as soon as it is available, so that the
+    results can be shown while the rest of the deck is being analyzed.
+    The cards are analyzed in parallel, with at most max_workers requests in flight.
+
     Args:
-        keys (dict): The dictionary of API keys for the different LLM providers.
-        models (dict): The dictionary of models for the different LLM providers.
-        inputs (dict): The inputs to the model, the same as the one in the Application Info tab.
+        api_key (str): The OpenAI API key.
+        model_name (str): The OpenAI model to use.
+        inputs (dict): The inputs to the model, a dictionary with the same keys as the one in the Application Info tab.
+        threats_to_analyze (int): The number of threats to analyze.
         temperature (float): The temperature to use for the model.
-        rounds (int): The number of rounds to run the simulation for.
+        provider (str): The provider to use. One of "OpenAI API", "Google AI API", "Mistral API", "Ollama", or "Local LM Studio".
+        max_workers (int): The maximum number of parallel requests. If None, the default from the configuration is used.
+        cards_per_request (int): The number of cards packed in a single request, to send the application description only once for all of them. Not supported by the Google AI API, which always uses one card per request.
+        journal (RunJournal): The journal of the run, to resume it if it has been interrupted. If None, nothing is recorded.
+        use_cache (bool): Whether to use the response cache, see should_use_cache in llms/cache.py.
+    
+    Yields:
+        tuple: A tuple (index, threat), where index is the position of the card in the analyzed deck and threat is the verdict on it, as returned by get_linddun_go.
+            If a card cannot be analyzed, the exception is raised and the cards still pending are not analyzed.
+    """
+    if provider == "Ollama":
+        client = get_openai_client("ollama", "http://localhost:11434/v1")
+    elif provider == "Local LM Studio":
+        client = get_openai_client("lmstudio", "http://localhost:1234/v1")
+    elif provider == "Google AI API":
+        try:
+            google_client = get_google_model(
+                api_key,
+                model_name,
+                generation_config={"response_mime_type": "application/json"}
+            )
+        except Exception as e:
+            print(f"Error initializing Google AI client: {str(e)}")
+            raise Exception(f"Error initializing Google AI client: {str(e)}")
+        yield from iter_linddun_go_google(google_client, model_name, inputs, threats_to_analyze, temperature, max_workers, journal, use_cache)
+        return
+    elif provider == "Mistral API":
+        client = get_openai_client(api_key)
+    else:
+        client = get_openai_client(api_key)
+    deck = pick_cards(threats_to_analyze, journal)
+
+    if cards_per_request > 1:
+        # The cards already in the journal are not packed again
+        pending = []
+        for index, card in enumerate(deck):
+            if journal is not None and f"card:{card['title']}" in journal:
+                yield index, journal.get(f"card:{card['title']}")
+            else:
+                pending.append(index)
+
+        def analyze_pack(pack):
+            if journal is not None:
+                journal.check_cancelled()
+            threats = analyze_cards_packed(client, model_name, inputs, [deck[index] for index in pack], temperature, provider, use_cache)
+            if journal is not None:
+                for index, threat in zip(pack, threats):
+                    journal.record(f"card:{deck[index]['title']}", threat)
+            return threats
+
+        # Pack the cards in groups, asking all the questions of a group at once
+        packs = [pending[i:i + cards_per_request] for i in range(0, len(pending), cards_per_request)]
+        for pack_index, threats, error in iter_as_completed(analyze_pack, packs, max_workers):
+            if error is not None:
+                raise error
+            for index, threat in zip(packs[pack_index], threats):
+                yield index, threat
+        return
+
+    # For each card, ask the associated questions to the LLM
+    yield from iter_pending_cards(
+        lambda card: analyze_card(client, model_name, inputs, card, temperature, provider, use_cache),
+        deck,
+        max_workers,
+        journal,
+    )
+
+
+def get_linddun_go(api_key, model_name, inputs, threats_to_analyze, temperature, provider=None, max_workers=None, cards_per_request=1, use_cache=None):
+    """
+    This function generates a single-agent LINDDUN threat model from the prompt.
+    The cards are analyzed in parallel, with at most max_workers requests in flight.
+
+    Args:
+        api_key (str): The OpenAI API key.
+        model_name (str): The OpenAI model to use.
+        inputs (dict): The inputs to the model, a dictionary with the same keys as the one in the Application Info tab.
         threats_to_analyze (int): The number of threats to analyze.
-        llms_to_use (list): The list of LLM providers to use.
+        temperature (float): The temperature to use for the model.
+        provider (str): The provider to use. One of "OpenAI API", "Google AI API", "Mistral API", "Ollama", or "Local LM Studio".
+        max_workers (int): The maximum number of parallel requests. If None, the default from the configuration is used.
+        cards_per_request (int): The number of cards packed in a single request, to send the application description only once for all of them. Not supported by the Google AI API, which always uses one card per request.
+        use_cache (bool): Whether to use the response cache, see should_use_cache in llms/cache.py.
     
     Returns:
-        list: The list of threats in the threat model. Each threat is a dictionary with the following keys
+        list: The list of threats in the threat model, in the same order as the deck. Each threat is a dictionary with the following keys:
             - question: string. The questions on the card, asked to the LLM to elicit the threat.
             - threat_title: string. The title of the threat.
             - threat_description: string. The description of the threat.
@@ -282,26 +514,54 @@ def get_multiagent_linddun_go(keys, models, inputs, temperature, rounds, threats
             - reply: boolean. Whether the threat was deemed present or not in the application by the LLM.
             - reason: string. The reason for the detection or non-detection of the threat.
     """
+    results = iter_linddun_go(api_key, model_name, inputs, threats_to_analyze, temperature, provider, max_workers, cards_per_request, use_cache=use_cache)
+    return [threat for index, threat in sorted(results, key=lambda result: result[0])]
+
+
+
+def iter_multiagent_linddun_go(keys, models, inputs, temperature, rounds, threats_to_analyze, llms_to_use, lmstudio=False, ollama=False, max_workers=None, cards_in_flight=None, journal=None, use_cache=None):
+    """
+    This function generates a multi-agent LINDDUN threat model from the prompt,
+    yielding the final verdict on each card as soon as its judge has decided.
+    
+    Args:
+        keys (dict): The dictionary of API keys for the different LLM providers.
+        models (dict): The dictionary of models for the different LLM providers.
+        inputs (dict): The inputs to the model, the same as the one in the Application Info tab.
+        temperature (float): The temperature to use for the model.
+        rounds (int): The number of rounds to run the simulation for.
+        threats_to_analyze (int): The number of threats to analyze.
+        llms_to_use (list): The list of LLM providers to use.
+        lmstudio (bool): Whether to use LM Studio.
+        ollama (bool): Whether to use Ollama.
+        max_workers (int): The maximum number of requests in flight overall. If None, the default from the configuration is used.
+        cards_in_flight (int): The maximum number of cards discussed at the same time. If None, the default from the configuration is used.
+        journal (RunJournal): The journal of the run, recording the reply of each agent in each round and the verdict on each card, to resume the run if it has been interrupted. If None, nothing is recorded.
+        use_cache (bool): Whether to use the response cache, see should_use_cache in llms/cache.py.
+    
+    Yields:
+        tuple: A tuple (index, threat), where index is the position of the card in the analyzed deck and threat is the final verdict on it, as returned by get_multiagent_linddun_go.
+            If a card cannot be analyzed, the exception is raised and the cards still pending are not discussed.
+    """
 
     # Initialize clients based on selected providers
     clients = {}
     if "OpenAI API" in llms_to_use:
-        clients["OpenAI API"] = OpenAI(api_key=keys["openai_api_key"])
+        clients["OpenAI API"] = get_openai_client(keys["openai_api_key"])
     if "Local LM Studio" in llms_to_use:
-        clients["Local LM Studio"] = OpenAI(base_url="http://127.0.0.1:7860/v1", api_key="lm-studio")
+        clients["Local LM Studio"] = get_openai_client("lm-studio", "http://127.0.0.1:7860/v1")
     if "Ollama" in llms_to_use:
-        clients["Ollama"] = OpenAI(base_url="http://localhost:11434/v1", api_key="ollama")
+        clients["Ollama"] = get_openai_client("ollama", "http://localhost:11434/v1")
     if "Mistral API" in llms_to_use:
-        clients["Mistral API"] = OpenAI(api_key=keys["mistral_api_key"])
+        clients["Mistral API"] = get_openai_client(keys["mistral_api_key"])
     if "Google AI API" in llms_to_use:
-        genai.configure(api_key=keys["google_api_key"])
-        clients["Google AI API"] = genai.GenerativeModel(
+        clients["Google AI API"] = get_google_model(
+            keys["google_api_key"],
             models["google_model"],
             generation_config={"response_mime_type": "application/json"}
         )
 
-    threats = []
-    deck = get_deck(shuffled=True)
+    deck = pick_cards(threats_to_analyze, journal)
 
     # Separate judge provider/model from agent pool
     if ollama:
@@ -331,29 +591,45 @@ def get_multiagent_linddun_go(keys, models, inputs, temperature, rounds, threats
             elif provider == "Google AI API":
                 agent_models.append(models.get("google_model"))
 
-    for card in deck[0:threats_to_analyze]:
+    limiter = RequestLimiter(max_workers)
+    if ollama:
+        judge_slot = "Ollama"
+    elif lmstudio:
+        judge_slot = "Local LM Studio"
+    else:
+        # judge() is called without a judge_provider, so it uses OpenAI
+        judge_slot = "OpenAI API"
+
+    def discuss_card(card):
         question = "\n".join(card["questions"])
         title = card["title"]
         description = card["description"]
         type = card["type"]
         previous_analysis = [{} for _ in range(6)]
         
-        for round in range(rounds):
-            # First round: all agents participate
-            # Subsequent rounds: only competent agents
-            agents_this_round = range(6) if round == 0 else card["competent_agents"]
-            
-            for i in agents_this_round:
-                if round > 0 and i not in card["competent_agents"]:
-                    continue
+        def ask_agent(i, round):
+            # The replies are recorded one by one, so that an interrupted
+            # discussion resumes from the last reply received
+            return remember(journal, f"card:{title}:round:{round}:agent:{i}", lambda: ask_new_agent(i))
 
-                # Select model for current agent from pool (excluding judge model)
-                model_index = (i % len(agent_models))
-                current_model = agent_models[model_index]
-                
-                system_prompt = LINDDUN_GO_SPECIFIC_PROMPTS[i] + LINDDUN_GO_SYSTEM_PROMPT
-                user_prompt = LINDDUN_GO_USER_PROMPT(inputs, question, title, description)
+        def ask_new_agent(i):
+            # Select model for current agent from pool (excluding judge model)
+            model_index = (i % len(agent_models))
+            current_model = agent_models[model_index]
+            if ollama:
+                current_provider = "Ollama"
+            elif lmstudio:
+                current_provider = "Local LM Studio"
+            else:
+                # Get current provider for the model
+                current_provider = llms_to_use[model_index % len(llms_to_use)]
+            
+            # Only the end of the prompt depends on the card and on the agent
+            system_prompt = LINDDUN_GO_SYSTEM_PROMPT
+            user_prompt = LINDDUN_GO_USER_PROMPT(inputs, question, title, description, LINDDUN_GO_SPECIFIC_PROMPTS[i])
 
+            # Wait for a free slot, shared with the agents and judges of the other cards
+            with limiter.slot(current_provider):
                 if ollama:
                     response_content = get_response_openai(
                         clients["Ollama"],
@@ -361,7 +637,8 @@ def get_multiagent_linddun_go(keys, models, inputs, temperature, rounds, threats
                         temperature,
                         system_prompt,
                         user_prompt,
-                        ollama=True
+                        ollama=True,
+                        use_cache=use_cache
                     )
                 elif lmstudio:
                     response_content = get_response_openai(
@@ -370,18 +647,18 @@ def get_multiagent_linddun_go(keys, models, inputs, temperature, rounds, threats
                         temperature,
                         system_prompt,
                         user_prompt,
-                        lmstudio=True
+                        lmstudio=True,
+                        use_cache=use_cache
                     )
                 else:
-                    # Get current provider for the model
-                    current_provider = llms_to_use[model_index % len(llms_to_use)]
                     if current_provider == "OpenAI API":
                         response_content = get_response_openai(
                             clients["OpenAI API"],
                             current_model,
                             temperature,
                             system_prompt,
-                            user_prompt
+                            user_prompt,
+                            use_cache=use_cache
                         )
                     elif current_provider == "Mistral API":
                         response_content = get_response_mistral(
@@ -389,37 +666,56 @@ def get_multiagent_linddun_go(keys, models, inputs, temperature, rounds, threats
                             current_model,
                             temperature,
                             system_prompt,
-                            user_prompt
+                            user_prompt,
+                            use_cache=use_cache
                         )
                     elif current_provider == "Google AI API":
                         response_content = get_response_google(
                             clients["Google AI API"],
                             temperature,
                             system_prompt,
-                            user_prompt
+                            user_prompt,
+                            use_cache=use_cache
                         )
 
+            return response_content
+
+        for round in range(rounds):
+            # First round: all agents participate
+            # Subsequent rounds: only competent agents
+            agents_this_round = list(range(6)) if round == 0 else list(card["competent_agents"])
+
+            # The agents of the same round do not read each other's replies,
+            # so they are queried together. The round ends when all of them
+            # have replied, before the next round or the judge starts.
+            replies = map_in_order(lambda i: ask_agent(i, round), agents_this_round, max_workers)
+            for i, response_content in zip(agents_this_round, replies):
                 previous_analysis[i] = response_content
 
         # Judge phase - use dedicated judge model
-        if ollama:
-            final_verdict = judge(
-                keys,
-                {"ollama_model": judge_model},
-                previous_analysis,
-                temperature,
-                ollama=True
-            )
-        elif lmstudio:
-            final_verdict = judge(
-                keys,
-                {"lmstudio_model": judge_model},
-                previous_analysis,
-                temperature,
-                lmstudio=True
-            )
-        else:
-            final_verdict = judge(keys, models, previous_analysis, temperature)
+        if journal is not None:
+            journal.check_cancelled()
+        with limiter.slot(judge_slot):
+            if ollama:
+                final_verdict = judge(
+                    keys,
+                    {"ollama_model": judge_model},
+                    previous_analysis,
+                    temperature,
+                    ollama=True,
+                    use_cache=use_cache
+                )
+            elif lmstudio:
+                final_verdict = judge(
+                    keys,
+                    {"lmstudio_model": judge_model},
+                    previous_analysis,
+                    temperature,
+                    lmstudio=True,
+                    use_cache=use_cache
+                )
+            else:
+                final_verdict = judge(keys, models, previous_analysis, temperature, use_cache=use_cache)
 
         final_verdict.update({
             "question": question,
@@ -428,11 +724,47 @@ def get_multiagent_linddun_go(keys, models, inputs, temperature, rounds, threats
             "threat_type": type
         })
 
-        threats.append(final_verdict)
+        return final_verdict
+
+    # Each card goes through its own rounds and judge independently of the
+    # others, so several cards are discussed at the same time. The requests of
+    # all the cards share the same limiter.
+    if cards_in_flight is None:
+        cards_in_flight = CONCURRENCY_CONFIG["cards_in_flight"]
+    yield from iter_pending_cards(discuss_card, deck, cards_in_flight, journal)
 
-    return threats
 
-def get_response_openai(client, model, temperature, system_prompt, user_prompt, lmstudio=False, ollama=False):
+def get_multiagent_linddun_go(keys, models, inputs, temperature, rounds, threats_to_analyze, llms_to_use, lmstudio=False, ollama=False, max_workers=None, cards_in_flight=None, use_cache=None):
+    """
+    This function generates a multi-agent LINDDUN threat model from the prompt.
+    
+    Args:
+        keys (dict): The dictionary of API keys for the different LLM providers.
+        models (dict): The dictionary of models for the different LLM providers.
+        inputs (dict): The inputs to the model, the same as the one in the Application Info tab.
+        temperature (float): The temperature to use for the model.
+        rounds (int): The number of rounds to run the simulation for.
+        threats_to_analyze (int): The number of threats to analyze.
+        llms_to_use (list): The list of LLM providers to use.
+        lmstudio (bool): Whether to use LM Studio.
+        ollama (bool): Whether to use Ollama.
+        max_workers (int): The maximum number of requests in flight overall. If None, the default from the configuration is used.
+        cards_in_flight (int): The maximum number of cards discussed at the same time. If None, the default from the configuration is used.
+        use_cache (bool): Whether to use the response cache, see should_use_cache in llms/cache.py.
+    
+    Returns:
+        list: The list of threats in the threat model, in the same order as the deck. Each threat is a dictionary with the following keys
+            - question: string. The questions on the card, asked to the LLM to elicit the threat.
+            - threat_title: string. The title of the threat.
+            - threat_description: string. The description of the threat.
+            - threat_type: int. The LINDDUN category of the threat, from 1 to 7.
+            - reply: boolean. Whether the threat was deemed present or not in the application by the LLM.
+            - reason: string. The reason for the detection or non-detection of the threat.
+    """
+    results = iter_multiagent_linddun_go(keys, models, inputs, temperature, rounds, threats_to_analyze, llms_to_use, lmstudio, ollama, max_workers, cards_in_flight, use_cache=use_cache)
+    return [threat for index, threat in sorted(results, key=lambda result: result[0])]
+
+def get_response_openai(client, model, temperature, system_prompt, user_prompt, lmstudio=False, ollama=False, use_cache=None):
     """
     This function generates a response from the OpenAI API, LM Studio, or Ollama.
 
@@ -444,6 +776,7 @@ def get_response_openai(client, model, temperature, system_prompt, user_prompt,
         user_prompt (str): The user prompt to use.
         lmstudio (bool): Whether to use LM Studio format.
         ollama (bool): Whether to use Ollama format.
+        use_cache (bool): Whether to use the response cache, see should_use_cache in llms/cache.py.
     
     Returns:
         dict: The response with the following keys:
@@ -461,40 +794,48 @@ def get_response_openai(client, model, temperature, system_prompt, user_prompt,
         },
     ]
 
-    if model in ["gpt-4o", "gpt-4o-mini"] or lmstudio:
-        # Use parse format for GPT4-organic and LM Studio
-        class Threat(BaseModel):
-            reason: str
-            reply: bool
-        response = client.beta.chat.completions.parse(
-            model=model,
-            response_format=Threat,
-            temperature=temperature,
-            messages=messages,
-            max_tokens=4096,
-        )
-    elif ollama:
-        # Use regular completion for Ollama
-        response = client.chat.completions.create(
-            model=model,
-            messages=messages,
-            response_format={"type": "json_object"},
-            temperature=temperature,
-            max_tokens=4096,
-        )
-    else:
-        # Standard OpenAI format
-        response = client.chat.completions.create(
-            model=model,
-            messages=messages,
-            response_format={"type": "json_object"},
-            temperature=temperature,
-            max_tokens=4096,
-        )
+    def request():
+        if model in ["gpt-4o", "gpt-4o-mini"] or lmstudio:
+            # Use parse format for GPT4-organic and LM Studio
+            class Threat(BaseModel):
+                reason: str
+                reply: bool
+            response = client.beta.chat.completions.parse(
+                model=model,
+                response_format=Threat,
+                temperature=temperature,
+                messages=messages,
+                max_tokens=4096,
+            )
+        elif ollama:
+            # Use regular completion for Ollama
+            response = client.chat.completions.create(
+                model=model,
+                messages=messages,
+                response_format={"type": "json_object"},
+                temperature=temperature,
+                max_tokens=4096,
+            )
+        else:
+            # Standard OpenAI format
+            response = client.chat.completions.create(
+                model=model,
+                messages=messages,
+                response_format={"type": "json_object"},
+                temperature=temperature,
+                max_tokens=4096,
+            )
+        return checked_text(response.choices[0].message.content, response.choices[0].finish_reason)
 
-    return json.loads(response.choices[0].message.content)
+    if ollama:
+        provider = "Ollama"
+    elif lmstudio:
+        provider = "Local LM Studio"
+    else:
+        provider = "OpenAI API"
+    return json.loads(cached_completion(provider, model, messages, temperature, request, schema="reason/reply", use_cache=use_cache))
 
-def get_response_mistral(client, model, temperature, system_prompt, user_prompt):
+def get_response_mistral(client, model, temperature, system_prompt, user_prompt, use_cache=None):
     """
     This function generates a response from the Mistral API.
 
@@ -504,26 +845,31 @@ def get_response_mistral(client, model, temperature, system_prompt, user_prompt)
         temperature (float): The temperature to use for the model.
         system_prompt (str): The system prompt to use.
         user_prompt (str): The user prompt to use.
+        use_cache (bool): Whether to use the response cache, see should_use_cache in llms/cache.py.
     
     Returns:
         dict: The response from the Mistral API, with the following keys:
             - reply: boolean. Whether the threat was deemed present or not in the application by the LLM.
             - reason: string. The reason for the detection or non-detection of the threat.
     """
-    response = client.chat(
-            model=model,
-            response_format={"type": "json_object"},
-            messages=[
-                {"role":"system", "content":system_prompt},
-                {"role":"user", "content":user_prompt},
-            ],
-            max_tokens=4096,
-            temperature=temperature,
-    )
+    messages = [
+        {"role":"system", "content":system_prompt},
+        {"role":"user", "content":user_prompt},
+    ]
+
+    def request():
+        response = client.chat(
+                model=model,
+                response_format={"type": "json_object"},
+                messages=messages,
+                max_tokens=4096,
+                temperature=temperature,
+        )
+        return checked_text(response.choices[0].message.content, response.choices[0].finish_reason)
 
-    return json.loads(response.choices[0].message.content)
+    return json.loads(cached_completion("Mistral API", model, messages, temperature, request, use_cache=use_cache, validate=json.loads))
 
-def get_response_google(client, temperature, system_prompt, user_prompt):
+def get_response_google(client, temperature, system_prompt, user_prompt, use_cache=None):
     """
     This function generates a response from the Google AI API.
     
@@ -532,6 +878,7 @@ def get_response_google(client, temperature, system_prompt, user_prompt):
         temperature (float): The temperature to use for the model.
         system_prompt (str): The system prompt to use.
         user_prompt (str): The user prompt to use.
+        use_cache (bool): Whether to use the response cache, see should_use_cache in llms/cache.py.
     
     Returns:
         dict: The response from the Google AI API, with the following keys:
@@ -548,7 +895,7 @@ def get_response_google(client, temperature, system_prompt, user_prompt):
             'parts': [{'text': user_prompt}],
         }
     ]
-    try:
+    def request():
         response = client.generate_content(
             messages,
             generation_config=genai.types.GenerationConfig(
@@ -560,7 +907,13 @@ def get_response_google(client, temperature, system_prompt, user_prompt):
         
         # Check if response has content
         if response and response.candidates and response.candidates[0].content and response.candidates[0].content.parts:
-            return json.loads(response.candidates[0].content.parts[0].text)
+            return checked_text(response.candidates[0].content.parts[0].text, response.candidates[0].finish_reason)
+        return None
+
+    try:
+        response_text = cached_completion("Google AI API", client.model_name, messages, temperature, request, use_cache=use_cache, validate=json.loads)
+        if response_text:
+            return json.loads(response_text)
         else:
             # Return a default response if no valid content is found
             return {"reply": False, "reason": "Google API response was empty or invalid."} 
@@ -569,7 +922,7 @@ def get_response_google(client, temperature, system_prompt, user_prompt):
         print(f"Error with Google Gemini API: {str(e)}")
         return {"reply": False, "reason": f"Error processing with Google API: {str(e)}"}
 
-def judge(keys, models, previous_analysis, temperature, judge_provider=None, lmstudio=False, ollama=False):
+def judge(keys, models, previous_analysis, temperature, judge_provider=None, lmstudio=False, ollama=False, use_cache=None):
     """
     This function judges the final verdict based on the previous analysis.
 
@@ -581,6 +934,7 @@ def judge(keys, models, previous_analysis, temperature, judge_provider=None, lms
         judge_provider (str): The provider to use as judge (OpenAI API, Google AI API, Mistral API).
         lmstudio (bool): Whether to use LM Studio.
         ollama (bool): Whether to use Ollama.
+        use_cache (bool): Whether to use the response cache, see should_use_cache in llms/cache.py.
     
     Returns:
         dict: The final verdict, with the following keys:
@@ -588,22 +942,21 @@ def judge(keys, models, previous_analysis, temperature, judge_provider=None, lms
             - reason: string. The reason for the detection or non-detection of the threat.
     """
     if ollama:
-        client = OpenAI(base_url="http://localhost:11434/v1", api_key="ollama")
+        client = get_openai_client("ollama", "http://localhost:11434/v1")
         model_name = models.get("ollama_model")  # Get the Judge model
     elif lmstudio:
-        client = OpenAI(base_url="http://localhost:1234/v1", api_key="lm-studio")
+        client = get_openai_client("lm-studio", "http://localhost:1234/v1")
         model_name = models.get("lmstudio_model")  # Get the Judge model
     else:
         # Use specified judge provider
         if judge_provider == "Google AI API":
-            genai.configure(api_key=keys["google_api_key"])
-            client = genai.GenerativeModel(models["google_model"])
+            client = get_google_model(keys["google_api_key"], models["google_model"])
             model_name = models.get("google_model")
         elif judge_provider == "Mistral API":
-            client = OpenAI(api_key=keys["mistral_api_key"])
+            client = get_openai_client(keys["mistral_api_key"])
             model_name = models.get("mistral_model")
         else:  # Default to OpenAI
-            client = OpenAI(api_key=keys["openai_api_key"])
+            client = get_openai_client(keys["openai_api_key"])
             model_name = models.get("openai_model")
 
     messages=[
@@ -617,18 +970,27 @@ def judge(keys, models, previous_analysis, temperature, judge_provider=None, lms
         },
     ]
 
+    if ollama:
+        provider = "Ollama"
+    elif lmstudio:
+        provider = "Local LM Studio"
+    else:
+        provider = judge_provider or "OpenAI API"
+
     if model_name in ["gpt-4o", "gpt-4o-mini"] or lmstudio:
         class Threat(BaseModel):
             reason: str
             reply: bool
-        response = client.beta.chat.completions.parse(
-            model=model_name,
-            response_format=Threat,
-            temperature=temperature,
-            messages=messages,
-            max_tokens=4096,
-        )
-        response_content = json.loads(response.choices[0].message.content)
+        def request():
+            response = client.beta.chat.completions.parse(
+                model=model_name,
+                response_format=Threat,
+                temperature=temperature,
+                messages=messages,
+                max_tokens=4096,
+            )
+            return checked_text(response.choices[0].message.content, response.choices[0].finish_reason)
+        response_content = json.loads(cached_completion(provider, model_name, messages, temperature, request, schema="reason/reply", use_cache=use_cache))
     elif judge_provider == "Google AI API":
         google_messages = [
             {
@@ -640,7 +1002,7 @@ def judge(keys, models, previous_analysis, temperature, judge_provider=None, lms
                 'parts': [{'text': LINDDUN_GO_PREVIOUS_ANALYSIS_PROMPT(previous_analysis)}],
             }
         ]
-        try:
+        def request():
             response = client.generate_content(
                 google_messages,
                 generation_config=genai.types.GenerationConfig(
@@ -650,19 +1012,26 @@ def judge(keys, models, previous_analysis, temperature, judge_provider=None, lms
                 ),
             )
             if response and response.candidates and response.candidates[0].content and response.candidates[0].content.parts:
-                response_content = json.loads(response.candidates[0].content.parts[0].text)
+                return checked_text(response.candidates[0].content.parts[0].text, response.candidates[0].finish_reason)
+            return None
+        try:
+            response_text = cached_completion(provider, model_name, google_messages, temperature, request, use_cache=use_cache, validate=json.loads)
+            if response_text:
+                response_content = json.loads(response_text)
             else:
                 response_content = {"reply": False, "reason": "Google API judge response was empty or invalid."}
         except Exception as e:
             print(f"Error with Google Gemini API in judge: {str(e)}")
             response_content = {"reply": False, "reason": f"Error processing with Google API judge: {str(e)}"}
     else:
-        response = client.chat.completions.create(
-            model=model_name,
-            messages=messages,
-            response_format={"type": "json_object"},
-            temperature=temperature,
-            max_tokens=4096,
-        )
-        response_content = json.loads(response.choices[0].message.content)
+        def request():
+            response = client.chat.completions.create(
+                model=model_name,
+                messages=messages,
+                response_format={"type": "json_object"},
+                temperature=temperature,
+                max_tokens=4096,
+            )
+            return checked_text(response.choices[0].message.content, response.choices[0].finish_reason)
+        response_content = json.loads(cached_completion(provider, model_name, messages, temperature, request, schema="json_object", use_cache=use_cache))
     return response_content
\ No newline at end of file
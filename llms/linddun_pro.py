@@ -13,9 +13,16 @@
 # limitations under the License.
 import streamlit as st
 import json
+import os
+import threading
 import requests
+from functools import lru_cache
 from openai import OpenAI
-from llms.config import OLLAMA_CONFIG, LMSTUDIO_CONFIG
+from llms.config import OLLAMA_CONFIG, LMSTUDIO_CONFIG, THREAT_TREES_CONFIG
+from llms.concurrency import iter_as_completed, RequestLimiter
+from llms.journal import remember
+from llms.cache import cached_completion, checked_text, contains_json
+from llms.clients import get_provider_client, get_mistral_client, get_google_model, get_session
 from misc.utils import (
     match_category_number,
     match_number_color,
@@ -24,9 +31,24 @@ from llms.prompts import (
     LINDDUN_PRO_SYSTEM_PROMPT,
     LINDDUN_PRO_USER_PROMPT,
 )
-from pydantic import BaseModel
+from pydantic import create_model
 from mistralai import Mistral, UserMessage
 import google.generativeai as genai
+
+# Version of the LINDDUN threat trees used by LINDDUN PRO. The trees are read
+# from the pinned copy in the misc folder, found from the location of this
+# file so that it does not depend on the working directory.
+THREAT_TREES_VERSION = "v240118"
+THREAT_TREES_URL = f"https://downloads.linddun.org/linddun-trees/structured/json/{THREAT_TREES_VERSION}/trees.json"
+THREAT_TREES_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "misc", f"trees_{THREAT_TREES_VERSION}.json")
+# Concurrent analyses must not read or download the trees at the same time
+threat_trees_lock = threading.Lock()
+
+LINDDUN_CATEGORIES = [
+    "Linking", "Identifying", "Non-repudiation", "Detecting",
+    "Data disclosure", "Unawareness and unintervenability", "Non-compliance"
+]
+
 def linddun_pro_gen_markdown(threats):
     """
     This function generates a markdown table from the threat model data.
@@ -89,7 +111,7 @@ def linddun_pro_gen_markdown(threats):
         )
     return markdown_output
 
-def mapping_table(edge, category):
+def mapping_table(edge, category, default=(True, True, True)):
     """
     This function implements the mapping table found at https://linddun.org/instructions-for-pro/#mappingtable.
     
@@ -101,6 +123,7 @@ def mapping_table(edge, category):
             - typeto: string. The type of the entity where the data flow ends
             - trusted: bool. Whether the data flow is trusted
         category (str): The LINDDUN category to look for in the threat model, in the format "Linking", "Identifying", etc.
+        default (tuple): The value to return if the types of the edge are not in the table.
     
     Returns:
         tuple: A tuple with three booleans representing whether the source, data flow, and destination of the threat have to be considered or not.
@@ -117,10 +140,146 @@ def mapping_table(edge, category):
         if row["from"] == edge["typefrom"] and row["to"] == edge["typeto"]:
             return row[category]
     # If the edge is not found in the table, there is an error with the category. Return True for all three booleans as a fallback.
-    return (True, True, True)
+    return default
+
 
+def threat_keys(locations):
+    """
+    This function returns the keys of a LINDDUN Pro response for the locations
+    which are analyzed, such as source_id, source_title and source.
+
+    Args:
+        locations (tuple): A tuple with three booleans representing whether the source, data flow, and destination have to be considered or not.
 
-def get_linddun_pro(api_key, model, dfd, edge, category, boundaries, temperature, model_provider="OpenAI"):
+    Returns:
+        list: The keys of the enabled locations, in the order of the threat.
+    """
+    return [
+        key
+        for (location, enabled) in zip(["source", "data_flow", "destination"], locations) if enabled
+        for key in (f"{location}_id", f"{location}_title", location)
+    ]
+
+
+def fill_not_applicable(threat, locations):
+    """
+    This function fills the locations of a threat that must not be analyzed
+    according to the mapping table. The model is only asked about the other
+    locations, so these are filled locally with "Not applicable". The keys of
+    the analyzed locations that the model left out are filled with empty
+    strings, so that the threat always has all the keys.
+
+    Args:
+        threat (dict): The threat to fill, with the same keys as the one returned by get_linddun_pro. It is modified in place.
+        locations (tuple): A tuple with three booleans representing whether the source, data flow, and destination have to be considered or not.
+
+    Returns:
+        dict: The filled threat.
+    """
+    for (location, enabled) in zip(["source", "data_flow", "destination"], locations):
+        if not enabled:
+            threat[f"{location}_id"] = ""
+            threat[f"{location}_title"] = ""
+            threat[location] = "Not applicable"
+        else:
+            for key in (f"{location}_id", f"{location}_title", location):
+                threat.setdefault(key, "")
+    return threat
+
+
+def edge_signature(edge):
+    """
+    This function returns the canonical signature of a DFD edge, which is the
+    same for edges that only differ in their description.
+
+    Args:
+        edge (dict): The edge of the DFD, with the same keys as the DFD.
+
+    Returns:
+        tuple: The signature of the edge.
+    """
+    return (
+        str(edge.get("from", "")).strip(),
+        str(edge.get("typefrom", "")).strip(),
+        str(edge.get("to", "")).strip(),
+        str(edge.get("typeto", "")).strip(),
+        str(edge.get("trusted", True)).strip().lower(),
+        str(edge.get("boundary", "")).strip(),
+    )
+
+
+def group_edges(dfd):
+    """
+    This function groups the structurally identical edges of the DFD, such as
+    repeated rows of an imported CSV file, so that they are analyzed once.
+
+    Args:
+        dfd (list): The Data Flow Diagram of the application.
+
+    Returns:
+        list: The list of groups, in the order of their first edge. Each group
+            is a dictionary with the following keys:
+            - edge_nums: list. The numbers of the edges in the group.
+            - edge: dict. The edge to analyze for the group, i.e. the first edge
+              of the group with the distinct descriptions of all its edges.
+    """
+    groups = {}
+    for (edge_num, edge) in enumerate(dfd):
+        signature = edge_signature(edge)
+        if signature not in groups:
+            groups[signature] = {"edge_nums": [], "edge": dict(edge), "descriptions": []}
+        group = groups[signature]
+        group["edge_nums"].append(edge_num)
+        description = str(edge.get("description") or "").strip()
+        if description and description not in group["descriptions"]:
+            group["descriptions"].append(description)
+
+    result = []
+    for group in groups.values():
+        group["edge"]["description"] = "; ".join(group["descriptions"])
+        result.append({"edge_nums": group["edge_nums"], "edge": group["edge"]})
+    return result
+
+
+def plan_linddun_pro(dfd, categories=LINDDUN_CATEGORIES):
+    """
+    This function computes the minimal set of LLM calls needed to analyze the
+    given edges and categories with LINDDUN Pro. Structurally identical edges
+    are analyzed once, and the result is shared by all of them. The pairs for
+    which the mapping table disables the source, the data flow and the
+    destination (or which have no row in the table, such as an Entity writing
+    directly to a Data store) do not need a call, as their result is known in
+    advance. The calls are ordered by category, then by edge.
+
+    Args:
+        dfd (list): The Data Flow Diagram of the application.
+        categories (list): The LINDDUN categories to look for.
+
+    Returns:
+        tuple: A tuple (work_items, skipped). work_items is a list of
+            dictionaries with the following keys, one for each call to make:
+            - edge_nums: list. The numbers of the edges sharing the result.
+            - edge: dict. The edge to analyze, as returned by group_edges.
+            - category: string. The LINDDUN category to look for.
+            - locations: tuple. The three booleans of the mapping table.
+            skipped is a list of (edge_num, category) tuples which need no call.
+    """
+    work_items = []
+    skipped = []
+    groups = group_edges(dfd)
+    # The calls are grouped by category, since the calls of the same category
+    # share the prompt up to the threat tree and can reuse the provider cache
+    for category in categories:
+        for group in groups:
+            locations = mapping_table(group["edge"], category, default=(False, False, False))
+            if any(locations):
+                work_items.append({"edge_nums": group["edge_nums"], "edge": group["edge"], "category": category, "locations": locations})
+            else:
+                skipped.extend((edge_num, category) for edge_num in group["edge_nums"])
+    return work_items, skipped
+
+
+def get_linddun_pro(api_key, model, dfd, edge, category, boundaries, temperature, model_provider="OpenAI", use_cache=None):
     """
     This function generates a LINDDUN Pro threat model from the information provided.
     
@@ -143,6 +302,7 @@ def get_linddun_pro(api_key, model, dfd, edge, category, boundaries, temperature
             - description: string. The description of the trust boundary.
             - color: string. The color of the trust boundary.
         - temperature (float): The temperature to use for the model.
+        - use_cache (bool): Whether to use the response cache, see should_use_cache in llms/cache.py.
     
     Returns:
         - dict: The threat model for the specific edge and category. The dictionary has the following
@@ -158,18 +318,7 @@ def get_linddun_pro(api_key, model, dfd, edge, category, boundaries, temperature
             - destination: string. The description of the threat at the destination.
             - category: string. The category of the threat, in the format "Linking", "Identifying", etc.
     """
-    if model_provider == "Ollama":
-        client = OpenAI(
-            base_url=OLLAMA_CONFIG["base_url"],
-            api_key=OLLAMA_CONFIG["api_key"]
-        )
-    elif model_provider == "Local LM Studio":
-        client = OpenAI(
-            base_url=LMSTUDIO_CONFIG["base_url"],
-            api_key=LMSTUDIO_CONFIG["api_key"],
-        )
-    else:  # Default: OpenAI
-        client = OpenAI(api_key=api_key)
+    client = get_provider_client(model_provider, api_key)
 
     source, data_flow, destination = mapping_table(edge, category)
     tree = threat_tree(category)
@@ -186,34 +335,31 @@ def get_linddun_pro(api_key, model, dfd, edge, category, boundaries, temperature
 
     # Use structured parsing ONLY for OpenAI gpt-4o models
     if model_provider == "OpenAI" and model in ["gpt-4o", "gpt-4o-mini"]:
-        class Threat(BaseModel):
-            source_id: str
-            source_title: str
-            source: str
-            data_flow_id: str
-            data_flow_title: str
-            data_flow: str
-            destination_id: str
-            destination_title: str
-            destination: str
-        response = client.beta.chat.completions.parse(
-            model=model,
-            response_format=Threat,
-            temperature=temperature,
-            messages=messages,
-            max_tokens=4096,
-        )
-        threat = response.choices[0].message.parsed.dict()
+        # Only the enabled locations are part of the response
+        Threat = create_model("Threat", **{key: (str, ...) for key in threat_keys((source, data_flow, destination))})
+        def request():
+            response = client.beta.chat.completions.parse(
+                model=model,
+                response_format=Threat,
+                temperature=temperature,
+                messages=messages,
+                max_tokens=4096,
+            )
+            return checked_text(response.choices[0].message.content, response.choices[0].finish_reason)
+        # The parsed response is also available as JSON in the content, which can be cached
+        threat = json.loads(cached_completion(model_provider, model, messages, temperature, request, schema="threat", use_cache=use_cache))
     elif model_provider == "Ollama":
         # For Ollama, use JSON object response format
-        response = client.chat.completions.create(
-            model=model,
-            response_format={"type": "json_object"},
-            max_tokens=4096,
-            temperature=temperature,
-            messages=messages,
-        )
-        raw_content = response.choices[0].message.content
+        def request():
+            response = client.chat.completions.create(
+                model=model,
+                response_format={"type": "json_object"},
+                max_tokens=4096,
+                temperature=temperature,
+                messages=messages,
+            )
+            return checked_text(response.choices[0].message.content, response.choices[0].finish_reason)
+        raw_content = cached_completion(model_provider, model, messages, temperature, request, schema="json_object", use_cache=use_cache)
         print(f"Raw {model_provider} response:", raw_content)
 
         try:
@@ -233,13 +379,15 @@ def get_linddun_pro(api_key, model, dfd, edge, category, boundaries, temperature
             }
     else:
         # For LM Studio and other non-OpenAI models, don't use response_format
-        response = client.chat.completions.create(
-            model=model,
-            max_tokens=4096,
-            temperature=temperature,
-            messages=messages,
-        )
-        raw_content = response.choices[0].message.content
+        def request():
+            response = client.chat.completions.create(
+                model=model,
+                max_tokens=4096,
+                temperature=temperature,
+                messages=messages,
+            )
+            return checked_text(response.choices[0].message.content, response.choices[0].finish_reason)
+        raw_content = cached_completion(model_provider, model, messages, temperature, request, use_cache=use_cache, validate=contains_json)
         print(f"Raw {model_provider} response:", raw_content)
 
         try:
@@ -266,15 +414,55 @@ def get_linddun_pro(api_key, model, dfd, edge, category, boundaries, temperature
                 "destination": ""
             }
 
+    # The locations which do not apply are filled locally, they are not asked to the model
+    threat = fill_not_applicable(threat, (source, data_flow, destination))
     # Add category to the threat
     threat["category"] = category
     
     return threat
 
 
+@lru_cache(maxsize=None)
+def get_threat_trees(file=THREAT_TREES_FILE, url=THREAT_TREES_URL):
+    """
+    This function returns the full LINDDUN threat trees, for all categories,
+    read from the pinned copy in the misc folder, so that LINDDUN PRO works
+    offline. If the copy is missing, the trees are downloaded from the LINDDUN
+    website only if THREAT_TREES_CONFIG allows it, and kept in memory for the
+    rest of the process. The copy is never written.
+
+    Args:
+        file (str): The path to the pinned copy of the threat trees.
+        url (str): The URL to download the threat trees from, if the copy is missing and downloads are allowed.
+
+    Returns:
+        list: The list of full threat trees, one for each LINDDUN category, as published by LINDDUN.
+
+    Raises:
+        FileNotFoundError: If the copy is missing and downloads are not allowed.
+    """
+    with threat_trees_lock:
+        try:
+            with open(file, "r", encoding="utf-8") as trees_file:
+                return json.load(trees_file)
+        except FileNotFoundError:
+            if not THREAT_TREES_CONFIG["download"]:
+                raise FileNotFoundError(
+                    f"The LINDDUN threat trees {THREAT_TREES_VERSION} are missing from {file}. "
+                    f"Download them from {url} into that file, or set \"download\" in THREAT_TREES_CONFIG to download them at runtime."
+                )
+            print(f"{file} not found, downloading the LINDDUN threat trees from {url}")
+
+        response = get_session().get(url, timeout=30)
+        response.raise_for_status()
+        return response.json()
+
+
+@lru_cache(maxsize=None)
 def threat_tree(category):
     """
     This function returns the LINDDUN threat tree for the given category, to be used in the LINDDUN Pro threat model.
+    The pruned tree of each category is built only once and then reused for the whole process.
     
     Args:
         category (str): The category of the threat, such as "Linking".
@@ -286,7 +474,7 @@ def threat_tree(category):
             - description: string. The description of the threat category.
             - children: list. The list of children of the threat category. Each child is a dictionary with the same keys as the parent.
     """
-    response = requests.get("https://downloads.linddun.org/linddun-trees/structured/json/v240118/trees.json").json()
+    response = get_threat_trees()
 
     full_tree = None
     for item in response:
@@ -327,7 +515,7 @@ def build_tree(tree, full_tree):
     
     return tree
 
-def get_linddun_pro_mistral(api_key, model, dfd, edge, category, boundaries, temperature):
+def get_linddun_pro_mistral(api_key, model, dfd, edge, category, boundaries, temperature, use_cache=None):
     """
     This function generates a LINDDUN Pro threat model using Mistral AI.
     
@@ -339,29 +527,32 @@ def get_linddun_pro_mistral(api_key, model, dfd, edge, category, boundaries, tem
         - category (str): The LINDDUN category to look for in the threat model.
         - boundaries (dict): The trust boundaries of the application.
         - temperature (float): The temperature to use for the model.
+        - use_cache (bool): Whether to use the response cache, see should_use_cache in llms/cache.py.
     
     Returns:
         - dict: The threat model for the specific edge and category.
     """
 
-    client = Mistral(api_key=api_key)
+    client = get_mistral_client(api_key)
     source, data_flow, destination = mapping_table(edge, category)
     tree = threat_tree(category)
     
     # Combine system and user prompts for Mistral
     combined_prompt = f"{LINDDUN_PRO_SYSTEM_PROMPT}\n\n{LINDDUN_PRO_USER_PROMPT(dfd, edge, category, source, data_flow, destination, boundaries, tree)}"
     
-    response = client.chat.complete(
-        model=model,
-        response_format={"type": "json_object"},
-        messages=[
-            UserMessage(content=combined_prompt)
-        ],
-        temperature=temperature
-    )
+    def request():
+        response = client.chat.complete(
+            model=model,
+            response_format={"type": "json_object"},
+            messages=[
+                UserMessage(content=combined_prompt)
+            ],
+            temperature=temperature
+        )
+        return checked_text(response.choices[0].message.content, response.choices[0].finish_reason)
     
     # Extract JSON from response with robust parsing
-    response_text = response.choices[0].message.content
+    response_text = cached_completion("Mistral API", model, combined_prompt, temperature, request, use_cache=use_cache, validate=contains_json)
     
     try:
         # Try to find JSON object boundaries
@@ -389,12 +580,14 @@ def get_linddun_pro_mistral(api_key, model, dfd, edge, category, boundaries, tem
             "destination": ""
         }
     
+    # The locations which do not apply are filled locally, they are not asked to the model
+    threat = fill_not_applicable(threat, (source, data_flow, destination))
     # Add category to the threat
     threat["category"] = category
     
     return threat
 
-def get_linddun_pro_google(api_key, model, dfd, edge, category, boundaries, temperature):
+def get_linddun_pro_google(api_key, model, dfd, edge, category, boundaries, temperature, use_cache=None):
     """
     This function generates a LINDDUN Pro threat model using Google AI.
     
@@ -406,35 +599,41 @@ def get_linddun_pro_google(api_key, model, dfd, edge, category, boundaries, temp
         - category (str): The LINDDUN category to look for in the threat model.
         - boundaries (dict): The trust boundaries of the application.
         - temperature (float): The temperature to use for the model.
+        - use_cache (bool): Whether to use the response cache, see should_use_cache in llms/cache.py.
     
     Returns:
         - dict: The threat model for the specific edge and category.
     """
+    source, data_flow, destination = mapping_table(edge, category)
     try:
-        genai.configure(api_key=api_key)
-        google_model = genai.GenerativeModel(
+        google_model = get_google_model(
+            api_key,
             model, 
             generation_config={"response_mime_type": "application/json"}
         )
         
-        source, data_flow, destination = mapping_table(edge, category)
         tree = threat_tree(category)
         
         # Combine system and user prompts for Google AI
         combined_prompt = f"{LINDDUN_PRO_SYSTEM_PROMPT}\n\n{LINDDUN_PRO_USER_PROMPT(dfd, edge, category, source, data_flow, destination, boundaries, tree)}"
         
-        response = google_model.generate_content(
-            combined_prompt,  
-            generation_config=genai.types.GenerationConfig(
-                temperature=temperature,
-                response_mime_type="application/json",
-                max_output_tokens=4096,
+        def request():
+            response = google_model.generate_content(
+                combined_prompt,  
+                generation_config=genai.types.GenerationConfig(
+                    temperature=temperature,
+                    response_mime_type="application/json",
+                    max_output_tokens=4096,
+                )
             )
-        )
+            if response.candidates and len(response.candidates) > 0:
+                return checked_text(response.candidates[0].content.parts[0].text, response.candidates[0].finish_reason)
+            return None
+
+        json_text = cached_completion("Google AI API", model, combined_prompt, temperature, request, use_cache=use_cache, validate=contains_json)
 
         # Handle the response
-        if response.candidates and len(response.candidates) > 0:
-            json_text = response.candidates[0].content.parts[0].text
+        if json_text:
             
             # Extract JSON from response with robust parsing
             try:
@@ -480,7 +679,91 @@ def get_linddun_pro_google(api_key, model, dfd, edge, category, boundaries, temp
             "destination": ""
         }
     
+    # The locations which do not apply are filled locally, they are not asked to the model
+    threat = fill_not_applicable(threat, (source, data_flow, destination))
     # Add category to the threat
     threat["category"] = category
     
-    return threat
\ No newline at end of file
+    return threat
+
+
+def get_linddun_pro_threat(provider, api_key, model, dfd, edge, category, boundaries, temperature, use_cache=None):
+    """
+    This function generates a LINDDUN Pro threat model for an edge and a
+    category, with the function appropriate for the provider.
+
+    Args:
+        - provider (str): The provider to use. One of "OpenAI API", "Google AI API", "Mistral API", "Ollama", or "Local LM Studio".
+        - api_key (str): The API key for the provider.
+        - model (str): The model to use.
+        - dfd (list): The Data Flow Diagram of the application.
+        - edge (dict): The specific edge of the DFD to find threats for.
+        - category (str): The LINDDUN category to look for in the threat model.
+        - boundaries (dict): The trust boundaries of the application.
+        - temperature (float): The temperature to use for the model.
+        - use_cache (bool): Whether to use the response cache, see should_use_cache in llms/cache.py.
+
+    Returns:
+        - dict: The threat model for the specific edge and category, with the same keys as the one returned by get_linddun_pro.
+    """
+    if provider == "Mistral API":
+        return get_linddun_pro_mistral(api_key, model, dfd, edge, category, boundaries, temperature, use_cache)
+    elif provider == "Google AI API":
+        return get_linddun_pro_google(api_key, model, dfd, edge, category, boundaries, temperature, use_cache)
+    else:  # OpenAI, Ollama, or LM Studio
+        return get_linddun_pro(api_key, model, dfd, edge, category, boundaries, temperature, provider, use_cache)
+
+
+def iter_linddun_pro_full(provider, api_key, model, dfd, boundaries, temperature, categories=LINDDUN_CATEGORIES, max_workers=None, journal=None, use_cache=None):
+    """
+    This function runs the LINDDUN Pro threat model for every edge of the DFD
+    and every category, with the calls running in parallel under the global
+    and per-provider limits. Only the calls computed by plan_linddun_pro are
+    made, the other pairs are filled deterministically. The threats are
+    yielded as soon as each call finishes, so that they can be stored and
+    shown while the others are still running. A failing call does not stop
+    the analysis.
+
+    Args:
+        - provider (str): The provider to use. One of "OpenAI API", "Google AI API", "Mistral API", "Ollama", or "Local LM Studio".
+        - api_key (str): The API key for the provider.
+        - model (str): The model to use.
+        - dfd (list): The Data Flow Diagram of the application.
+        - boundaries (dict): The trust boundaries of the application.
+        - temperature (float): The temperature to use for the model.
+        - categories (list): The LINDDUN categories to look for, all of them by default.
+        - max_workers (int): The maximum number of parallel requests. If None, the default from the configuration is used.
+        - journal (RunJournal): The journal of the run, recording each edge-category call, to resume the run if it has been interrupted. If None, nothing is recorded.
+        - use_cache (bool): Whether to use the response cache, see should_use_cache in llms/cache.py.
+
+    Yields:
+        - tuple: A tuple (edge_num, category, threat, error). threat is the
+            dictionary returned by get_linddun_pro_threat, with the "edge" key
+            added, or None if the call failed with the exception error.
+    """
+    work_items, skipped = plan_linddun_pro(dfd, categories)
+
+    # The pairs that need no call are filled right away
+    for (edge_num, category) in skipped:
+        threat = fill_not_applicable({"category": category}, (False, False, False))
+        threat["edge"] = dfd[edge_num]
+        yield edge_num, category, threat, None
+
+    limiter = RequestLimiter(max_workers)
+
+    def request(item):
+        with limiter.slot(provider):
+            return get_linddun_pro_threat(provider, api_key, model, dfd, item["edge"], item["category"], boundaries, temperature, use_cache)
+
+    def analyze(item):
+        threat = remember(journal, f"edge:{item['edge_nums'][0]}:{item['category']}", lambda: request(item))
+        threat["category"] = item["category"]
+        return threat
+
+    for index, threat, error in iter_as_completed(analyze, work_items, limiter.max_workers):
+        # The result is shared by all the identical edges of the group
+        for edge_num in work_items[index]["edge_nums"]:
+            if threat is None:
+                yield edge_num, work_items[index]["category"], None, error
+            else:
+                yield edge_num, work_items[index]["category"], dict(threat, edge=dfd[edge_num]), None
@@ -11,6 +11,8 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+from misc.dfd_serializer import serialize_dfd, serialize_boundaries
+
 LINDDUN_GO_SPECIFIC_PROMPTS = [
     """
 You are a cyber security expert specialized in privacy with more than 10 years
@@ -106,57 +108,69 @@ This is the previous analysis from your team:
 {f"The Chief Information Security Officer thinks the threat is {'present' if previous_analysis[5]['reply'] else 'not present'} because {previous_analysis[5]['reason']}." if previous_analysis[5] else ""}
 """
 
-def LINDDUN_GO_USER_PROMPT(inputs, question, title, description):
-	if not inputs["dfd_only"]:
+def DFD_DESCRIPTION_PROMPT(dfd, boundaries):
+	return f"""The DFD is described by a table of nodes, each with an id, a name and a
+type (Entity, Process, or Data store), and a table of edges. Each edge is a data
+flow from the "from" node to the "to" node, referenced by their ids. "trusted"
+indicates whether the edge's data flow is trusted. "boundary" is the id of the
+trust boundary the source belongs to. "description" describes the data flow.
+This is the DFD provided:
+{serialize_dfd(dfd)}
 
-		prompt =  f"""
+And these are the trust boundaries:
+{serialize_boundaries(boundaries)}"""
 
+def APPLICATION_CONTEXT_PROMPT(inputs):
+	"""
+	Description of the application shared by all the requests of an analysis.
+	It only depends on the inputs, so it is kept at the beginning of the
+	prompts: requests sharing it also share a long, byte-identical prefix,
+	which providers and local servers can cache.
+	"""
+	if not inputs["dfd_only"]:
+		prompt = f"""
+'''
 APPLICATION TYPE: {inputs["app_type"]}
 TYPES OF DATA: {inputs["types_of_data"]}
 APPLICATION DESCRIPTION: {inputs["app_description"]}
 {f'''
 The user has also provided a Data Flow Diagram to describe the application.
-The DFD is described as a list of edges, connecting the "from" node to the
-"to" node. "typefrom" and "typeto" describe the type of the node, which can be
-an Entity, Process, or Data store. "trusted" indicates whether the edge's data
-flow is trusted. "boundary" indicates the boundary id of the trust boundary the
-source belongs to. "description" describes the data flow. This is the DFD
-provided:
-{inputs["dfd"]}
-
-And this is the dictionary containing the trust boundaries:
-each boundary has "id", "name", "description", and "color" keys.
-{inputs["boundaries"]}
+{DFD_DESCRIPTION_PROMPT(inputs["dfd"], inputs["boundaries"])}
+
 ''' if inputs["use_dfd"] else ""}
 
-DATABASE_SCHEMA: {inputs["database"]}
+DATABASE SCHEMA: {inputs["database"]}
 DATA POLICY: {inputs["data_policy"]}
 USER DATA CONTROL: {inputs["user_data_control"]}
-QUESTIONS: {question}
-THREAT_TITLE: {title}
-THREAT_DESCRIPTION: {description}
 '''
-	"""
+"""
 	else:
 		prompt = f"""
 '''
 The user has provided only a Data Flow Diagram to describe the application.
-The DFD is described as a list of edges, connecting the "from" node to the
-"to" node. "typefrom" and "typeto" describe the type of the node, which can be
-an Entity, Process, or Data store. "trusted" indicates whether the edge's data
-flow is trusted. "boundary" indicates the boundary id of the trust boundary the
-source belongs to. "description" describes the data flow. This is the DFD provided:
-{inputs["dfd"]}
-
-And this is the dictionary containing the trust boundaries:
-each boundary has "id", "name", "description", and "color" keys.
-{inputs["boundaries"]}
+{DFD_DESCRIPTION_PROMPT(inputs["dfd"], inputs["boundaries"])}
+'''
+"""
+	return prompt
 
+def LINDDUN_GO_PERSONA_PROMPT(persona):
+	return f"""
+This is the expert you are, and from whose point of view you have to answer:
+{persona}"""
+
+def LINDDUN_GO_USER_PROMPT(inputs, question, title, description, persona=None):
+	# The application comes first and the card after it, so that all the
+	# cards and agents of an analysis share the same prefix. The persona of
+	# the agent is the last part.
+	prompt = APPLICATION_CONTEXT_PROMPT(inputs) + f"""
+'''
 QUESTIONS: {question}
 THREAT_TITLE: {title}
 THREAT_DESCRIPTION: {description}
 '''
-	"""
+"""
+	if persona:
+		prompt += LINDDUN_GO_PERSONA_PROMPT(persona)
 	return prompt
 
 LINDDUN_GO_SYSTEM_PROMPT = """
@@ -217,6 +231,71 @@ THREAT_TITLE: the threat title
 THREAT_DESCRIPTION: the threat description
 '''
 
+The application and the threat are followed by the description of the expert
+you are: answer from the point of view of that expert.
+"""
+
+def LINDDUN_GO_PACKED_USER_PROMPT(inputs, cards, persona=None):
+	cards_prompt = "\n".join(f"""
+THREAT_TITLE: {card["title"]}
+THREAT_DESCRIPTION: {card["description"]}
+QUESTIONS: {chr(10).join(card["questions"])}
+""" for card in cards)
+	prompt = APPLICATION_CONTEXT_PROMPT(inputs) + f"""
+These are the threats to analyze, enclosed in triple quotes:
+'''
+{cards_prompt}
+'''
+"""
+	if persona:
+		prompt += LINDDUN_GO_PERSONA_PROMPT(persona)
+	return prompt
+
+LINDDUN_GO_PACKED_SYSTEM_PROMPT = """
+You will be given an application description and several threats, each with
+its title, description and the questions associated with it. You have to
+analyze each threat independently, answering its questions to understand if
+the threat is present in the application or not.
+
+When providing the answer, you MUST reply with a JSON object with the following
+structure, with exactly one element for each threat, in the same order:
+{
+    "threats": [
+        {
+            "title": <string>,
+            "reason": <string>,
+            "reply": <boolean>
+        },
+        /// other threats
+    ]
+}
+
+The "title" field MUST be the THREAT_TITLE of the threat, copied exactly.
+When the answer to the questions is positive or indicates the presence of the
+threat, set the "reply" field to true. If the answer is negative or indicates
+the absence of the threat, set the "reply" field to false. The "reason" field
+should contain a string explaining extensively why the threat is present or
+not, and some concrete examples of how it could be exploited.
+BE VERY CRITICAL AND THOROUGH IN YOUR ANALYSIS: do not assume the threat is
+always present. ONLY set the "reply" field to true if you are mostly sure the
+threat is applicable to the system.
+Ensure that each reason is VERY SPECIFIC to the application description and the
+questions of that threat, referring to both of them in your response and
+tailoring it accordingly.
+
+The input is enclosed in triple quotes. The application is described with the
+same format as for a single threat: APPLICATION TYPE, TYPES OF DATA,
+APPLICATION DESCRIPTION, DATABASE SCHEMA, DATA POLICY and USER DATA CONTROL
+(or only a Data Flow Diagram). Then, each threat is described as follows:
+
+'''
+THREAT_TITLE: the threat title
+THREAT_DESCRIPTION: the threat description
+QUESTIONS: the questions associated with the threat, which you need to answer to understand if the threat is present or not
+'''
+
+The threats are followed by the description of the expert you are: answer from
+the point of view of that expert.
 """
 
 LINDDUN_GO_JUDGE_PROMPT="""
@@ -364,51 +443,7 @@ Example of expected JSON response format:
 def THREAT_MODEL_USER_PROMPT(
 		inputs
 ):
-	prompt = ""
-	if not inputs["dfd_only"]:
-		prompt = f"""
-'''
-APPLICATION TYPE: {inputs["app_type"]}
-TYPES OF DATA: {inputs["types_of_data"]}
-APPLICATION DESCRIPTION: {inputs["app_description"]}
-{f'''
-The user has also provided a Data Flow Diagram to describe the application.
-The DFD is described as a list of edges, connecting the "from" node to the
-"to" node. "typefrom" and "typeto" describe the type of the node, which can be
-an Entity, Process, or Data store. "trusted" indicates whether the edge's data
-flow is trusted. "boundary" indicates the boundary id of the trust boundary the
-source belongs to. "description" describes the data flow. This is the DFD
-provided:
-{inputs["dfd"]}
-
-And this is the dictionary containing the trust boundaries:
-each boundary has "id", "name", "description", and "color" keys.
-{inputs["boundaries"]}
-
-''' if inputs["use_dfd"] else ""}
-
-DATABASE SCHEMA: {inputs["database"]}
-DATA POLICY: {inputs["data_policy"]}
-USER DATA CONTROL: {inputs["user_data_control"]}
-'''
-"""
-	else:
-		prompt = f"""
-'''
-The user has provided only a Data Flow Diagram to describe the application.
-The DFD is described as a list of edges, connecting the "from" node to the
-"to" node. "typefrom" and "typeto" describe the type of the node, which can be
-an Entity, Process, or Data store. "trusted" indicates whether the edge's data
-flow is trusted. "boundary" indicates the boundary id of the trust boundary the
-source belongs to. "description" describes the data flow. This is the DFD provided:
-{inputs["dfd"]}
-
-And this is the dictionary containing the trust boundaries:
-each boundary has "id", "name", "description", and "color" keys.
-{inputs["boundaries"]}
-'''
-"""
-	return prompt
+	return APPLICATION_CONTEXT_PROMPT(inputs)
 
 DFD_SYSTEM_PROMPT = """
 You are a senior system architect with more than 20 years of
@@ -647,9 +682,9 @@ indicating also the id in the threat tree which represents
 the found threat. There can be multiple threats found, so you should provide
 multiple ids and explain why each of them is present, although you should aim
 for just one or two threats per element.
-In the input, if the SOURCE, DATA FLOW or DESTINATION is set to False, you
-should not analyze that part of the edge, writing "Not applicable" instead. If
-for a specific part of the edge, there is no possible threat in the tree, you
+You should only analyze the parts of the edge listed in LOCATIONS, the other
+parts do not apply to the edge and must not appear in the output. If for a
+specific part of the edge, there is no possible threat in the tree, you
 should write "Threat not possible" instead.
 To help you in determining whether there is a threat at a particu-
 lar location, you can use the following interpretations to decide
@@ -675,19 +710,14 @@ recipient does with that data triggers the threat
 
 The input is structured as follows, enclosed in triple quotes:
 '''
-DFD: The Data Flow Diagram for the whole application, represented as a list of dictionaries with the keys "from", "typefrom", "to", "typeto", "trusted", "boundary" and "description", representing each edge.
-EDGE: {"from": "source_node", "typefrom": "source_type", "to": "destination_node", "typeto": "destination_type", "trusted": True/False, "boundary": "boundary_id", "description": "edge_description"}
-CATEGORY: The specific LINDDUN threat category you should analyze for the edge.
-SOURCE: A boolean, indicating whether you should analyze the source node for the edge.
-DATA FLOW: A boolean, indicating whether you should analyze the data flow for the edge.
-DESTINATION: A boolean, indicating whether you should analyze the destination node for the edge.
-BOUNDARIES: The boundaries of the DFD, in this JSON format:
-{
-	'id': 'boundary_1',
-	'name': 'Boundary 1',
-	'description': 'Description of the boundary',
-	'color': '#00a6fb'
-}
+DFD: The Data Flow Diagram for the whole application, as a table of nodes followed by a table of edges, in this format:
+NODES (id | name | type):
+N0 | node name | Entity, Process or Data store
+EDGES (id | from | to | trusted | boundary | description):
+DF0 | N0 | N1 | yes/no | boundary_id | edge description
+BOUNDARIES: The trust boundaries of the DFD, referenced by id in the edges, in this format:
+BOUNDARIES (id | name | description):
+boundary_1 | Boundary 1 | Description of the boundary
 THREAT TREE: The threat tree you should follow for the threat elicitation process, in this JSON format:
 {
 	"id": "The node id",
@@ -712,36 +742,51 @@ THREAT TREE: The threat tree you should follow for the threat elicitation proces
 	]
 
 }
+CATEGORY: The specific LINDDUN threat category you should analyze for the edge.
+EDGE: {"from": "source_node", "typefrom": "source_type", "to": "destination_node", "typeto": "destination_type", "trusted": True/False, "boundary": "boundary_id", "description": "edge_description"}
+LOCATIONS: The parts of the edge you should analyze, among source, data flow and destination.
+OUTPUT: The structure of the JSON response, with only the keys of the parts to analyze.
 '''
 
 In your analysis, you should take into account the whole dfd and the specified trust boundaries, but focus on finding the threats for the specific edge provided.
 
-The output MUST be a JSON response with the following structure, with each explanation about 200 words long, and each path shall NOT jump over a node in the tree (i.e., after DD.1 there can only be DD.1.1, DD.1.2, etc. but not DD.1.2.3 right away):
-
-{
-	"source_id": "The ids of the source node threat in the threat tree",
-	"source_title": "The title of the source threat, briefly explaining the threat",
-    "source": "A detailed explanation of which threat of the specified category is possible at the source node.",
-	"data_flow_id": "The ids of the data flow threat in the threat tree",
-	"data_flow_title": "The title of the data flow threat, briefly explaining the threat",
-    "data_flow": "A detailed explanation of which threat of the specified category is possible in the data flow.",
-	"destination_id": "The ids of the destination node threat in the threat",
-	"destination_title": "The title of the destination threat, briefly explaining the threat",
-    "destination": "A detailed explanation of which threat of the specified category is possible at the destination node.",
-}
+The output MUST be a JSON response with the structure given in OUTPUT, with each explanation about 200 words long, and each path shall NOT jump over a node in the tree (i.e., after DD.1 there can only be DD.1.1, DD.1.2, etc. but not DD.1.2.3 right away).
+For each part of the edge to analyze, the output has three keys: the ids of the threat in the threat tree, the title of the threat, briefly explaining it, and a detailed explanation of which threat of the specified category is possible at that part.
                 """
 
+# The locations of a LINDDUN PRO edge, with the keys of their threat in the
+# response and the way they are named in the prompt
+LINDDUN_PRO_LOCATIONS = [
+	("source", "source", "the source node"),
+	("data_flow", "data flow", "the data flow"),
+	("destination", "destination", "the destination node"),
+]
+
+def LINDDUN_PRO_OUTPUT_PROMPT(source, data_flow, destination):
+	lines = []
+	for ((key, _, element), enabled) in zip(LINDDUN_PRO_LOCATIONS, (source, data_flow, destination)):
+		if enabled:
+			lines.append(f'\t"{key}_id": "The ids of the {key.replace("_", " ")} threat in the threat tree",')
+			lines.append(f'\t"{key}_title": "The title of the {key.replace("_", " ")} threat, briefly explaining the threat",')
+			lines.append(f'\t"{key}": "A detailed explanation of which threat of the specified category is possible at {element}.",')
+	return "{\n" + "\n".join(lines).rstrip(",") + "\n}"
+
 def LINDDUN_PRO_USER_PROMPT(dfd, edge, category, source, data_flow, destination, boundaries, threat_tree):
+	# The parts shared by the most calls come first: the DFD and boundaries
+	# are the same for the whole analysis, the threat tree for all the edges
+	# of a category, and only the last lines depend on the edge.
 	return f"""
 	'''
-	DFD: {dfd}
-	EDGE: {{ "from": {edge["from"]}, "typefrom": {edge["typefrom"]}, "to": {edge["to"]}, "typeto": {edge["typeto"]} }}
-	CATEGORY: {category}
-	SOURCE: {source}
-	DATA FLOW: {data_flow}
-	DESTINATION: {destination}
-	BOUNDARIES: {boundaries}
+	DFD:
+{serialize_dfd(dfd)}
+	BOUNDARIES:
+{serialize_boundaries(boundaries)}
 	THREAT TREE: {threat_tree}
+	CATEGORY: {category}
+	EDGE: {{ "from": {edge["from"]}, "typefrom": {edge["typefrom"]}, "to": {edge["to"]}, "typeto": {edge["typeto"]} }}
+	LOCATIONS: {", ".join(name for ((_, name, _), enabled) in zip(LINDDUN_PRO_LOCATIONS, (source, data_flow, destination)) if enabled)}
+	OUTPUT:
+{LINDDUN_PRO_OUTPUT_PROMPT(source, data_flow, destination)}
 	'''
 	"""
 
@@ -945,4 +990,73 @@ The JSON output MUST be structured as follows:
 }
 The "explanation" and "implementation" fields should be detailed and tailored to the application and threat provided, and should be about 100 words long each.
 The "measures" array should contain only 3 or 4 objects, so you should choose the most relevant privacy patterns between the 5 to 7 provided.
-"""
\ No newline at end of file
+"""
+
+EXPLAIN_CONTROL_MEASURES_BATCH_PROMPT = """
+You are a privacy expert with 20 years of experience in the field.
+Given an application description and several related threats detected in the
+application, you have to provide, for each threat, a detailed explanation of the
+chosen privacy patterns (control measures) to mitigate it. The response should be
+detailed and actionable, providing a clear understanding of each threat and the
+possible mitigation strategies. You should also suggest how to implement the
+chosen patterns in the application.
+
+The input is structured as follows, enclosed in triple quotes:
+'''
+APPLICATION TYPE: Web | Mobile | Desktop | Cloud | IoT | Other application
+TYPES OF DATA: PII, Financial, Health, User activity, Sensitive, Geolocation, Other
+APPLICATION DESCRIPTION: the general application description, sometimes with a Data Flow Diagram
+DATABASE SCHEMA: the database schema used by the application to contain the
+data, or none if no database is used, in JSON format
+DATA POLICY: the data policy of the application
+USER DATA CONTROL: the control the user has over their data
+'''
+
+The threats are structured as follows, enclosed in triple quotes:
+'''
+THREATS: [
+    {
+        "id": 0,
+        "threat": the threat detected in the application
+    },
+    /// other threats
+]
+'''
+
+The 5 to 7 chosen privacy patterns, shared by all the threats, are provided as
+follows, enclosed in triple quotes:
+'''
+PATTERNS: [
+    {
+        "title": "Pattern Title",
+        "excerpt": "Pattern excerpt",
+        "sections": {
+            /// detailed sections of the pattern, including context, examples, implementation, context etc.
+        }
+    },
+    /// other patterns used
+]
+'''
+
+The JSON output MUST be structured as follows, with one object for each threat,
+with the same "id" as in the input:
+{
+    "threats": [
+        {
+            "id": 0,
+            "measures": [
+                {
+                    "filename": "Pattern Filename",
+                    "title": "Pattern Title",
+                    "explanation": "A detailed explanation of the pattern and how it mitigates the threat.",
+                    "implementation": "Suggested implementation of the pattern in the application."
+                },
+                /// other patterns used
+            ]
+        },
+        /// other threats
+    ]
+}
+The "explanation" and "implementation" fields should be detailed and tailored to the application and to each threat, and should be about 100 words long each.
+Each "measures" array should contain only 3 or 4 objects, so you should choose the most relevant privacy patterns between the 5 to 7 provided.
+"""
@@ -13,15 +13,21 @@
 # limitations under the License.
 import json
 from pydantic import BaseModel
-from llms.prompts import CHOOSE_CONTROL_MEASURES_PROMPT, EXPLAIN_CONTROL_MEASURES_PROMPT, IMPACT_ASSESSMENT_PROMPT, THREAT_MODEL_USER_PROMPT
+from llms.prompts import CHOOSE_CONTROL_MEASURES_PROMPT, EXPLAIN_CONTROL_MEASURES_PROMPT, EXPLAIN_CONTROL_MEASURES_BATCH_PROMPT, IMPACT_ASSESSMENT_PROMPT, THREAT_MODEL_USER_PROMPT
 from misc.utils import (
     match_number_color,
     match_category_number,
+    match_number_category,
 )
 from openai import OpenAI
 import google.generativeai as genai
 from mistralai import Mistral, UserMessage
 import requests
+from llms.cache import cached_completion, cached_stream, checked_text
+from llms.concurrency import call_with_retries, iter_as_completed
+from misc.privacy_patterns import get_patterns_by_title, rank_patterns
+from llms.config import CONTROL_MEASURES_CONFIG
+from llms.clients import get_openai_client, get_mistral_client, get_google_model, get_session
 def assessment_gen_markdown(assessment):
     """
     This function generates a markdown table from the assessment data.
@@ -57,6 +63,62 @@ def linddun_pro_gen_individual_markdown(threat):
     markdown_output += f"| {color_html}{threat['category']}</p> | {threat['description']} |\n"
     return markdown_output
 
+def is_threat(source, threat):
+    """
+    This function tells whether a result of an analysis is an actual threat,
+    which is worth assessing: all the SIMPLE threats, the LINDDUN GO cards
+    deemed present and the LINDDUN Pro threats at the locations which apply
+    to the edge. The locations which do not apply have no threat tree node
+    and "Not applicable" as description (see fill_not_applicable in
+    llms/linddun_pro.py).
+
+    Args:
+        source (str): The analysis the threat comes from, such as "linddun_go" or "linddun_pro". The results of the other analyses are all threats.
+        threat (dict): The threat, as stored in the "to_assess" session state.
+
+    Returns:
+        bool: Whether the threat should be assessed.
+    """
+    if source == "linddun_go":
+        return bool(threat.get("reply"))
+    if source == "linddun_pro":
+        return bool(threat.get("threat_tree_node") or threat.get("threat_title")) and threat.get("description", "").strip() != "Not applicable"
+    return True
+
+def linddun_pro_to_assess(analyzed_edges):
+    """
+    This function turns the LINDDUN Pro threats of each edge into the list of
+    threats to assess. For each edge and category, LINDDUN Pro finds a threat at
+    the source, data flow, and destination, which are assessed separately.
+
+    Args:
+        analyzed_edges (list): The threats of each edge of the DFD, as stored in the "linddun_pro_threats" session state.
+
+    Returns:
+        list: The threats to assess. Each threat is a dictionary with the following keys:
+            - category: string. The category of the threat.
+            - description: string. The description of the threat.
+            - edge: dict. The edge of the DFD.
+            - threat_tree_node: string. The threat tree node of the threat.
+            - threat_title: string. The title of the threat.
+            - threat_location: string. One of "source", "data_flow" or "destination".
+            - data_flow_number: int. The position of the edge in the DFD.
+    """
+    to_assess = []
+    for (i, edge) in enumerate(analyzed_edges):
+        for threats_of_categories in edge:
+            for location in ["source", "data_flow", "destination"]:
+                to_assess.append({
+                    "category": threats_of_categories["category"], 
+                    "description": threats_of_categories[location], 
+                    "edge": threats_of_categories["edge"], 
+                    "threat_tree_node": threats_of_categories[f"{location}_id"],
+                    "threat_title": threats_of_categories[f"{location}_title"],
+                    "threat_location": location,
+                    "data_flow_number": i,
+                })
+    return to_assess
+
 def measures_gen_markdown(measures):
     """
     This function generates a markdown table from the control measures data.
@@ -85,23 +147,49 @@ def measures_gen_markdown(measures):
 
     
 
-def get_assessment(api_key, model, threat, inputs, temperature, provider):
+def parse_assessment(raw_content):
     """
-    This function generates an assessment for a threat.
-    
+    This function parses the response of an impact assessment request, also
+    when it is wrapped in a markdown code block or is not valid JSON.
+
     Args:
-        api_key (str): The API key for the selected provider.
-        model (str): The model to use.
-        threat (dict): The threat to assess. Any dictionary is accepted, since it will be converted to a string and passed to the model.
-        inputs (dict): The dictionary of inputs to the application, with the same keys as the "input" session state in the Application Info tab.
-        temperature (float): The temperature to use for the model.
-        provider (str): The provider to use. One of "OpenAI API", "Google AI API", "Mistral API", "Ollama", or "Local LM Studio".
+        raw_content (str): The text of the response.
 
     Returns:
-        dict: The assessment data. The dictionary has the following keys:
-            - impact: string. The impact of the threat.
+        dict: The assessment data, with the "impact" key.
     """
-    messages=[
+    content = raw_content
+    
+    # Clean up the content if it contains markdown JSON formatting
+    if "```json" in content:
+        content = content.split("```json")[1]
+        if "```" in content:
+            content = content.split("```")[0]
+    elif "```" in content:
+        content = content.split("```")[1].split("```")[0]
+        
+    content = content.strip()
+    
+    try:
+        result = json.loads(content)
+        if "impact" in result:
+            return {"impact": result["impact"]}
+        else:
+            return {"impact": content}
+    except Exception as e:
+        if "impact" in content.lower() and ":" in content:
+            try:
+                impact_text = content.lower().split("impact")[1].split("\n")[0]
+                impact_text = impact_text.replace(":", "").replace('"', "").replace(",", "").strip()
+                return {"impact": f"Extracted from response: {impact_text}"}
+            except:
+                pass
+        
+        return {"impact": raw_content}
+
+def assessment_messages(threat, inputs):
+    """Returns the messages of the impact assessment request for a threat."""
+    return [
         {
             "role": "system",
             "content": IMPACT_ASSESSMENT_PROMPT,
@@ -116,77 +204,74 @@ THREAT: {threat}
 """,
         },
     ]
+
+def get_assessment(api_key, model, threat, inputs, temperature, provider, use_cache=None):
+    """
+    This function generates an assessment for a threat.
+    
+    Args:
+        api_key (str): The API key for the selected provider.
+        model (str): The model to use.
+        threat (dict): The threat to assess. Any dictionary is accepted, since it will be converted to a string and passed to the model.
+        inputs (dict): The dictionary of inputs to the application, with the same keys as the "input" session state in the Application Info tab.
+        temperature (float): The temperature to use for the model.
+        provider (str): The provider to use. One of "OpenAI API", "Google AI API", "Mistral API", "Ollama", or "Local LM Studio".
+        use_cache (bool): Whether to use the response cache, see should_use_cache in llms/cache.py.
+
+    Returns:
+        dict: The assessment data. The dictionary has the following keys:
+            - impact: string. The impact of the threat.
+    """
+    messages = assessment_messages(threat, inputs)
     
     if provider == "OpenAI API":
-        client = OpenAI(api_key=api_key)
-        response = client.chat.completions.create(
-            model=model,
-            messages=messages,
-            response_format={"type": "json_object"},
-            max_tokens=4096,
-            temperature=temperature,
-        )
-        return json.loads(response.choices[0].message.content)
+        client = get_openai_client(api_key)
+        def request():
+            response = client.chat.completions.create(
+                model=model,
+                messages=messages,
+                response_format={"type": "json_object"},
+                max_tokens=4096,
+                temperature=temperature,
+            )
+            return checked_text(response.choices[0].message.content, response.choices[0].finish_reason)
+        return json.loads(cached_completion(provider, model, messages, temperature, request, schema="json_object", use_cache=use_cache))
     
     elif provider == "Google AI API":
      
         
-        genai.configure(api_key=api_key)
-        model_obj = genai.GenerativeModel(model)
-        
-        response = model_obj.generate_content(
-            [
-                {"role": "system", "parts": [messages[0]["content"]]},
-                {"role": "user", "parts": [messages[1]["content"]]},
-            ],
-            generation_config={"temperature": temperature}
-        )
-        
-        content = response.text
+        model_obj = get_google_model(api_key, model)
         
-        # Clean up the content if it contains markdown JSON formatting
-        if "```json" in content:
-            content = content.split("```json")[1]
-            if "```" in content:
-                content = content.split("```")[0]
-        elif "```" in content:
-            content = content.split("```")[1].split("```")[0]
-            
-        content = content.strip()
+        def request():
+            response = model_obj.generate_content(
+                [
+                    {"role": "system", "parts": [messages[0]["content"]]},
+                    {"role": "user", "parts": [messages[1]["content"]]},
+                ],
+                generation_config={"temperature": temperature}
+            )
+            return checked_text(response.text, response.candidates[0].finish_reason)
         
-        try:
-            result = json.loads(content)
-            if "impact" in result:
-                return {"impact": result["impact"]}
-            else:
-                return {"impact": content}
-        except Exception as e:
-            if "impact" in content.lower() and ":" in content:
-                try:
-                    impact_text = content.lower().split("impact")[1].split("\n")[0]
-                    impact_text = impact_text.replace(":", "").replace('"', "").replace(",", "").strip()
-                    return {"impact": f"Extracted from response: {impact_text}"}
-                except:
-                    pass
-            
-            return {"impact": response.text}
+        return parse_assessment(cached_completion(provider, model, messages, temperature, request, use_cache=use_cache))
     
     elif provider == "Mistral API": 
-        client = Mistral(api_key=api_key)
+        client = get_mistral_client(api_key)
         
         combined_prompt = f"{messages[0]['content']}\n\nUser request: {messages[1]['content']}"
         
-        response = client.chat.complete(
-            model=model,
-            response_format={"type": "json_object"},
-            messages=[
-                UserMessage(content=combined_prompt)
-            ],
-            max_tokens=4096,
-            temperature=temperature,
-        )
+        def request():
+            response = client.chat.complete(
+                model=model,
+                response_format={"type": "json_object"},
+                messages=[
+                    UserMessage(content=combined_prompt)
+                ],
+                max_tokens=4096,
+                temperature=temperature,
+            )
+            return checked_text(response.choices[0].message.content, response.choices[0].finish_reason)
         
-        content = response.choices[0].message.content
+        content = cached_completion(provider, model, combined_prompt, temperature, request, use_cache=use_cache)
         
         try:
             start_idx = content.find('{')
@@ -214,101 +299,232 @@ THREAT: {threat}
             return {"impact": content}
     
     elif provider == "Ollama":   
-        response = requests.post(
-            "http://localhost:11434/api/chat",
-            json={
-                "model": model,
-                "messages": [
-                    {"role": "system", "content": messages[0]["content"]},
-                    {"role": "user", "content": messages[1]["content"]},
-                ],
-                "stream": False,
-                "options": {"temperature": temperature}
-            }
-        )
+        def request():
+            response = get_session().post(
+                "http://localhost:11434/api/chat",
+                json={
+                    "model": model,
+                    "messages": [
+                        {"role": "system", "content": messages[0]["content"]},
+                        {"role": "user", "content": messages[1]["content"]},
+                    ],
+                    "stream": False,
+                    "options": {"temperature": temperature}
+                }
+            )
+            if response.status_code != 200:
+                raise Exception(f"Error from Ollama: {response.text}")
+            data = response.json()
+            return checked_text(data["message"]["content"], data.get("done_reason"))
         
-        if response.status_code == 200:
-            content = response.json()["message"]["content"]
-            
-            if "```json" in content:
-                content = content.split("```json")[1]
-                if "```" in content:
-                    content = content.split("```")[0]
-            elif "```" in content:
-                content = content.split("```")[1].split("```")[0]
-                
-            content = content.strip()
-            
-            try:
-                result = json.loads(content)
-                if "impact" in result:
-                    return {"impact": result["impact"]}
-                else:
-                    return {"impact": content}
-            except Exception as e:
-                if "impact" in content.lower() and ":" in content:
-                    try:
-                        impact_text = content.lower().split("impact")[1].split("\n")[0]
-                        impact_text = impact_text.replace(":", "").replace('"', "").replace(",", "").strip()
-                        return {"impact": f"Extracted from response: {impact_text}"}
-                    except:
-                        pass
-                
-                return {"impact": response.json()["message"]["content"]}
-        else:
-            raise Exception(f"Error from Ollama: {response.text}")
+        return parse_assessment(cached_completion(provider, model, messages, temperature, request, use_cache=use_cache))
     
     elif provider == "Local LM Studio":
         
-        response = requests.post(
-            "http://localhost:1234/v1/chat/completions",
-            json={
-                "model": model,
-                "messages": messages,
-                "temperature": temperature,
-                "max_tokens": 4096,
-            },
-            headers={"Content-Type": "application/json"}
-        )
+        def request():
+            response = get_session().post(
+                "http://localhost:1234/v1/chat/completions",
+                json={
+                    "model": model,
+                    "messages": messages,
+                    "temperature": temperature,
+                    "max_tokens": 4096,
+                },
+                headers={"Content-Type": "application/json"}
+            )
+            if response.status_code != 200:
+                raise Exception(f"Error from LM Studio: {response.text}")
+            choice = response.json()["choices"][0]
+            return checked_text(choice["message"]["content"], choice.get("finish_reason"))
         
-        if response.status_code == 200:
-            content = response.json()["choices"][0]["message"]["content"]
-            
-            if "```json" in content:
-                content = content.split("```json")[1]
-                if "```" in content:
-                    content = content.split("```")[0]
-            elif "```" in content:
-                content = content.split("```")[1].split("```")[0]
-                
-            content = content.strip()
-            
-            try:
-                result = json.loads(content)
-                if "impact" in result:
-                    return {"impact": result["impact"]}
-                else:
-                    return {"impact": content}
-            except Exception as e:
-                if "impact" in content.lower() and ":" in content:
-                    try:
-                        impact_text = content.lower().split("impact")[1].split("\n")[0]
-                        impact_text = impact_text.replace(":", "").replace('"', "").replace(",", "").strip()
-                        return {"impact": f"Extracted from response: {impact_text}"}
-                    except:
-                        pass
-                
-                return {"impact": response.json()["choices"][0]["message"]["content"]}
-        else:
-            raise Exception(f"Error from LM Studio: {response.text}")
+        return parse_assessment(cached_completion(provider, model, messages, temperature, request, use_cache=use_cache))
     
     else:
         raise ValueError(f"Unknown provider: {provider}")
 
 
-def choose_control_measures(api_key, model, threat, inputs, temperature, provider="OpenAI API"):
+def stream_assessment(api_key, model, threat, inputs, temperature, provider, use_cache=None):
+    """
+    This function generates an assessment for a threat, streaming the
+    response of the model. The requests are the same as the ones of
+    get_assessment, so they share the same cached responses. The full text
+    can be parsed with parse_assessment once the stream ends.
+
+    Args:
+        api_key (str): The API key for the selected provider.
+        model (str): The model to use.
+        threat (dict): The threat to assess.
+        inputs (dict): The dictionary of inputs to the application, with the same keys as the "input" session state in the Application Info tab.
+        temperature (float): The temperature to use for the model.
+        provider (str): The provider to use. One of "OpenAI API", "Google AI API", "Mistral API", "Ollama", or "Local LM Studio".
+        use_cache (bool): Whether to use the response cache, see should_use_cache in llms/cache.py.
+
+    Yields:
+        str: The text pieces of the response, as they arrive.
+    """
+    messages = assessment_messages(threat, inputs)
+
+    if provider == "OpenAI API":
+        client = get_openai_client(api_key)
+        def stream():
+            response = client.chat.completions.create(
+                model=model,
+                messages=messages,
+                response_format={"type": "json_object"},
+                max_tokens=4096,
+                temperature=temperature,
+                stream=True,
+            )
+            finish_reason = None
+            for chunk in response:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+                if chunk.choices and chunk.choices[0].finish_reason:
+                    finish_reason = chunk.choices[0].finish_reason
+            yield checked_text("", finish_reason)
+        yield from cached_stream(provider, model, messages, temperature, stream, schema="json_object", use_cache=use_cache)
+
+    elif provider == "Google AI API":
+        model_obj = get_google_model(api_key, model)
+        def stream():
+            response = model_obj.generate_content(
+                [
+                    {"role": "system", "parts": [messages[0]["content"]]},
+                    {"role": "user", "parts": [messages[1]["content"]]},
+                ],
+                generation_config={"temperature": temperature},
+                stream=True,
+            )
+            finish_reason = None
+            for chunk in response:
+                if chunk.candidates and chunk.candidates[0].content.parts:
+                    yield chunk.text
+                if chunk.candidates and chunk.candidates[0].finish_reason:
+                    finish_reason = chunk.candidates[0].finish_reason
+            yield checked_text("", finish_reason)
+        yield from cached_stream(provider, model, messages, temperature, stream, use_cache=use_cache)
+
+    elif provider == "Mistral API":
+        client = get_mistral_client(api_key)
+        combined_prompt = f"{messages[0]['content']}\n\nUser request: {messages[1]['content']}"
+        def stream():
+            response = client.chat.stream(
+                model=model,
+                response_format={"type": "json_object"},
+                messages=[
+                    UserMessage(content=combined_prompt)
+                ],
+                max_tokens=4096,
+                temperature=temperature,
+            )
+            finish_reason = None
+            for event in response:
+                if event.data.choices and event.data.choices[0].delta.content:
+                    yield event.data.choices[0].delta.content
+                if event.data.choices and event.data.choices[0].finish_reason:
+                    finish_reason = event.data.choices[0].finish_reason
+            yield checked_text("", finish_reason)
+        yield from cached_stream(provider, model, combined_prompt, temperature, stream, use_cache=use_cache)
+
+    elif provider == "Ollama":
+        def stream():
+            # Ollama streams one JSON object per line
+            response = get_session().post(
+                "http://localhost:11434/api/chat",
+                json={
+                    "model": model,
+                    "messages": [
+                        {"role": "system", "content": messages[0]["content"]},
+                        {"role": "user", "content": messages[1]["content"]},
+                    ],
+                    "stream": True,
+                    "options": {"temperature": temperature}
+                },
+                stream=True,
+            )
+            if response.status_code != 200:
+                raise Exception(f"Error from Ollama: {response.text}")
+            finish_reason = None
+            for line in response.iter_lines():
+                if line:
+                    data = json.loads(line)
+                    yield data.get("message", {}).get("content", "")
+                    finish_reason = data.get("done_reason", finish_reason)
+            yield checked_text("", finish_reason)
+        yield from cached_stream(provider, model, messages, temperature, stream, use_cache=use_cache)
+
+    elif provider == "Local LM Studio":
+        def stream():
+            # LM Studio streams server-sent events, like the OpenAI API
+            response = get_session().post(
+                "http://localhost:1234/v1/chat/completions",
+                json={
+                    "model": model,
+                    "messages": messages,
+                    "temperature": temperature,
+                    "max_tokens": 4096,
+                    "stream": True,
+                },
+                headers={"Content-Type": "application/json"},
+                stream=True,
+            )
+            if response.status_code != 200:
+                raise Exception(f"Error from LM Studio: {response.text}")
+            finish_reason = None
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                choices = json.loads(data).get("choices", [])
+                if choices and choices[0].get("delta", {}).get("content"):
+                    yield choices[0]["delta"]["content"]
+                if choices and choices[0].get("finish_reason"):
+                    finish_reason = choices[0]["finish_reason"]
+            yield checked_text("", finish_reason)
+        yield from cached_stream(provider, model, messages, temperature, stream, use_cache=use_cache)
+
+    else:
+        raise ValueError(f"Unknown provider: {provider}")
+
+
+def iter_assessments(api_key, model, threats, inputs, temperature, provider, max_workers=None, retries=None, use_cache=None):
     """
-    This function generates a list of control measures which could be useful for a threat, out of the full list of [privacy patterns](https://privacypatterns.org/).
+    This function generates the assessments of many threats concurrently,
+    retrying the failed requests, and yields each assessment as soon as it is
+    available.
+
+    Args:
+        api_key (str): The API key for the selected provider.
+        model (str): The model to use.
+        threats (list): The threats to assess, as accepted by get_assessment.
+        inputs (dict): The dictionary of inputs to the application, with the same keys as the "input" session state in the Application Info tab.
+        temperature (float): The temperature to use for the model.
+        provider (str): The provider to use. One of "OpenAI API", "Google AI API", "Mistral API", "Ollama", or "Local LM Studio".
+        max_workers (int): The maximum number of requests in flight at the same time. If None, the default from the configuration is used.
+        retries (int): The number of retries for each failed request. If None, the default from the configuration is used.
+        use_cache (bool): Whether to use the response cache, see should_use_cache in llms/cache.py.
+
+    Yields:
+        tuple: A tuple (index, assessment, error), where index is the position of
+            the threat in threats, assessment is the result of get_assessment (None
+            if all the attempts failed) and error is the last exception raised (None
+            if it succeeded).
+    """
+    def assess(threat):
+        return call_with_retries(
+            lambda: get_assessment(api_key, model, threat, inputs, temperature, provider, use_cache),
+            retries,
+        )
+
+    yield from iter_as_completed(assess, threats, max_workers)
+
+
+def choose_control_measures(api_key, model, threat, inputs, temperature, provider="OpenAI API", top_k=None, use_cache=None):
+    """
+    This function generates a list of control measures which could be useful for a threat, out of the [privacy patterns](https://privacypatterns.org/).
+    The patterns are first ranked locally against the threat, and only the top_k most relevant ones are sent to the model.
     
     Note: This function only supports OpenAI API provider for reliable JSON parsing and response formatting.
 
@@ -319,17 +535,19 @@ def choose_control_measures(api_key, model, threat, inputs, temperature, provide
         inputs (dict): The dictionary of inputs to the application.
         temperature (float): The temperature to use for the model.
         provider (str): The provider to use. Only "OpenAI API" is supported.
+        top_k (int): The number of candidate patterns sent to the model. If None, the default from CONTROL_MEASURES_CONFIG is used.
+        use_cache (bool): Whether to use the response cache, see should_use_cache in llms/cache.py.
 
     Returns:
         list: The list of control measures.
     """
     if provider != "OpenAI API":
         raise ValueError("Control measures selection is only supported with OpenAI API provider.")
-        
-    with open("misc/privacypatterns.json", "r") as f:
-        patterns = json.load(f)
-        patterns = [{"title": p["title"], "excerpt": p["excerpt"], "related_patterns": p["sections"]["Related Patterns"] if "Related Patterns" in p["sections"] else None} for p in patterns["patterns"]]
 
+    if top_k is None:
+        top_k = CONTROL_MEASURES_CONFIG["top_k"]
+    candidates = rank_patterns(str(threat), top_k)
+        
     messages = [
         {
             "role": "system",
@@ -342,23 +560,72 @@ def choose_control_measures(api_key, model, threat, inputs, temperature, provide
 THREAT: {threat}
 '''
 '''
+PATTERNS: {json.dumps(candidates)}
+'''
+""",
+        },
+    ]
+
+    client = get_openai_client(api_key)
+    def request():
+        response = client.chat.completions.create(
+            model=model,
+            messages=messages,
+            response_format={"type": "json_object"},
+            max_tokens=4096,
+            temperature=temperature,
+        )
+        return checked_text(response.choices[0].message.content, response.choices[0].finish_reason)
+    return json.loads(cached_completion(provider, model, messages, temperature, request, schema="json_object", use_cache=use_cache))["measures"]
+
+def explain_control_measures(api_key, model, threat, inputs, temperature, patterns, provider="OpenAI API", use_cache=None):
+    """
+    This function explains why the chosen privacy patterns are useful for a threat and how to implement them.
+
+    Args:
+        api_key (str): The API key for OpenAI.
+        model (str): The OpenAI model to use.
+        threat (dict): The threat to assess.
+        inputs (dict): The dictionary of inputs to the application.
+        temperature (float): The temperature to use for the model.
+        patterns (list): The full privacy patterns chosen for the threat.
+        provider (str): The provider to use. Only "OpenAI API" is supported.
+        use_cache (bool): Whether to use the response cache, see should_use_cache in llms/cache.py.
+
+    Returns:
+        list: The list of control measures.
+    """
+    messages = [
+        {
+            "role": "system",
+            "content": EXPLAIN_CONTROL_MEASURES_PROMPT,
+        },
+        {
+            "role": "user",
+            "content": THREAT_MODEL_USER_PROMPT(inputs) + f"""
+'''
+THREAT: {threat}
+'''
+'''
 PATTERNS: {json.dumps(patterns)}
 '''
 """,
         },
     ]
 
-    client = OpenAI(api_key=api_key)
-    response = client.chat.completions.create(
-        model=model,
-        messages=messages,
-        response_format={"type": "json_object"},
-        max_tokens=4096,
-        temperature=temperature,
-    )
-    return json.loads(response.choices[0].message.content)["measures"]
+    client = get_openai_client(api_key)
+    def request():
+        response = client.chat.completions.create(
+            model=model,
+            messages=messages,
+            response_format={"type": "json_object"},
+            max_tokens=4096,
+            temperature=temperature,
+        )
+        return checked_text(response.choices[0].message.content, response.choices[0].finish_reason)
+    return json.loads(cached_completion(provider, model, messages, temperature, request, schema="json_object", use_cache=use_cache))["measures"]
 
-def get_control_measures(api_key, model, threat, inputs, temperature, provider="OpenAI API"):
+def get_control_measures(api_key, model, threat, inputs, temperature, provider="OpenAI API", use_cache=None):
     """
     This function generates a list of control measures which could be useful for a threat and explains why they are useful and how to implement them.
     
@@ -371,6 +638,7 @@ def get_control_measures(api_key, model, threat, inputs, temperature, provider="
         inputs (dict): The dictionary of inputs to the application.
         temperature (float): The temperature to use for the model.
         provider (str): The provider to use. Only "OpenAI API" is supported.
+        use_cache (bool): Whether to use the response cache, see should_use_cache in llms/cache.py.
 
     Returns:
         list: The list of control measures.
@@ -378,43 +646,208 @@ def get_control_measures(api_key, model, threat, inputs, temperature, provider="
     if provider != "OpenAI API":
         raise ValueError("Control measures generation is only supported with OpenAI API provider.")
     
-    measures = choose_control_measures(api_key, model, threat, inputs, temperature, provider)
+    measures = choose_control_measures(api_key, model, threat, inputs, temperature, provider, use_cache=use_cache)
     
     if not isinstance(measures, list):
         measures = [measures] if measures is not None else []
     
-    chosen = []
-    with open("misc/privacypatterns.json", "r") as f:
-        patterns = json.load(f)["patterns"]
+    chosen = get_patterns_by_title(measures)
 
-    for pattern in patterns:
-        if pattern["title"] in measures:
-            chosen.append(pattern)
+    return explain_control_measures(api_key, model, threat, inputs, temperature, chosen, provider, use_cache)
+
+def explain_control_measures_batch(api_key, model, threats, inputs, temperature, patterns, provider="OpenAI API", use_cache=None):
+    """
+    This function explains the same chosen privacy patterns for several
+    related threats with a single request. The threats the model leaves out
+    of its response are explained again one by one.
+
+    Args:
+        api_key (str): The API key for OpenAI.
+        model (str): The OpenAI model to use.
+        threats (list): The threats to assess.
+        inputs (dict): The dictionary of inputs to the application.
+        temperature (float): The temperature to use for the model.
+        patterns (list): The full privacy patterns chosen for the threats.
+        provider (str): The provider to use. Only "OpenAI API" is supported.
+        use_cache (bool): Whether to use the response cache, see should_use_cache in llms/cache.py.
+
+    Returns:
+        list: The list of control measures of each threat, in the same order as the threats.
+    """
+    if len(threats) == 1:
+        return [explain_control_measures(api_key, model, threats[0], inputs, temperature, patterns, provider, use_cache)]
 
     messages = [
         {
             "role": "system",
-            "content": EXPLAIN_CONTROL_MEASURES_PROMPT,
+            "content": EXPLAIN_CONTROL_MEASURES_BATCH_PROMPT,
         },
         {
             "role": "user",
             "content": THREAT_MODEL_USER_PROMPT(inputs) + f"""
 '''
-THREAT: {threat}
+THREATS: {json.dumps([{"id": i, "threat": str(threat)} for i, threat in enumerate(threats)])}
 '''
 '''
-PATTERNS: {json.dumps(chosen)}
+PATTERNS: {json.dumps(patterns)}
 '''
 """,
         },
     ]
 
-    client = OpenAI(api_key=api_key)
-    response = client.chat.completions.create(
-        model=model,
-        messages=messages,
-        response_format={"type": "json_object"},
-        max_tokens=4096,
-        temperature=temperature,
-    )
-    return json.loads(response.choices[0].message.content)["measures"]
+    client = get_openai_client(api_key)
+    def request():
+        response = client.chat.completions.create(
+            model=model,
+            messages=messages,
+            response_format={"type": "json_object"},
+            # Each threat needs about as many tokens as a single explanation
+            max_tokens=min(16384, 4096 * len(threats)),
+            temperature=temperature,
+        )
+        return checked_text(response.choices[0].message.content, response.choices[0].finish_reason)
+
+    results = [None] * len(threats)
+    try:
+        response = json.loads(cached_completion(provider, model, messages, temperature, request, schema="json_object", use_cache=use_cache))
+        for item in response.get("threats", []):
+            if isinstance(item, dict) and isinstance(item.get("id"), int) and 0 <= item["id"] < len(threats) and isinstance(item.get("measures"), list):
+                results[item["id"]] = item["measures"]
+    except Exception as e:
+        print(f"Error in batched control measures, explaining the threats one by one: {str(e)}")
+
+    for i, threat in enumerate(threats):
+        if results[i] is None:
+            results[i] = explain_control_measures(api_key, model, threat, inputs, temperature, patterns, provider, use_cache)
+    return results
+
+def threat_category(threat):
+    """
+    This function returns the LINDDUN category of a threat of any analysis, in
+    the format "Linking", "Identifying", etc.: the category of the LINDDUN PRO
+    threats, the card type of the LINDDUN GO threats, as a number from 1 to 7,
+    or the threat type of the SIMPLE threats, in the format "L - Linking".
+
+    Args:
+        threat (dict): The threat to assess.
+
+    Returns:
+        str: The category of the threat, or None if it has none.
+    """
+    if not isinstance(threat, dict):
+        return None
+    if threat.get("category"):
+        return str(threat["category"]).strip()
+    threat_type = threat.get("threat_type")
+    if isinstance(threat_type, int):
+        return match_number_category(threat_type)
+    if threat_type:
+        return str(threat_type).split(" - ", 1)[-1].strip()
+    return None
+
+def threat_text(threat):
+    """Returns the description of a threat of any analysis, to describe a group of threats."""
+    for key in ["description", "threat_description", "Scenario"]:
+        if threat.get(key):
+            return str(threat[key])
+    return str(threat)
+
+def control_measures_group(threat):
+    """
+    This function returns the key of the group of a threat in bulk control
+    measure generation. Threats in the same group share the same choice of
+    privacy patterns: LINDDUN PRO threats with the same category and threat
+    tree node, and the other threats with the same category.
+
+    Args:
+        threat (dict): The threat to assess.
+
+    Returns:
+        tuple: The key of the group, or None if the threat has to be handled on its own.
+    """
+    category = threat_category(threat)
+    if not category:
+        return None
+    if threat.get("threat_tree_node"):
+        return (category, threat["threat_tree_node"])
+    return (category,)
+
+def iter_control_measures(api_key, model, threats, inputs, temperature, provider="OpenAI API", max_workers=None, batch_size=None, use_cache=None):
+    """
+    This function generates the control measures of many threats. Threats in
+    the same group (see control_measures_group) share a single pattern
+    selection request, and their explanations are requested in batches of
+    batch_size threats. All the requests of a stage run concurrently, and
+    each result is yielded as soon as it is available.
+
+    Args:
+        api_key (str): The API key for OpenAI.
+        model (str): The OpenAI model to use.
+        threats (list): The threats to assess.
+        inputs (dict): The dictionary of inputs to the application.
+        temperature (float): The temperature to use for the model.
+        provider (str): The provider to use. Only "OpenAI API" is supported.
+        max_workers (int): The maximum number of requests in flight at the same time. If None, the default from the configuration is used.
+        batch_size (int): The maximum number of threats explained by a single request. If None, the default from CONTROL_MEASURES_CONFIG is used.
+        use_cache (bool): Whether to use the response cache, see should_use_cache in llms/cache.py.
+
+    Yields:
+        tuple: A tuple (index, measures, error), where index is the position of
+            the threat in threats, measures is its list of control measures (None
+            if it failed) and error is the exception raised (None if it succeeded).
+    """
+    if provider != "OpenAI API":
+        raise ValueError("Control measures generation is only supported with OpenAI API provider.")
+    if batch_size is None:
+        batch_size = CONTROL_MEASURES_CONFIG["batch_size"]
+
+    groups = {}
+    for i, threat in enumerate(threats):
+        key = control_measures_group(threat)
+        groups.setdefault(key if key is not None else ("threat", i), []).append(i)
+    groups = list(groups.values())
+
+    def choose(indices):
+        if len(indices) == 1:
+            threat = threats[indices[0]]
+        else:
+            # The group is described by what its threats have in common, with
+            # a few of their descriptions to rank and choose the patterns
+            first = threats[indices[0]]
+            descriptions = list(dict.fromkeys(threat_text(threats[i]) for i in indices))
+            threat = {"category": threat_category(first)}
+            if first.get("threat_tree_node"):
+                threat["threat_tree_node"] = first["threat_tree_node"]
+            titles = list(dict.fromkeys(threats[i]["threat_title"] for i in indices if threats[i].get("threat_title")))
+            if titles:
+                threat["threat_titles"] = titles[:5]
+            threat["descriptions"] = descriptions[:5]
+        measures = call_with_retries(lambda: choose_control_measures(api_key, model, threat, inputs, temperature, provider, use_cache=use_cache))
+        if not isinstance(measures, list):
+            measures = [measures] if measures is not None else []
+        return get_patterns_by_title(measures)
+
+    # First stage: choose the patterns of each group
+    batches = []
+    for group, patterns, error in iter_as_completed(choose, groups, max_workers):
+        if error is not None:
+            for i in groups[group]:
+                yield i, None, error
+            continue
+        for start in range(0, len(groups[group]), batch_size):
+            batches.append((groups[group][start:start + batch_size], patterns))
+
+    # Second stage: explain the chosen patterns, batching the threats of a group
+    def explain(batch):
+        indices, patterns = batch
+        return call_with_retries(lambda: explain_control_measures_batch(
+            api_key, model, [threats[i] for i in indices], inputs, temperature, patterns, provider, use_cache
+        ))
+
+    for batch, results, error in iter_as_completed(explain, batches, max_workers):
+        indices = batches[batch][0]
+        for position, i in enumerate(indices):
+            if error is not None:
+                yield i, None, error
+            else:
+                yield i, results[position], None
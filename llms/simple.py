@@ -13,6 +13,8 @@
 # limitations under the License.
 import json
 from llms.config import OLLAMA_CONFIG, LMSTUDIO_CONFIG
+from llms.cache import cached_completion, cached_stream, checked_text, contains_json
+from llms.clients import get_provider_client, get_mistral_client, get_google_model
 import google.generativeai as genai
 from mistralai import Mistral, UserMessage
 from openai import OpenAI
@@ -60,7 +62,7 @@ def threat_model_gen_markdown(threat_model):
 
 	return markdown_output
 
-def get_threat_model_openai(api_key, model_name, prompt, temperature, lmstudio=False, ollama=False):
+def get_threat_model_openai(api_key, model_name, prompt, temperature, lmstudio=False, ollama=False, use_cache=None):
 	"""
 	This function generates a simple LINDDUN threat model from the prompt.
 	
@@ -69,6 +71,7 @@ def get_threat_model_openai(api_key, model_name, prompt, temperature, lmstudio=F
 		model_name (str): The OpenAI model to use.
 		prompt (str): The prompt to use for generating the threat model.
 		temperature (float): The temperature to use for the model.
+		use_cache (bool): Whether to use the response cache, see should_use_cache in llms/cache.py.
 	
 	Returns:
 		threat_model: The list of threats in the threat model. Each threat is a dictionary with the following keys:
@@ -79,17 +82,11 @@ def get_threat_model_openai(api_key, model_name, prompt, temperature, lmstudio=F
 	"""
 
 	if lmstudio:
-		client = OpenAI(
-            base_url=LMSTUDIO_CONFIG["base_url"],
-            api_key=LMSTUDIO_CONFIG["api_key"],
-        )
+		client = get_provider_client("Local LM Studio")
 	elif ollama:
-		client = OpenAI(
-            base_url=OLLAMA_CONFIG["base_url"],
-            api_key=OLLAMA_CONFIG["api_key"]
-        )
+		client = get_provider_client("Ollama")
 	else:
-		client = OpenAI(api_key=api_key)
+		client = get_provider_client("OpenAI API", api_key)
 	messages=[
 			{
 			"role": "system",
@@ -98,55 +95,65 @@ def get_threat_model_openai(api_key, model_name, prompt, temperature, lmstudio=F
 			{"role": "user", "content": prompt},
 	]
 
-	if model_name in ["gpt-4o", "gpt-4o-mini"]:
-		class Threat(BaseModel):
-			title: str
-			threat_type: str
-			Scenario: str
-			Reason: str
-		class ThreatModel(BaseModel):
-			threat_model: list[Threat]
-
-		response = client.beta.chat.completions.parse(
-			messages=messages,
-			model=model_name,
-			response_format=ThreatModel,
-			temperature=temperature,
-			max_tokens=4096,
-		)
+	def request():
+		if model_name in ["gpt-4o", "gpt-4o-mini"]:
+			class Threat(BaseModel):
+				title: str
+				threat_type: str
+				Scenario: str
+				Reason: str
+			class ThreatModel(BaseModel):
+				threat_model: list[Threat]
+
+			response = client.beta.chat.completions.parse(
+				messages=messages,
+				model=model_name,
+				response_format=ThreatModel,
+				temperature=temperature,
+				max_tokens=4096,
+			)
+		else:
+			response = client.chat.completions.create(
+				model=model_name,
+				messages=messages,
+				max_tokens=4096,
+				temperature=temperature,
+				response_format={"type": "json_object"},
+			)
+		return checked_text(response.choices[0].message.content, response.choices[0].finish_reason)
+
+	if lmstudio:
+		provider = "Local LM Studio"
+	elif ollama:
+		provider = "Ollama"
 	else:
-		response = client.chat.completions.create(
-			model=model_name,
-			messages=messages,
-			max_tokens=4096,
-			temperature=temperature,
-			response_format={"type": "json_object"},
-		)
-		
-	response_content = json.loads(response.choices[0].message.content)
+		provider = "OpenAI API"
+	response_content = json.loads(cached_completion(provider, model_name, messages, temperature, request, schema="threat_model", use_cache=use_cache))
 
 	return response_content
 
-def get_threat_model_mistral(mistral_api_key, mistral_model, prompt, temperature):
+def get_threat_model_mistral(mistral_api_key, mistral_model, prompt, temperature, use_cache=None):
     """
     Get a threat model using Mistral AI
     """
-    client = Mistral(api_key=mistral_api_key)
+    client = get_mistral_client(mistral_api_key)
     
     # Combine system and user prompts into a single prompt for Mistral
     combined_prompt = f"{THREAT_MODEL_SYSTEM_PROMPT}\n\nUser request: {prompt}"
 
-    response = client.chat.complete(
-        model=mistral_model,
-        response_format={"type": "json_object"},
-        messages=[
-            UserMessage(content=combined_prompt)
-        ],
-        temperature=temperature
-    )
+    def request():
+        response = client.chat.complete(
+            model=mistral_model,
+            response_format={"type": "json_object"},
+            messages=[
+                UserMessage(content=combined_prompt)
+            ],
+            temperature=temperature
+        )
+        return checked_text(response.choices[0].message.content, response.choices[0].finish_reason)
 
     # Convert the JSON string in the 'content' field to a Python dictionary
-    response_text = response.choices[0].message.content
+    response_text = cached_completion("Mistral API", mistral_model, combined_prompt, temperature, request, use_cache=use_cache, validate=contains_json)
     
     # Extract only the JSON part from the response
     try:
@@ -167,13 +174,13 @@ def get_threat_model_mistral(mistral_api_key, mistral_model, prompt, temperature
     return response_content
 
 
-def get_threat_model_google(google_api_key: str, model: str, app_input: str, temp: float = 0.7):
+def get_threat_model_google(google_api_key: str, model: str, app_input: str, temp: float = 0.7, use_cache=None):
     """
     This function generates a threat model from the prompt using the Google AI model.
     """
     try:
-        genai.configure(api_key=google_api_key)
-        google_model = genai.GenerativeModel(
+        google_model = get_google_model(
+            google_api_key,
             model, 
             generation_config={"response_mime_type": "application/json"}
         )
@@ -181,19 +188,24 @@ def get_threat_model_google(google_api_key: str, model: str, app_input: str, tem
         # Combine system and user prompts into a single prompt for Google AI
         combined_prompt = f"{THREAT_MODEL_SYSTEM_PROMPT}\n\nUser request: {app_input}"
         
-        response = google_model.generate_content(
-            combined_prompt,  
-            generation_config=genai.types.GenerationConfig(
-                temperature=temp,
-                response_mime_type="application/json",
-                max_output_tokens=4096,
+        def request():
+            response = google_model.generate_content(
+                combined_prompt,  
+                generation_config=genai.types.GenerationConfig(
+                    temperature=temp,
+                    response_mime_type="application/json",
+                    max_output_tokens=4096,
+                )
             )
-        )
+            if response.candidates and len(response.candidates) > 0:
+                return checked_text(response.candidates[0].content.parts[0].text, response.candidates[0].finish_reason)
+            return None
+
+        json_text = cached_completion("Google AI API", model, combined_prompt, temp, request, use_cache=use_cache, validate=json.loads)
 
         # Handle the response
-        if response.candidates and len(response.candidates) > 0:
+        if json_text:
             try:
-                json_text = response.candidates[0].content.parts[0].text
                 response_content = json.loads(json_text)
                 
                 # Ensure we have the expected structure
@@ -217,3 +229,128 @@ def get_threat_model_google(google_api_key: str, model: str, app_input: str, tem
         raise e
 
 
+
+
+def parse_threat_model(response_text):
+    """
+    This function parses the full response of a threat model request, also
+    when the model surrounded the JSON object with other text.
+
+    Args:
+        response_text (str): The text of the response.
+
+    Returns:
+        dict: The threat model, with the "threat_model" key containing the list of threats.
+    """
+    try:
+        start_idx = response_text.find('{')
+        end_idx = response_text.rfind('}') + 1
+        if start_idx != -1 and end_idx > start_idx:
+            response_content = json.loads(response_text[start_idx:end_idx])
+        else:
+            response_content = json.loads(response_text)
+    except json.JSONDecodeError:
+        return {"threat_model": []}
+
+    if isinstance(response_content, list):
+        return {"threat_model": response_content}
+    return response_content
+
+
+def stream_threat_model(provider, api_key, model_name, prompt, temperature, use_cache=None):
+    """
+    This function generates a simple LINDDUN threat model from the prompt,
+    streaming the response of the model. The requests are the same as the
+    ones of get_threat_model_openai, get_threat_model_mistral and
+    get_threat_model_google, so they share the same cached responses.
+
+    Args:
+        provider (str): The provider to use. One of "OpenAI API", "Google AI API", "Mistral API", "Ollama", or "Local LM Studio".
+        api_key (str): The API key for the provider, ignored for the local providers.
+        model_name (str): The model to use.
+        prompt (str): The prompt to use for generating the threat model.
+        temperature (float): The temperature to use for the model.
+        use_cache (bool): Whether to use the response cache, see should_use_cache in llms/cache.py.
+
+    Yields:
+        str: The text pieces of the response, a JSON object with the "threat_model" key, as they arrive.
+    """
+    if provider == "Mistral API":
+        client = get_mistral_client(api_key)
+        combined_prompt = f"{THREAT_MODEL_SYSTEM_PROMPT}\n\nUser request: {prompt}"
+
+        def stream():
+            response = client.chat.stream(
+                model=model_name,
+                response_format={"type": "json_object"},
+                messages=[
+                    UserMessage(content=combined_prompt)
+                ],
+                temperature=temperature
+            )
+            finish_reason = None
+            for event in response:
+                if event.data.choices and event.data.choices[0].delta.content:
+                    yield event.data.choices[0].delta.content
+                if event.data.choices and event.data.choices[0].finish_reason:
+                    finish_reason = event.data.choices[0].finish_reason
+            yield checked_text("", finish_reason)
+
+        yield from cached_stream(provider, model_name, combined_prompt, temperature, stream, use_cache=use_cache, validate=contains_json)
+
+    elif provider == "Google AI API":
+        google_model = get_google_model(
+            api_key,
+            model_name,
+            generation_config={"response_mime_type": "application/json"}
+        )
+        combined_prompt = f"{THREAT_MODEL_SYSTEM_PROMPT}\n\nUser request: {prompt}"
+
+        def stream():
+            response = google_model.generate_content(
+                combined_prompt,
+                generation_config=genai.types.GenerationConfig(
+                    temperature=temperature,
+                    response_mime_type="application/json",
+                    max_output_tokens=4096,
+                ),
+                stream=True,
+            )
+            finish_reason = None
+            for chunk in response:
+                if chunk.candidates and chunk.candidates[0].content.parts:
+                    yield chunk.text
+                if chunk.candidates and chunk.candidates[0].finish_reason:
+                    finish_reason = chunk.candidates[0].finish_reason
+            yield checked_text("", finish_reason)
+
+        yield from cached_stream(provider, model_name, combined_prompt, temperature, stream, use_cache=use_cache, validate=contains_json)
+
+    else:
+        client = get_provider_client(provider, api_key)
+        messages = [
+            {
+                "role": "system",
+                "content": THREAT_MODEL_SYSTEM_PROMPT,
+            },
+            {"role": "user", "content": prompt},
+        ]
+
+        def stream():
+            response = client.chat.completions.create(
+                model=model_name,
+                messages=messages,
+                max_tokens=4096,
+                temperature=temperature,
+                response_format={"type": "json_object"},
+                stream=True,
+            )
+            finish_reason = None
+            for chunk in response:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+                if chunk.choices and chunk.choices[0].finish_reason:
+                    finish_reason = chunk.choices[0].finish_reason
+            yield checked_text("", finish_reason)
+
+        yield from cached_stream(provider, model_name, messages, temperature, stream, schema="threat_model", use_cache=use_cache)
@@ -0,0 +1,100 @@
+# Copyright 2024 Fondazione Bruno Kessler
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import json
+
+
+class JsonArrayParser:
+    """
+    This class parses the elements of a JSON array while the response of the
+    model is still being streamed. Text is fed as it arrives, and every
+    object (or array) in the array is returned as soon as its closing bracket
+    has been received, without waiting for the rest of the response.
+
+    The array is the value of the given key, such as {"threat_model": [...]},
+    or the first array of the response if no key is given.
+
+    Args:
+        key (str): The key of the array in the JSON object, or None to use the first array found.
+    """
+    def __init__(self, key=None):
+        self.key = key
+        self.buffer = ""
+        self.position = 0
+        self.in_array = False
+        self.done = False
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.element_start = None
+
+    def find_array(self):
+        """Moves the position to the start of the array, returning whether it has been found."""
+        if self.key is None:
+            start = self.buffer.find("[")
+        else:
+            key_start = self.buffer.find(json.dumps(self.key))
+            if key_start == -1:
+                return False
+            start = self.buffer.find("[", key_start)
+        if start == -1:
+            return False
+        self.position = start + 1
+        self.in_array = True
+        return True
+
+    def feed(self, text):
+        """
+        This function adds a piece of the response and returns the elements of
+        the array completed by it.
+
+        Args:
+            text (str): The next piece of the response.
+
+        Returns:
+            list: The elements completed by this piece, already parsed. Elements which are not valid JSON are skipped.
+        """
+        self.buffer += text
+        items = []
+        if self.done or (not self.in_array and not self.find_array()):
+            return items
+
+        while self.position < len(self.buffer):
+            char = self.buffer[self.position]
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char in "{[":
+                if self.depth == 0:
+                    self.element_start = self.position
+                self.depth += 1
+            elif char in "}]":
+                if self.depth == 0:
+                    # End of the array
+                    self.done = True
+                    break
+                self.depth -= 1
+                if self.depth == 0:
+                    try:
+                        items.append(json.loads(self.buffer[self.element_start:self.position + 1]))
+                    except json.JSONDecodeError:
+                        pass
+                    self.element_start = None
+            self.position += 1
+        return items
@@ -134,6 +134,11 @@ def init_session_state():
     if "last_uploaded_csv_hash" not in st.session_state:
         # Store the hash of the last uploaded CSV to prevent reprocessing
         st.session_state["last_uploaded_csv_hash"] = None
+    if "dfd_index" not in st.session_state:
+        # "dfd_index" is the index of the components of the DFD (see index_dfd
+        # in misc/utils.py), kept between the graph updates so that edges added
+        # at the end of the table are indexed without going over the others
+        st.session_state["dfd_index"] = None
     if "dfd_only" not in st.session_state:
         # "dfd_only" is a boolean that indicates whether only the DFD is
         # needed, in order to disable the application description
@@ -250,6 +255,14 @@ def init_session_state():
     if "to_report" not in st.session_state:
         # "to_report" is a list of booleans used to store whether each threat should be included in the report.
         st.session_state["to_report"] = []
+    if "report_file" not in st.session_state:
+        # "report_file" is a string used to store the path of the last generated
+        # report, a temporary file served by the download button of the Report tab.
+        st.session_state["report_file"] = None
+    if "report_directory" not in st.session_state:
+        # "report_directory" is the temporary directory of the reports of the
+        # session, created by the Report tab and deleted when the session ends.
+        st.session_state["report_directory"] = None
 
         
 # Streamlit configuration
@@ -0,0 +1,89 @@
+# Copyright 2024 Fondazione Bruno Kessler
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+def clean(value):
+    """Returns a value as a single line of text, safe to put in a table cell."""
+    return " ".join(str(value).replace("|", "/").split())
+
+
+def is_trusted(value):
+    """Returns whether the "trusted" field of an edge is true, also when read from a CSV file."""
+    if isinstance(value, str):
+        return value.strip().lower() in ["true", "1", "yes"]
+    return bool(value)
+
+
+def serialize_dfd(dfd):
+    """
+    This function serializes a Data Flow Diagram in a compact, deterministic
+    text form for the prompts. Every node, i.e. every pair of name and type,
+    is listed once in a node table with a short id, and the edge table refers to the nodes by id, so that names,
+    types and key names are not repeated on every edge. The same DFD always
+    gives the same text.
+
+    Args:
+        dfd (list): The Data Flow Diagram of the application. Each element is a dictionary with the following keys:
+            - from: string. The entity where the data flow starts
+            - typefrom: string. The type of the entity where the data flow starts
+            - to: string. The entity where the data flow ends
+            - typeto: string. The type of the entity where the data flow ends
+            - trusted: bool. Whether the data flow is trusted
+            - boundary: string. The trust boundary id of the data flow
+            - description: string. The description of the data flow
+
+    Returns:
+        str: The node table followed by the edge table. Nodes are numbered N0, N1, ...
+            in order of first appearance and edges DF0, DF1, ... in the order of the DFD.
+    """
+    # Nodes are identified by their cleaned name and type, so that names
+    # differing only in whitespace (e.g. from a CSV file) are the same node,
+    # while a name used with two types, such as a "Database" Process and a
+    # "Database" Data store, gives two nodes and neither type is lost
+    nodes = {}
+    for edge in dfd:
+        for node in [(clean(edge["from"]), clean(edge["typefrom"])), (clean(edge["to"]), clean(edge["typeto"]))]:
+            if node not in nodes:
+                nodes[node] = f"N{len(nodes)}"
+
+    lines = ["NODES (id | name | type):"]
+    for (name, type), id in nodes.items():
+        lines.append(f"{id} | {name} | {type}")
+    lines.append("EDGES (id | from | to | trusted | boundary | description):")
+    for i, edge in enumerate(dfd):
+        source = nodes[(clean(edge["from"]), clean(edge["typefrom"]))]
+        destination = nodes[(clean(edge["to"]), clean(edge["typeto"]))]
+        lines.append(
+            f"DF{i} | {source} | {destination} | "
+            f"{'yes' if is_trusted(edge.get('trusted')) else 'no'} | "
+            f"{clean(edge.get('boundary', ''))} | {clean(edge.get('description', ''))}"
+        )
+    return "\n".join(lines)
+
+
+def serialize_boundaries(boundaries):
+    """
+    This function serializes the trust boundaries in the same compact form as
+    serialize_dfd, leaving out their colors, which only matter for the graph.
+
+    Args:
+        boundaries (list): The trust boundaries. Each boundary is a dictionary with the keys id, name, description and color.
+
+    Returns:
+        str: The table of the boundaries, referenced by id in the edge table of the DFD.
+    """
+    lines = ["BOUNDARIES (id | name | description):"]
+    for boundary in boundaries or []:
+        lines.append(f"{clean(boundary.get('id', ''))} | {clean(boundary.get('name', ''))} | {clean(boundary.get('description', ''))}")
+    return "\n".join(lines)
@@ -0,0 +1,309 @@
+# Copyright 2024 Fondazione Bruno Kessler
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import json
+import os
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Font
+from openpyxl.utils import get_column_letter
+from misc.report import (
+    report_threats,
+    write_report,
+    write_report_html,
+    write_report_markdown,
+)
+
+# The formats the report can be exported to. Binary formats are written to
+# files opened in binary mode, the others to text files in UTF-8.
+EXPORT_FORMATS = {
+    "PDF": {"extension": ".pdf", "mime": "application/pdf", "binary": True},
+    "HTML": {"extension": ".html", "mime": "text/html", "binary": False},
+    "Markdown": {"extension": ".md", "mime": "text/markdown", "binary": False},
+    "JSON": {"extension": ".json", "mime": "application/json", "binary": False},
+    "SARIF": {"extension": ".sarif", "mime": "application/sarif+json", "binary": False},
+    "XLSX": {"extension": ".xlsx", "mime": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "binary": True},
+}
+
+PILLAR_URI = "https://github.com/stfbk/PILLAR"
+
+# The width of the columns of the XLSX threats sheet, as in the spreadsheets in the examples folder
+XLSX_WIDTHS = {"Number": 8, "Threat Type": 22, "Title": 40, "Impact assessment": 70, "Control measures": 70}
+XLSX_DETAIL_WIDTH = 70
+
+
+def report_data(state):
+    """
+    This function collects the content of the report in a plain structure,
+    shared by the structured export formats (JSON, SARIF and XLSX). It has the
+    same threats as the PDF report, which are the ones selected in the risk
+    assessment tab.
+
+    Args:
+        state (dict): The state of the analysis, as accepted by iter_report_markdown.
+
+    Returns:
+        dict: The content of the report, with the following keys:
+            - details: dict. The general information: app_name, app_version, author, date and high_level_description.
+            - threat_source: string. The analysis which found the threats, such as "linddun_go".
+            - dfd: list. The edges of the DFD, as dictionaries with the keys of the DFD tab, and their number as "data_flow".
+            - threats: list. The threats to report, as yielded by report_threats, with the details as a dictionary.
+    """
+    dfd = (state.get("input") or {}).get("dfd") or []
+    return {
+        "details": {
+            "app_name": state["app_name"],
+            "app_version": state["app_version"],
+            "author": state["author"],
+            "date": str(state["date"]),
+            "high_level_description": state["high_level_description"],
+        },
+        "threat_source": state["threat_source"],
+        "dfd": [
+            {
+                "data_flow": f"DF{i}",
+                "from": edge["from"],
+                "typefrom": edge["typefrom"],
+                "to": edge["to"],
+                "typeto": edge["typeto"],
+                "trusted": bool(edge.get("trusted", False)),
+                "boundary": edge.get("boundary", ""),
+                "description": edge.get("description", ""),
+            }
+            for (i, edge) in enumerate(dfd)
+        ],
+        "threats": [
+            {**threat, "details": dict(threat["details"])}
+            for threat in report_threats(state)
+        ],
+    }
+
+
+def write_json_report(state, file):
+    """
+    This function writes the report as JSON, with the structure returned by report_data.
+
+    Args:
+        state (dict): The state of the analysis, as accepted by report_data.
+        file: The text file object the report is written to.
+    """
+    json.dump(report_data(state), file, indent=2, ensure_ascii=False)
+
+
+def category_rule(category):
+    """Returns the SARIF rule id and name of a category such as "L - Linking", i.e. "L" and "Linking"."""
+    letter, separator, name = category.partition(" - ")
+    if not separator:
+        return (category, category)
+    return (letter.strip(), name.strip())
+
+
+def write_sarif_report(state, file):
+    """
+    This function writes the report in the SARIF 2.1.0 format, which code
+    scanning tools can read. Each LINDDUN category is a rule, and each threat
+    is a result of the rule of its category. Threats found on a DFD edge have
+    it as logical location.
+
+    Args:
+        state (dict): The state of the analysis, as accepted by report_data.
+        file: The text file object the report is written to.
+    """
+    data = report_data(state)
+    rules = {}
+    results = []
+    for threat in data["threats"]:
+        (rule_id, rule_name) = category_rule(threat["category"])
+        if rule_id not in rules:
+            rules[rule_id] = {
+                "id": rule_id,
+                "name": rule_name,
+                "shortDescription": {"text": threat["category"]},
+                "helpUri": "https://linddun.org/",
+            }
+        text = f"{threat['title']}\n\n" + "\n\n".join(
+            f"{label}: {value}" for (label, value) in threat["details"].items()
+        )
+        if threat["impact"]:
+            text += f"\n\nImpact assessment: {threat['impact']}"
+        result = {
+            "ruleId": rule_id,
+            "level": "warning",
+            "message": {"text": text},
+            "properties": {
+                "number": threat["number"],
+                "title": threat["title"],
+                "category": threat["category"],
+                "impact": threat["impact"],
+                "controlMeasures": threat["measures"],
+            },
+        }
+        edge = threat.get("edge")
+        if edge:
+            result["locations"] = [{
+                "logicalLocations": [{
+                    "name": f"DF{edge['data_flow_number']}",
+                    "fullyQualifiedName": f"{edge['from']} -> {edge['to']}",
+                    "kind": edge["location"],
+                }]
+            }]
+        results.append(result)
+
+    sarif = {
+        "$schema": "https://json.schemastore.org/sarif-2.1.0.json",
+        "version": "2.1.0",
+        "runs": [{
+            "tool": {
+                "driver": {
+                    "name": "PILLAR",
+                    "informationUri": PILLAR_URI,
+                    "rules": list(rules.values()),
+                }
+            },
+            "properties": data["details"],
+            "results": results,
+        }],
+    }
+    json.dump(sarif, file, indent=2, ensure_ascii=False)
+
+
+def write_xlsx_report(state, file):
+    """
+    This function writes the report as an XLSX spreadsheet, with a sheet for
+    the threats, in the layout of the spreadsheets in the examples folder, a
+    sheet for the control measures, one for the DFD and one for the general
+    information. The workbook is written in the write-only mode of openpyxl,
+    which streams the rows instead of keeping them in memory.
+
+    Args:
+        state (dict): The state of the analysis, as accepted by report_data.
+        file: The binary file object the report is written to.
+    """
+    data = report_data(state)
+    workbook = Workbook(write_only=True)
+    header_font = Font(bold=True)
+    wrap = Alignment(wrap_text=True, vertical="top")
+
+    def add_sheet(title, headers, rows, widths):
+        sheet = workbook.create_sheet(title)
+        for (i, width) in enumerate(widths):
+            sheet.column_dimensions[get_column_letter(i + 1)].width = width
+        header = []
+        for text in headers:
+            cell = WriteOnlyCell(sheet, value=text)
+            cell.font = header_font
+            header.append(cell)
+        sheet.append(header)
+        for row in rows:
+            cells = []
+            for value in row:
+                cell = WriteOnlyCell(sheet, value=value)
+                cell.alignment = wrap
+                cells.append(cell)
+            sheet.append(cells)
+
+    # The detail labels are the same for all the threats of a source
+    labels = list(data["threats"][0]["details"]) if data["threats"] else []
+    headers = ["Number", "Threat Type", "Title", *labels, "Impact assessment", "Control measures"]
+    add_sheet(
+        "Threats",
+        headers,
+        (
+            [
+                threat["number"],
+                threat["category"],
+                threat["title"],
+                *[threat["details"].get(label, "") for label in labels],
+                threat["impact"],
+                ", ".join(measure.get("title", "") for measure in threat["measures"] if isinstance(measure, dict)),
+            ]
+            for threat in data["threats"]
+        ),
+        [XLSX_WIDTHS.get(header, XLSX_DETAIL_WIDTH) for header in headers],
+    )
+    add_sheet(
+        "Control measures",
+        ["Threat", "Title", "Explanation", "Implementation", "Link"],
+        (
+            [
+                threat["number"],
+                measure.get("title", ""),
+                measure.get("explanation", ""),
+                measure.get("implementation", ""),
+                f"https://privacypatterns.org/patterns/{measure['filename']}" if measure.get("filename") else "",
+            ]
+            for threat in data["threats"]
+            for measure in threat["measures"] if isinstance(measure, dict)
+        ),
+        [8, 30, 70, 70, 50],
+    )
+    add_sheet(
+        "DFD",
+        ["Data Flow", "From", "Type", "To", "Type", "Trusted", "Boundary", "Description"],
+        (
+            [edge["data_flow"], edge["from"], edge["typefrom"], edge["to"], edge["typeto"], "Yes" if edge["trusted"] else "No", edge["boundary"], edge["description"]]
+            for edge in data["dfd"]
+        ),
+        [10, 25, 10, 25, 10, 10, 14, 50],
+    )
+    add_sheet(
+        "Report details",
+        ["Field", "Value"],
+        [
+            ["Application Name", data["details"]["app_name"]],
+            ["Application Version", data["details"]["app_version"]],
+            ["Report author", data["details"]["author"]],
+            ["Date", data["details"]["date"]],
+            ["High-level Description", data["details"]["high_level_description"]],
+            ["Threat source", data["threat_source"]],
+        ],
+        [25, 80],
+    )
+    workbook.save(file)
+
+
+# The function writing each export format
+EXPORT_WRITERS = {
+    "PDF": write_report,
+    "HTML": write_report_html,
+    "Markdown": write_report_markdown,
+    "JSON": write_json_report,
+    "SARIF": write_sarif_report,
+    "XLSX": write_xlsx_report,
+}
+
+
+def export_format(path):
+    """
+    This function returns the export format matching the extension of a file
+    name, such as "XLSX" for "report.xlsx", or None if there is no match.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".htm":
+        extension = ".html"
+    for (name, export) in EXPORT_FORMATS.items():
+        if export["extension"] == extension:
+            return name
+    return None
+
+
+def export_report(state, export, file):
+    """
+    This function writes the report in the given export format.
+
+    Args:
+        state (dict): The state of the analysis, as accepted by iter_report_html.
+        export (str): The export format, one of the keys of EXPORT_FORMATS.
+        file: The file object the report is written to, opened in binary mode for the binary formats and in text mode otherwise.
+    """
+    EXPORT_WRITERS[export](state, file)
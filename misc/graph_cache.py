@@ -0,0 +1,147 @@
+# Copyright 2024 Fondazione Bruno Kessler
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from llms.config import GRAPH_CACHE_CONFIG
+
+# The graphs built from a DFD and the rendered graphs, by key, shared by all
+# the sessions of the application since the keys depend only on the content
+built_graphs = OrderedDict()
+rendered_graphs = OrderedDict()
+graph_cache_lock = threading.Lock()
+
+
+def graph_key(*params):
+    """
+    This function computes the key of a graph in the cache, as a hash of
+    everything that determines it, such as the DFD edges, the boundaries,
+    the layout engine, the seed and the styling.
+
+    Args:
+        *params: The parameters of the graph, which must be serializable to JSON.
+
+    Returns:
+        str: The hex digest of the key.
+    """
+    graph = json.dumps(params, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(graph.encode("utf-8")).hexdigest()
+
+
+def remember_in_memory(entries, key, value):
+    """Stores a value in an in-memory cache, evicting the least recently used entries over the limit."""
+    with graph_cache_lock:
+        entries[key] = value
+        entries.move_to_end(key)
+        while len(entries) > GRAPH_CACHE_CONFIG["memory_entries"]:
+            entries.popitem(last=False)
+
+
+def recall_from_memory(entries, key):
+    """Returns a value of an in-memory cache, or None if it is not present."""
+    with graph_cache_lock:
+        value = entries.get(key)
+        if value is not None:
+            entries.move_to_end(key)
+        return value
+
+
+def cached_graph(build, *params):
+    """
+    This function returns the graph built from the given parameters, calling
+    the build function only if the same graph has not already been built.
+    The graphs are kept in memory only, since they are cheap to rebuild
+    compared to their layout. The returned graph must not be modified.
+
+    Args:
+        build (callable): The function building the graph from the parameters.
+        *params: The parameters of the graph, as accepted by graph_key.
+
+    Returns:
+        The graph, as returned by the build function.
+    """
+    if not GRAPH_CACHE_CONFIG["enabled"]:
+        return build(*params)
+    key = graph_key(*params)
+    graph = recall_from_memory(built_graphs, key)
+    if graph is None:
+        graph = build(*params)
+        if graph is not None:
+            remember_in_memory(built_graphs, key, graph)
+    return graph
+
+
+def prune_rendered_graphs(directory):
+    """Removes the oldest rendered graphs from the disk cache, over the configured limit."""
+    try:
+        paths = [os.path.join(directory, name) for name in os.listdir(directory)]
+        paths.sort(key=os.path.getmtime, reverse=True)
+        for path in paths[GRAPH_CACHE_CONFIG["max_files"]:]:
+            os.remove(path)
+    except OSError as e:
+        print(f"Error pruning the graph cache: {e}")
+
+
+def render_graph(graph, format="svg"):
+    """
+    This function renders a graphviz graph, i.e. runs its layout engine,
+    only if the same graph has not already been rendered. The rendered graphs
+    are kept in memory and on disk, with the DOT source of the graph, its
+    engine and the output format as key. Problems with the disk cache never
+    make the rendering fail, while rendering errors are raised and not cached.
+
+    Args:
+        graph (graphviz.Digraph): The graph to render.
+        format (str): The output format, such as "svg".
+
+    Returns:
+        str: The rendered graph, decoded as UTF-8.
+    """
+    if not GRAPH_CACHE_CONFIG["enabled"]:
+        return graph.pipe(format=format, encoding="utf-8")
+
+    key = graph_key(graph.source, graph.engine, format)
+    rendered = recall_from_memory(rendered_graphs, key)
+    if rendered is not None:
+        return rendered
+
+    directory = GRAPH_CACHE_CONFIG["directory"]
+    path = os.path.join(directory, f"{key}.{format}")
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            rendered = f.read()
+        # Mark the graph as recently used, for the eviction
+        os.utime(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        print(f"Error reading the graph cache: {e}")
+
+    if rendered is None:
+        rendered = graph.pipe(format=format, encoding="utf-8")
+        try:
+            os.makedirs(directory, exist_ok=True)
+            # Write to a temporary file first, so that concurrent readers never see a partial graph
+            temporary_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(temporary_path, "w", encoding="utf-8") as f:
+                f.write(rendered)
+            os.replace(temporary_path, path)
+            prune_rendered_graphs(directory)
+        except OSError as e:
+            print(f"Error writing the graph cache: {e}")
+
+    remember_in_memory(rendered_graphs, key, rendered)
+    return rendered
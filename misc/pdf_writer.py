@@ -0,0 +1,410 @@
+# Copyright 2024 Fondazione Bruno Kessler
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import zlib
+
+# Page sizes in points (1/72 inch)
+PAGE_SIZES = {
+    "Letter": (612, 792),
+    "A4": (595, 842),
+}
+
+# The standard PDF fonts used for each font face of the Report tab. They are
+# available in every PDF viewer, so they do not need to be embedded.
+FONTS = {
+    "Arial": ("Helvetica", "Helvetica-Bold"),
+    "Verdana": ("Helvetica", "Helvetica-Bold"),
+    "Courier": ("Courier", "Courier-Bold"),
+    "Times New Roman": ("Times-Roman", "Times-Bold"),
+}
+
+# Widths of the printable ASCII characters (32 to 126) of the standard fonts,
+# in thousandths of the font size, from their Adobe font metrics
+WIDTHS = {
+    "Helvetica": [
+        278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278,
+        556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556,
+        1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778,
+        667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556,
+        333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556,
+        556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584,
+    ],
+    "Helvetica-Bold": [
+        278, 333, 474, 556, 556, 889, 722, 238, 333, 333, 389, 584, 278, 333, 278, 278,
+        556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 333, 333, 584, 584, 584, 611,
+        975, 722, 722, 722, 722, 667, 611, 778, 722, 278, 556, 722, 611, 833, 722, 778,
+        667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 333, 278, 333, 584, 556,
+        333, 556, 611, 556, 611, 556, 333, 611, 611, 278, 278, 556, 278, 889, 611, 611,
+        611, 611, 389, 556, 333, 611, 556, 778, 556, 556, 500, 389, 280, 389, 584,
+    ],
+    "Times-Roman": [
+        250, 333, 408, 500, 500, 833, 778, 180, 333, 333, 500, 564, 250, 333, 250, 278,
+        500, 500, 500, 500, 500, 500, 500, 500, 500, 500, 278, 278, 564, 564, 564, 444,
+        921, 722, 667, 667, 722, 611, 556, 722, 722, 333, 389, 722, 611, 889, 722, 722,
+        556, 722, 667, 556, 611, 722, 722, 944, 722, 722, 611, 333, 278, 333, 469, 500,
+        333, 444, 500, 444, 500, 444, 333, 500, 500, 278, 278, 500, 278, 778, 500, 500,
+        500, 500, 333, 389, 278, 500, 500, 722, 500, 500, 444, 480, 200, 480, 541,
+    ],
+    "Times-Bold": [
+        250, 333, 555, 500, 500, 1000, 833, 278, 333, 333, 500, 570, 250, 333, 250, 278,
+        500, 500, 500, 500, 500, 500, 500, 500, 500, 500, 333, 333, 570, 570, 570, 500,
+        930, 722, 667, 722, 722, 667, 611, 778, 778, 389, 500, 778, 667, 944, 722, 778,
+        611, 778, 722, 556, 667, 722, 722, 1000, 722, 722, 667, 333, 278, 333, 581, 500,
+        333, 500, 556, 444, 556, 444, 333, 500, 556, 278, 333, 556, 278, 833, 556, 500,
+        556, 556, 444, 389, 333, 556, 500, 722, 500, 500, 444, 394, 220, 394, 520,
+    ],
+    "Courier": [600] * 95,
+    "Courier-Bold": [600] * 95,
+}
+
+
+# The widths of each font by character, for fast lookups
+CHAR_WIDTHS = {
+    font: {chr(32 + i): width for (i, width) in enumerate(widths)}
+    for (font, widths) in WIDTHS.items()
+}
+
+
+def char_width(char, font):
+    """Returns the width of a character in thousandths of the font size."""
+    # Other characters are drawn from the WinAnsi encoding, use the width of a digit
+    return CHAR_WIDTHS[font].get(char, WIDTHS[font][16])
+
+
+def text_width(text, font, size):
+    """
+    This function computes the width of a text written with a standard font.
+
+    Args:
+        text (str): The text.
+        font (str): The name of the standard font, such as "Helvetica".
+        size (float): The font size, in points.
+
+    Returns:
+        float: The width of the text, in points.
+    """
+    widths = CHAR_WIDTHS[font]
+    default = WIDTHS[font][16]
+    return sum(widths.get(char, default) for char in text) * size / 1000
+
+
+def pdf_string(text):
+    """Returns a text as a PDF literal string, in the WinAnsi encoding of the standard fonts."""
+    data = text.encode("cp1252", "replace")
+    return b"(" + data.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)") + b")"
+
+
+def hex_to_rgb(color):
+    """Returns a hex color such as "#4570b3" as the RGB components of a PDF color, from 0 to 1."""
+    color = color.lstrip("#")
+    return tuple(int(color[i:i + 2], 16) / 255 for i in range(0, 6, 2))
+
+
+def wrap_runs(runs, fonts, size, width):
+    """
+    This function splits a text made of runs with different fonts (e.g. a bold
+    label followed by a regular text) into lines no wider than the given width.
+
+    Args:
+        runs (list): The runs of the text, tuples (text, font key), where the font key is "F1" (regular) or "F2" (bold).
+        fonts (dict): The name of the standard font of each font key.
+        size (float): The font size, in points.
+        width (float): The maximum width of a line, in points.
+
+    Returns:
+        list: The lines, each a list of (text, font key) runs.
+    """
+    lines = [[]]
+    line_width = 0
+    space = {key: text_width(" ", font, size) for key, font in fonts.items()}
+    for (text, key) in runs:
+        font = fonts[key]
+        paragraphs = str(text).replace("\r", "").split("\n")
+        for (p, paragraph) in enumerate(paragraphs):
+            if p > 0:
+                lines.append([])
+                line_width = 0
+            for word in paragraph.split():
+                word_width = text_width(word, font, size)
+                # Words longer than a line are split at the characters
+                if word_width > width:
+                    if line_width:
+                        lines.append([])
+                    piece, word_width = "", 0
+                    for char in word:
+                        w = char_width(char, font) * size / 1000
+                        if piece and word_width + w > width:
+                            lines[-1].append((piece, key))
+                            lines.append([])
+                            piece, word_width = "", 0
+                        piece += char
+                        word_width += w
+                    word = piece
+                    line_width = 0
+                if line_width and line_width + space[key] + word_width > width:
+                    lines.append([])
+                    line_width = 0
+                if line_width:
+                    lines[-1].append((" ", key))
+                    line_width += space[key]
+                lines[-1].append((word, key))
+                line_width += word_width
+    return lines
+
+
+class PdfWriter:
+    """
+    This class writes a PDF document made of text, headings and tables,
+    without external programs or libraries. Each page is written to the
+    file as soon as it is complete, so the memory used does not grow with
+    the length of the document.
+
+    Args:
+        file: The binary file object the document is written to.
+        font (str): The font face, one of the keys of FONTS.
+        font_size (float): The size of the body text, in points.
+        page_size (str): The page size, one of the keys of PAGE_SIZES.
+        margin (float): The page margins, in points.
+    """
+    def __init__(self, file, font="Arial", font_size=11, page_size="Letter", margin=54):
+        self.file = file
+        self.position = 0
+        self.width, self.height = PAGE_SIZES[page_size]
+        self.margin = margin
+        self.size = font_size
+        regular, bold = FONTS.get(font, FONTS["Arial"])
+        self.fonts = {"F1": regular, "F2": bold}
+        self.page_ids = []
+        self.content = None
+        self.y = 0
+
+        self.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        # The catalog and the page tree are written at the end, when all the
+        # pages are known, but their object numbers are reserved now
+        self.offsets = [None, None]
+        self.font_ids = {
+            key: self.add_object(b"<< /Type /Font /Subtype /Type1 /BaseFont /%s /Encoding /WinAnsiEncoding >>" % name.encode())
+            for key, name in self.fonts.items()
+        }
+
+    @property
+    def text_width(self):
+        """The width available for the text, between the margins."""
+        return self.width - 2 * self.margin
+
+    def write(self, data):
+        """Writes bytes to the file, keeping track of the position for the cross-reference table."""
+        self.file.write(data)
+        self.position += len(data)
+
+    def add_object(self, body, number=None):
+        """Writes an object to the file, returning its number."""
+        if number is None:
+            self.offsets.append(None)
+            number = len(self.offsets)
+        self.offsets[number - 1] = self.position
+        self.write(b"%d 0 obj\n" % number + body + b"\nendobj\n")
+        return number
+
+    def new_page(self):
+        """Ends the current page, if any, and starts a new one."""
+        self.end_page()
+        self.content = []
+        self.y = self.height - self.margin
+
+    def end_page(self):
+        """Writes the current page and its content to the file."""
+        if self.content is None:
+            return
+        stream = zlib.compress(b"\n".join(self.content))
+        contents_id = self.add_object(b"<< /Length %d /Filter /FlateDecode >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        fonts = b" ".join(b"/%s %d 0 R" % (key.encode(), number) for key, number in self.font_ids.items())
+        self.page_ids.append(self.add_object(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] /Resources << /Font << %s >> >> /Contents %d 0 R >>"
+            % (self.width, self.height, fonts, contents_id)
+        ))
+        self.content = None
+
+    def ensure_space(self, height):
+        """Starts a new page if there is not enough vertical space left for the given height."""
+        if self.content is None or self.y - height < self.margin:
+            self.new_page()
+
+    def draw_line(self, runs, x, size, color=None):
+        """Draws a line of text made of (text, font key) runs, with its baseline at the current position."""
+        ops = [b"BT"]
+        if color is not None:
+            ops.append(b"%.3f %.3f %.3f rg" % color)
+        ops.append(b"%.2f %.2f Td" % (x, self.y - size))
+        for (text, key) in runs:
+            ops.append(b"/%s %.1f Tf %s Tj" % (key.encode(), size, pdf_string(text)))
+        ops.append(b"ET")
+        self.content.append(b" ".join(ops))
+
+    def spacer(self, height):
+        """Adds vertical space, if it fits in the current page."""
+        if self.content is not None:
+            self.y -= min(height, self.y - self.margin)
+
+    def heading(self, text, level=1):
+        """
+        This function writes a heading, kept on the same page as the line that follows it.
+
+        Args:
+            text (str): The text of the heading.
+            level (int): The level of the heading, from 1 (the largest) to 3.
+        """
+        size = self.size * {1: 1.8, 2: 1.4, 3: 1.15}.get(level, 1)
+        lines = wrap_runs([(text, "F2")], self.fonts, size, self.text_width)
+        leading = size * 1.3
+        self.ensure_space(leading * len(lines) + self.size * 2.5)
+        self.spacer(size * 0.5)
+        for line in lines:
+            self.draw_line(line, self.margin, size)
+            self.y -= leading
+        self.spacer(size * 0.3)
+
+    def paragraph(self, text, label=None):
+        """
+        This function writes a paragraph, splitting it across pages if needed.
+
+        Args:
+            text (str): The text of the paragraph. Line breaks are kept.
+            label (str): A label written in bold before the text, such as "Impact assessment".
+        """
+        runs = [(f"{label}: ", "F2")] if label else []
+        runs.append((text, "F1"))
+        leading = self.size * 1.3
+        for line in wrap_runs(runs, self.fonts, self.size, self.text_width):
+            self.ensure_space(leading)
+            self.draw_line(line, self.margin, self.size)
+            self.y -= leading
+        self.spacer(self.size * 0.5)
+
+    def badge(self, label, text, color):
+        """
+        This function writes a label followed by a short text with a colored
+        background, such as the LINDDUN category of a threat.
+
+        Args:
+            label (str): The label, written in bold.
+            text (str): The text on the colored background, written in white.
+            color (str): The background color, as a hex value.
+        """
+        leading = self.size * 1.3
+        self.ensure_space(leading + self.size * 0.5)
+        label = f"{label}: "
+        x = self.margin + text_width(label, self.fonts["F2"], self.size)
+        width = min(text_width(text, self.fonts["F1"], self.size), self.width - self.margin - x)
+        self.draw_line([(label, "F2")], self.margin, self.size)
+        self.content.append(b"%.3f %.3f %.3f rg %.2f %.2f %.2f %.2f re f 0 g" % (
+            *hex_to_rgb(color), x - 2, self.y - leading + self.size * 0.05, width + 4, leading,
+        ))
+        self.draw_line([(text, "F1")], x, self.size, color=(1, 1, 1))
+        self.content.append(b"0 g")
+        self.y -= leading
+        self.spacer(self.size * 0.5)
+
+    def table(self, headers, rows, column_widths=None, size=None):
+        """
+        This function writes a table with borders. Rows taller than the space
+        left on a page continue on the next one, and the header row is
+        repeated at the top of every page.
+
+        Args:
+            headers (list): The texts of the header row, or None for a table without header.
+            rows (list): The rows of the table, each a list of texts.
+            column_widths (list): The relative widths of the columns. If None, the columns have the same width.
+            size (float): The font size of the table. If None, it is slightly smaller than the body text.
+        """
+        size = size or self.size * 0.9
+        columns = len(headers) if headers else len(rows[0]) if rows else 0
+        if not columns:
+            return
+        column_widths = column_widths or [1] * columns
+        total = sum(column_widths)
+        widths = [self.text_width * w / total for w in column_widths]
+        padding = size * 0.4
+        leading = size * 1.25
+
+        def cells_lines(row, key):
+            return [
+                wrap_runs([("" if cell is None else str(cell), key)], self.fonts, size, width - 2 * padding) or [[]]
+                for (cell, width) in zip(row, widths)
+            ]
+
+        header_lines = cells_lines(headers, "F2") if headers else None
+
+        def draw_row(lines, fill=None, first=False):
+            # Draws as many lines of the row as fit in the page, then continues on the next pages
+            start = 0
+            height = max(len(cell) for cell in lines)
+            while start < height:
+                available = int((self.y - self.margin - 2 * padding) // leading)
+                if available < 1 or (first and start == 0 and available < min(height, 3)):
+                    self.new_page()
+                    if header_lines is not None and lines is not header_lines:
+                        draw_row(header_lines, fill=(0.949, 0.949, 0.949))
+                    available = int((self.y - self.margin - 2 * padding) // leading)
+                count = min(available, height - start)
+                row_height = count * leading + 2 * padding
+                x = self.margin
+                for (cell, width) in zip(lines, widths):
+                    if fill is not None:
+                        self.content.append(b"%.3f %.3f %.3f rg %.2f %.2f %.2f %.2f re f 0 g" % (*fill, x, self.y - row_height, width, row_height))
+                    self.content.append(b"0.5 w %.2f %.2f %.2f %.2f re S" % (x, self.y - row_height, width, row_height))
+                    top = self.y
+                    self.y -= padding
+                    for line in cell[start:start + count]:
+                        self.draw_line(line, x + padding, size)
+                        self.y -= leading
+                    self.y = top
+                    x += width
+                self.y -= row_height
+                start += count
+                first = False
+
+        if header_lines is not None:
+            self.ensure_space(2 * leading + 4 * padding)
+            draw_row(header_lines, fill=(0.949, 0.949, 0.949))
+        for row in rows:
+            draw_row(cells_lines(row, "F1"), first=True)
+        self.spacer(self.size * 0.8)
+
+    def close(self, title=None):
+        """
+        This function ends the last page and writes the page tree, the catalog
+        and the cross-reference table, completing the document. The file is
+        not closed.
+
+        Args:
+            title (str): The title of the document, shown by PDF viewers.
+        """
+        if self.content is None and not self.page_ids:
+            self.new_page()
+        self.end_page()
+        kids = b" ".join(b"%d 0 R" % number for number in self.page_ids)
+        self.add_object(b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(self.page_ids)), number=2)
+        self.add_object(b"<< /Type /Catalog /Pages 2 0 R >>", number=1)
+        info_id = None
+        if title:
+            info_id = self.add_object(b"<< /Title %s /Producer (PILLAR) >>" % pdf_string(title))
+
+        xref = self.position
+        self.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(self.offsets) + 1))
+        for offset in self.offsets:
+            self.write(b"%010d 00000 n \n" % offset)
+        trailer = b"<< /Size %d /Root 1 0 R" % (len(self.offsets) + 1)
+        if info_id is not None:
+            trailer += b" /Info %d 0 R" % info_id
+        self.write(b"trailer\n" + trailer + b" >>\nstartxref\n%d\n%%%%EOF\n" % xref)
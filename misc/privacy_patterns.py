@@ -0,0 +1,171 @@
+# Copyright 2024 Fondazione Bruno Kessler
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import json
+import math
+import re
+from collections import Counter
+from functools import lru_cache
+
+PRIVACY_PATTERNS_FILE = "misc/privacypatterns.json"
+
+# Parameters of the BM25 ranking, with the usual default values
+BM25_K1 = 1.5
+BM25_B = 0.75
+# The title and the excerpt describe what a pattern is for, so their words
+# count more than the ones in the long sections of the pattern
+TITLE_WEIGHT = 3
+EXCERPT_WEIGHT = 2
+# Common words which do not help telling the patterns apart
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "for", "from", "has",
+    "have", "in", "is", "it", "its", "may", "of", "on", "or", "that", "the",
+    "their", "this", "to", "was", "which", "will", "with",
+}
+
+
+@lru_cache(maxsize=None)
+def get_catalogue(file=PRIVACY_PATTERNS_FILE):
+    """
+    This function loads the catalogue of [privacy patterns](https://privacypatterns.org/)
+    and indexes it. The file is parsed only once per process, every later call
+    returns the same catalogue, which must therefore not be modified.
+
+    Args:
+        file (str): The path of the JSON file with the patterns.
+
+    Returns:
+        dict: The catalogue, with the following keys:
+            - patterns: list. The full patterns, in the order of the file. Each pattern is a dictionary with the keys filename, title, excerpt and sections.
+            - by_title: dict. The full patterns, indexed by title.
+            - summaries: list. The trimmed view of each pattern used to choose the control measures, a dictionary with the keys title, excerpt and related_patterns.
+            - summaries_json: str. The summaries serialized as JSON, ready to be put in a prompt.
+    """
+    with open(file, "r") as f:
+        patterns = json.load(f)["patterns"]
+
+    summaries = [
+        {
+            "title": p["title"],
+            "excerpt": p["excerpt"],
+            "related_patterns": p["sections"]["Related Patterns"] if "Related Patterns" in p["sections"] else None,
+        }
+        for p in patterns
+    ]
+    return {
+        "patterns": patterns,
+        "by_title": {p["title"]: p for p in patterns},
+        "summaries": summaries,
+        "summaries_json": json.dumps(summaries),
+    }
+
+
+def get_patterns_by_title(titles):
+    """
+    This function returns the full patterns with the given titles, skipping
+    the duplicates and the titles that are not in the catalogue.
+
+    Args:
+        titles (list): The titles of the patterns, e.g. as chosen by the model.
+
+    Returns:
+        list: The full patterns, in the same order as the titles.
+    """
+    by_title = get_catalogue()["by_title"]
+    chosen = {}
+    for title in titles:
+        if isinstance(title, str) and title in by_title:
+            chosen.setdefault(title, by_title[title])
+    return list(chosen.values())
+
+
+def tokenize(text):
+    """
+    This function splits a text into the lowercase words used by the pattern
+    index, dropping the stopwords and the single characters.
+
+    Args:
+        text (str): The text to split.
+
+    Returns:
+        list: The words of the text.
+    """
+    return [word for word in re.findall(r"[a-z0-9]+", str(text).lower()) if len(word) > 1 and word not in STOPWORDS]
+
+
+@lru_cache(maxsize=None)
+def get_index(file=PRIVACY_PATTERNS_FILE):
+    """
+    This function builds the BM25 index of the privacy patterns, over their
+    title, excerpt and sections. It is built only once per process.
+
+    Args:
+        file (str): The path of the JSON file with the patterns.
+
+    Returns:
+        dict: The index, with the following keys:
+            - postings: dict. For each word, the list of (pattern position, word count) pairs.
+            - idf: dict. The inverse document frequency of each word.
+            - lengths: list. The number of words of each pattern.
+            - average_length: float. The average number of words of a pattern.
+    """
+    patterns = get_catalogue(file)["patterns"]
+    postings = {}
+    lengths = []
+    for position, pattern in enumerate(patterns):
+        words = tokenize(pattern["title"]) * TITLE_WEIGHT + tokenize(pattern["excerpt"]) * EXCERPT_WEIGHT
+        for section in pattern["sections"].values():
+            words += tokenize(section)
+        for word, count in Counter(words).items():
+            postings.setdefault(word, []).append((position, count))
+        lengths.append(len(words))
+
+    total = len(patterns)
+    idf = {
+        word: math.log(1 + (total - len(documents) + 0.5) / (len(documents) + 0.5))
+        for word, documents in postings.items()
+    }
+    return {
+        "postings": postings,
+        "idf": idf,
+        "lengths": lengths,
+        "average_length": sum(lengths) / max(1, total),
+    }
+
+
+def rank_patterns(query, top_k=None):
+    """
+    This function ranks the privacy patterns against a text with BM25, so that
+    only the most relevant ones need to be sent to the model. It runs locally
+    and does not call any model.
+
+    Args:
+        query (str): The text to match, e.g. the description of a threat.
+        top_k (int): The number of patterns to return. If None, all the patterns are returned.
+
+    Returns:
+        list: The summaries of the best patterns (see get_catalogue), from the most to the least relevant.
+    """
+    catalogue = get_catalogue()
+    index = get_index()
+    scores = [0.0] * len(catalogue["patterns"])
+    for word, query_count in Counter(tokenize(query)).items():
+        for position, count in index["postings"].get(word, []):
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * index["lengths"][position] / index["average_length"])
+            scores[position] += query_count * index["idf"][word] * count * (BM25_K1 + 1) / (count + norm)
+
+    # Ties keep the order of the catalogue, so the ranking is deterministic
+    ranking = sorted(range(len(scores)), key=lambda position: -scores[position])
+    if top_k is not None:
+        ranking = ranking[:top_k]
+    return [catalogue["summaries"][position] for position in ranking]
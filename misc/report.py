@@ -0,0 +1,591 @@
+# Copyright 2024 Fondazione Bruno Kessler
+# 
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# 
+#   https://www.apache.org/licenses/LICENSE-2.0
+# 
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import markdown 
+import pdfkit
+import urllib.parse
+import graphviz
+import io
+import os
+import platform
+import shutil
+import tempfile
+from misc.utils import (
+    match_color,
+    match_number_color,
+    match_letter,
+    match_number_category,
+    match_category_number,
+)
+from llms.risk_assessment import measures_gen_markdown
+from misc.pdf_writer import PdfWriter
+from misc.graph_cache import render_graph
+
+# The PDF engines of the report: the built-in writer is pure Python, while
+# wkhtmltopdf renders the HTML report, including the graph of the DFD
+PDF_ENGINES = ["Built-in", "wkhtmltopdf"]
+
+# The label of the optional description in the details table, which the HTML
+# report spans over the empty cells of its row
+DESCRIPTION_MESSAGE = "High-level Description"
+
+# The title of the threats section of the report, by threat source
+THREAT_SOURCE_TITLES = {
+    "threat_model": "Threats found with the simple threat model",
+    "linddun_go": "Threats found with the LINDDUN Go methodology",
+    "linddun_pro": "Threats found with the LINDDUN Pro methodology",
+}
+
+
+def iter_report_markdown(state):
+    """
+    This function generates the markdown text of the report section by
+    section, so that the report can be written to a file without holding
+    the whole text in memory.
+
+    Args:
+        state (dict): The state of the analysis, with the same keys as the session state of the application
+            (see init_session_state in main.py): app_name, app_version, author, date, high_level_description,
+            include_graph, graph_seed, input, threat_source, to_assess, to_report, assessments and control_measures.
+
+    Yields:
+        str: The markdown text of each section of the report. The first one holds the general information.
+    """
+    # Start the markdown text with the general information
+    text="""# Privacy Threat Modeling and Risk Assessment Report\n"""
+    text += "## Report Details \n\n"
+
+    # Add the general information to the report as a table
+    text += f"| | | | |\n"
+    text += f"|------|-------|-----|-----|\n"
+    text += f"| **Application Name** | {state['app_name']} | **Application Version** | {state['app_version']} |\n"
+    text += f"| **Report author** | {state['author']} | **Date** | {state['date']} |\n"
+    if state["high_level_description"]: # the high-level description is optional
+        text += f"| **{DESCRIPTION_MESSAGE}** | {state['high_level_description']} | | |\n\n"
+    else:
+        text += f"\n\n"
+    yield text
+
+    # if state["include_graph"] and state["is_graph_generated"]:
+    if (state["include_graph"] and 
+        state.get("input") and 
+        state["input"].get("dfd") and 
+        len(state["input"]["dfd"]) > 0):
+        yield dfd_markdown(state)
+    
+    # Add the threats found with the selected methodology to the report
+    if state["threat_source"] == "threat_model":
+        yield from from_threat_model(state)
+    elif state["threat_source"] == "linddun_go":
+        yield from from_linddun_go(state)
+    elif state["threat_source"] == "linddun_pro":
+        yield from from_linddun_pro(state)
+
+
+def dfd_markdown(state):
+    """
+    This function generates the markdown text of the Data Flow Diagram section
+    of the report, with the graph as an SVG image, or as a table if Graphviz
+    is not available.
+    """
+    text ="## Data Flow Diagram\n\n"
+    text+="The Data Flow Diagram (DFD) is a graphical representation of the data flow within the application. To reduce ambiguity, the labels are close to the **tail** of the arrow they refer to.\n\n"
+
+    try:
+        graph = graphviz.Digraph(engine='fdp', format='svg')
+        graph.attr(
+            bgcolor="white",
+            overlap="false",
+            K="5",
+            start=state["graph_seed"],
+            splines="ortho",
+        )
+        graph.node_attr.update(
+            color="black",
+            fontcolor="black",
+        )
+        graph.edge_attr.update(
+            color="grey",
+            fontcolor="fuchsia",
+            arrowsize="0.5",
+        )
+        with graph.subgraph(name='cluster_0') as c:
+            c.attr(
+                color="#00a6fb",
+                label="Trusted",
+                fontcolor="#00a6fb",
+                style="dashed"
+            )
+            for object in state["input"]["dfd"]:
+                if object["trusted"]:
+                    c.node(object["from"])
+                if object["trusted"]:
+                    c.node(object["to"])
+        for (i, object) in enumerate(state["input"]["dfd"]):
+            graph.node(object["from"], shape=f"{'box' if object['typefrom'] == 'Entity' else 'ellipse' if object['typefrom'] == 'Process' else 'cylinder'}")
+            graph.node(object["to"], shape=f"{{'box' if object['typeto'] == 'Entity' else 'ellipse' if object['typeto'] == 'Process' else 'cylinder'}}")
+            graph.edge(object["from"], object["to"], taillabel=f"DF{i}", constraint="false")
+
+        # Add the graph to the report as an SVG image
+        text += f"![Data Flow Diagram](data:image/svg+xml,{urllib.parse.quote(render_graph(graph))})\n"
+    except Exception as e:
+        # If Graphviz fails (common in cloud deployments), provide a textual representation instead
+        text += "**Note**: Graphical DFD rendering is not available in this deployment environment. Showing textual representation instead:\n\n"
+        text += "| Data Flow | From | Type | To | Type | Trusted | Boundary |\n"
+        text += "|-----------|------|------|----|----- |---------|----------|\n"
+        for (i, object) in enumerate(state["input"]["dfd"]):
+            trusted_text = "Yes" if object.get("trusted", False) else "No"
+            boundary = object.get("boundary", "N/A")
+            text += f"| DF{i} | {object['from']} | {object['typefrom']} | {object['to']} | {object['typeto']} | {trusted_text} | {boundary} |\n"
+        text += "\n"
+    return text
+
+
+def report_markdown(state):
+    """
+    This function generates the markdown text of the report.
+
+    Args:
+        state (dict): The state of the analysis, as accepted by iter_report_markdown.
+
+    Returns:
+        str: The markdown text of the report.
+    """
+    return "".join(iter_report_markdown(state))
+
+
+def write_report_markdown(state, file):
+    """
+    This function writes the markdown report to a file, section by section.
+
+    Args:
+        state (dict): The state of the analysis, as accepted by iter_report_markdown.
+        file: The text file object the report is written to.
+    """
+    for section in iter_report_markdown(state):
+        file.write(section)
+
+
+def iter_report_html(state):
+    """
+    This function generates the HTML report, styled for the conversion to PDF,
+    piece by piece. Each section of the markdown report is converted on its
+    own, so that only one section at a time is held in memory.
+
+    Args:
+        state (dict): The state of the analysis, as accepted by iter_report_markdown, also with the font and font_size keys.
+
+    Yields:
+        str: The pieces of the HTML document of the report.
+    """
+    column_widths = [10, 40, 10, 40]
+    colgroup_html = "<colgroup>" + "".join([f"<col style='width: {width}%;'>" for width in column_widths]) + "</colgroup>"
+
+    # Add the CSS styles to the HTML
+    yield f"""
+    <html>
+    <head>
+    <style type="text/css">
+    body {{
+        font-family: {state["font"]};
+        font-size: {state["font_size"]}px;
+    }}
+    table {{
+        width: 100%;
+    }}
+    table, th, td {{
+        border: 1px solid black;
+        border-collapse: collapse;
+    }}
+    th, td {{
+        padding: 10px;
+        text-align: left;
+    }}
+    th {{
+        background-color: #f2f2f2;
+    }}
+    </style>
+    </head>
+    <body>
+        {colgroup_html}
+    """
+
+    for (i, section) in enumerate(iter_report_markdown(state)):
+        # Convert the markdown text to HTML
+        html = markdown.markdown(section, extensions=["markdown.extensions.tables"])
+        if i == 0:
+            # The first section holds the table with the general information
+            html = html.replace("<table>", f"<table table-layout='fixed'>{colgroup_html}", 1)
+            html = html.replace(f"<td><strong>{DESCRIPTION_MESSAGE}</strong></td>\n<td>{state['high_level_description']}</td>\n<td></td>\n<td></td>", 
+                                f"<td><strong>{DESCRIPTION_MESSAGE}</strong></td>\n<td colspan='3'>{state['high_level_description']}</td>\n", 1)
+        yield html + "\n"
+
+    yield """
+    </body>
+    </html>
+    """
+
+
+def report_html(state):
+    """
+    This function generates the HTML report, styled for the conversion to PDF.
+
+    Args:
+        state (dict): The state of the analysis, as accepted by iter_report_html.
+
+    Returns:
+        str: The HTML document of the report.
+    """
+    return "".join(iter_report_html(state))
+
+
+def write_report_html(state, file):
+    """
+    This function writes the HTML report to a file, piece by piece.
+
+    Args:
+        state (dict): The state of the analysis, as accepted by iter_report_html.
+        file: The text file object the report is written to.
+    """
+    for piece in iter_report_html(state):
+        file.write(piece)
+
+
+def write_report(state, file):
+    """
+    This function writes the PDF report to a file, with the PDF engine
+    selected in the "pdf_engine" key of the state (wkhtmltopdf by default).
+    Neither engine holds the whole report in memory.
+
+    Args:
+        state (dict): The state of the analysis, as accepted by iter_report_html.
+        file: The binary file object the report is written to.
+    """
+    if state.get("pdf_engine") == "Built-in":
+        write_native_report(state, file)
+    else:
+        write_pdfkit_report(state, file)
+
+
+def generate_report(state):
+    """
+    This function generates the PDF report based on the information provided
+    by the user, see write_report.
+
+    Args:
+        state (dict): The state of the analysis, as accepted by iter_report_html.
+
+    Returns:
+        PDF file: The PDF file with the report.
+    """
+    buffer = io.BytesIO()
+    write_report(state, buffer)
+    return buffer.getvalue()
+
+
+def write_pdfkit_report(state, file):
+    """
+    This function writes the PDF report by converting the HTML report with
+    wkhtmltopdf, through pdfkit. The HTML report is written to a temporary
+    file, which wkhtmltopdf converts to another temporary file, so that
+    neither document is held in memory.
+
+    Args:
+        state (dict): The state of the analysis, as accepted by iter_report_html.
+        file: The binary file object the report is written to.
+    """
+    try:
+        # Try to find wkhtmltopdf automatically
+        wkhtmltopdf_path = find_wkhtmltopdf()
+
+        options = {
+            'page-size': 'Letter',
+            'margin-top': '0.75in',
+            'margin-right': '0.75in',
+            'margin-bottom': '0.75in',
+            'margin-left': '0.75in',
+            'encoding': "UTF-8",
+            'no-outline': None,
+        }
+
+        # Configure pdfkit with the found path if available
+        config = None
+        if wkhtmltopdf_path:
+            config = pdfkit.configuration(wkhtmltopdf=wkhtmltopdf_path)
+
+        with tempfile.TemporaryDirectory() as directory:
+            html_path = os.path.join(directory, "report.html")
+            pdf_path = os.path.join(directory, "report.pdf")
+            with open(html_path, "w", encoding="utf-8") as f:
+                write_report_html(state, f)
+
+            # Generate the PDF report with the styled HTML content and the specified options
+            if config:
+                pdfkit.from_file(html_path, pdf_path, options=options, configuration=config)
+            else:
+                pdfkit.from_file(html_path, pdf_path, options=options)
+
+            with open(pdf_path, "rb") as f:
+                shutil.copyfileobj(f, file)
+        
+    except OSError as e:
+        if "wkhtmltopdf" in str(e):
+            raise OSError("wkhtmltopdf executable not found. Please install wkhtmltopdf to generate PDF reports.")
+        else:
+            raise e
+    except Exception as e:
+        raise Exception(f"Error generating PDF report: {str(e)}")
+
+
+def from_threat_model(state):
+    """
+    This function generates the markdown text for the threats found with the simple threat model.
+
+    Yields:
+        str: The heading of the section, then the markdown text of each threat to report.
+    """
+    yield "## Threats found with the simple threat model\n"
+    for (i, threat) in enumerate(state["to_assess"]):
+        if state["to_report"][i]:
+            text = f"## Threat {i+1}: {threat['title']}\n\n"
+            color = match_color(threat["threat_type"])
+            color_html = f"<span style='background-color:{color};color:#ffffff;'>"
+            text += f"**Category**: {color_html}{threat['threat_type']}</span>\n\n"
+            text += f"**Reason for detection**: {threat['Reason']}\n\n"
+            text += f"**Scenario**: {threat['Scenario']}\n\n"
+            if state["assessments"][i]["impact"]:
+                text += f"**Impact assessment**: {state['assessments'][i]['impact']}\n\n"
+            if state["control_measures"][i]:
+                text += f"**Suggested control measures**: \n\n{measures_gen_markdown(state['control_measures'][i])}\n\n"
+            yield text
+
+def from_linddun_go(state):
+    """
+    This function generates the markdown text for the threats found with the LINDDUN Go methodology.
+
+    Yields:
+        str: The heading of the section, then the markdown text of each threat to report.
+    """
+    yield "## Threats found with the LINDDUN Go methodology\n"
+    for (i, threat) in enumerate(state["to_assess"]):
+        if state["to_report"][i]:
+            text = f"## Threat {i+1}: {threat['threat_title']}\n\n"
+            color = match_number_color(threat["threat_type"])
+            color_html = f"<span style='background-color:{color};color:#ffffff;'>"
+            text += f"**Category**: {color_html}{match_letter(threat['threat_type'])} - {match_number_category(threat['threat_type'])}</span>\n\n"
+            text += f"**Threat description**: {threat['threat_description']}\n\n"
+            text += f"**Reason for detection**: {threat['reason']}\n\n"
+            if state["assessments"][i]["impact"]:
+                text += f"**Impact assessment**: {state['assessments'][i]['impact']}\n\n"
+            if state["control_measures"][i]:
+                text += f"**Suggested control measures**: \n\n{measures_gen_markdown(state['control_measures'][i])}\n\n"
+            yield text
+
+def from_linddun_pro(state):
+    """
+    This function generates the markdown text for the threats found with the LINDDUN Pro methodology.
+
+    Yields:
+        str: The heading of the section, then the markdown text of each threat to report.
+    """
+    yield "## Threats found with the LINDDUN Pro methodology\n"
+    for (i, threat) in enumerate(state["to_assess"]):
+        if state["to_report"][i]:
+            text = f"## Threat {i+1}: {threat['threat_title']}\n\n"
+            color = match_number_color(match_category_number(threat["category"]))
+            color_html = f"<span style='background-color:{color};color:#ffffff;'>"
+            text += f"**Category**: {color_html}{match_letter(match_category_number(threat['category']))} - {threat['category']}</span>\n\n"
+            text += f"**DFD edge**:         "
+            # Underline the source, data flow, or destination node in the edge, depending on the threat location
+            if threat["threat_location"] == "source":
+                text += f"<u>{threat['edge']['from']}</u>, DF{threat['data_flow_number']}, {threat['edge']['to']}\n\n"
+            elif threat["threat_location"] == "data_flow":
+                text += f"{threat['edge']['from']}, <u>DF{threat['data_flow_number']}</u>, {threat['edge']['to']}\n\n"
+            elif threat["threat_location"] == "destination":
+                text += f"{threat['edge']['from']}, DF{threat['data_flow_number']}, <u>{threat['edge']['to']}</u>\n\n"
+            text += f"**Threat tree involved nodes**: {threat['threat_tree_node']}\n\n"
+            text += f"**Threat description**: {threat['description']}\n\n"
+            if state["assessments"][i]["impact"]:
+                text += f"**Impact assessment**: {state['assessments'][i]['impact']}\n\n"
+            if state["control_measures"][i]:
+                text += f"**Suggested control measures**: \n\n{measures_gen_markdown(state['control_measures'][i])}\n\n"
+            yield text
+
+
+def report_threats(state):
+    """
+    This function returns the content of the threats to report, in a plain
+    form which does not depend on the output format.
+
+    Args:
+        state (dict): The state of the analysis, as accepted by iter_report_markdown.
+
+    Yields:
+        dict: The threats to report, in order, with the following keys:
+            - number: int. The number of the threat, as in the risk assessment tab.
+            - title: string. The title of the threat.
+            - category: string. The LINDDUN category of the threat, such as "L - Linking".
+            - color: string. The color of the category, as a hex value.
+            - details: list. The other fields of the threat, as (label, text) tuples.
+            - impact: string. The impact assessment, possibly empty.
+            - measures: list. The suggested control measures, as returned by get_control_measures.
+            - edge: dict. For LINDDUN Pro, the DFD edge of the threat, with the keys from, to, data_flow_number
+              and location (source, data_flow or destination). None for the other sources.
+    """
+    source = state["threat_source"]
+    for (i, threat) in enumerate(state["to_assess"]):
+        if not state["to_report"][i]:
+            continue
+        edge = None
+        if source == "threat_model":
+            title = threat["title"]
+            category = threat["threat_type"]
+            color = match_color(threat["threat_type"])
+            details = [
+                ("Reason for detection", threat["Reason"]),
+                ("Scenario", threat["Scenario"]),
+            ]
+        elif source == "linddun_go":
+            title = threat["threat_title"]
+            category = f"{match_letter(threat['threat_type'])} - {match_number_category(threat['threat_type'])}"
+            color = match_number_color(threat["threat_type"])
+            details = [
+                ("Threat description", threat["threat_description"]),
+                ("Reason for detection", threat["reason"]),
+            ]
+        elif source == "linddun_pro":
+            number = match_category_number(threat["category"])
+            title = threat["threat_title"]
+            category = f"{match_letter(number)} - {threat['category']}"
+            color = match_number_color(number)
+            location = threat["threat_location"].replace("_", " ")
+            details = [
+                ("DFD edge", f"{threat['edge']['from']}, DF{threat['data_flow_number']}, {threat['edge']['to']} (threat at the {location})"),
+                ("Threat tree involved nodes", threat["threat_tree_node"]),
+                ("Threat description", threat["description"]),
+            ]
+            edge = {
+                "from": threat["edge"]["from"],
+                "to": threat["edge"]["to"],
+                "data_flow_number": threat["data_flow_number"],
+                "location": threat["threat_location"],
+            }
+        else:
+            continue
+        yield {
+            "number": i + 1,
+            "title": title,
+            "category": category,
+            "color": color,
+            "details": details,
+            "impact": state["assessments"][i]["impact"],
+            "measures": state["control_measures"][i] or [],
+            "edge": edge,
+        }
+
+
+def write_native_report(state, file):
+    """
+    This function writes the PDF report with the built-in PDF writer, without
+    external programs. The threats are written one by one, and each page goes
+    to the file as soon as it is complete, so that long reports are fast and
+    use little memory. The DFD is shown as a table.
+
+    Args:
+        state (dict): The state of the analysis, as accepted by iter_report_html.
+        file: The binary file object the report is written to.
+    """
+    # The font size of the HTML report is in pixels, the PDF one in points
+    pdf = PdfWriter(file, font=state.get("font", "Arial"), font_size=state.get("font_size", 16) * 0.75)
+    pdf.heading("Privacy Threat Modeling and Risk Assessment Report", 1)
+    pdf.heading("Report Details", 2)
+    details = [
+        ["Application Name", state["app_name"], "Application Version", state["app_version"]],
+        ["Report author", state["author"], "Date", state["date"]],
+    ]
+    if state["high_level_description"]: # the high-level description is optional
+        details.append(["High-level Description", state["high_level_description"], "", ""])
+    pdf.table(None, details, [10, 40, 10, 40])
+
+    if state["include_graph"] and state.get("input") and state["input"].get("dfd"):
+        pdf.heading("Data Flow Diagram", 2)
+        pdf.table(
+            ["Data Flow", "From", "Type", "To", "Type", "Trusted", "Boundary"],
+            [
+                [f"DF{i}", edge["from"], edge["typefrom"], edge["to"], edge["typeto"], "Yes" if edge.get("trusted", False) else "No", edge.get("boundary", "N/A")]
+                for (i, edge) in enumerate(state["input"]["dfd"])
+            ],
+            [8, 20, 10, 20, 10, 10, 12],
+        )
+
+    if state["threat_source"] in THREAT_SOURCE_TITLES:
+        pdf.heading(THREAT_SOURCE_TITLES[state["threat_source"]], 2)
+    for threat in report_threats(state):
+        pdf.heading(f"Threat {threat['number']}: {threat['title']}", 3)
+        pdf.badge("Category", threat["category"], threat["color"])
+        for (label, text) in threat["details"]:
+            pdf.paragraph(text, label=label)
+        if threat["impact"]:
+            pdf.paragraph(threat["impact"], label="Impact assessment")
+        if threat["measures"]:
+            pdf.paragraph("", label="Suggested control measures")
+            pdf.table(
+                ["Title", "Explanation", "Implementation"],
+                [
+                    [measure.get("title", "No Title"), measure.get("explanation", ""), measure.get("implementation", "")]
+                    for measure in threat["measures"] if isinstance(measure, dict)
+                ],
+                [20, 40, 40],
+            )
+    pdf.close(title=f"Privacy Threat Modeling and Risk Assessment Report - {state['app_name']}")
+
+
+def find_wkhtmltopdf():
+    """
+    Try to find wkhtmltopdf executable in common installation paths
+    """
+    system = platform.system().lower()
+    
+    if system == "windows":
+        # Common Windows installation paths
+        common_paths = [
+            r"C:\Program Files\wkhtmltopdf\bin\wkhtmltopdf.exe",
+            r"C:\Program Files (x86)\wkhtmltopdf\bin\wkhtmltopdf.exe",
+            r"C:\wkhtmltopdf\bin\wkhtmltopdf.exe",
+        ]
+        
+        for path in common_paths:
+            if os.path.exists(path):
+                return path
+                
+    elif system == "darwin":  # macOS
+        common_paths = [
+            "/usr/local/bin/wkhtmltopdf",
+            "/opt/homebrew/bin/wkhtmltopdf",
+        ]
+        
+        for path in common_paths:
+            if os.path.exists(path):
+                return path
+                
+    elif system == "linux":
+        common_paths = [
+            "/usr/bin/wkhtmltopdf",
+            "/usr/local/bin/wkhtmltopdf",
+        ]
+        
+        for path in common_paths:
+            if os.path.exists(path):
+                return path
+    
+    return None
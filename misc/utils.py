@@ -11,6 +11,205 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import csv
+from io import StringIO
+
+# Default boundaries
+DEFAULT_BOUNDARIES = [
+    {
+        "id": "boundary_1",
+        "name": " Boundary 1",
+        "color": "#00a6fb",
+        "description": "description"
+    },
+    {
+        "id": "boundary_2",
+        "name": "Boundary 2",
+        "color": "#701796",
+        "description": "description"
+    },
+    {
+        "id": "boundary_3",
+        "name": "Boundary 3",
+        "color": "#9c5b28",
+        "description": "description"
+    },
+    {
+        "id": "boundary_4",
+        "name": "Boundary 4",
+        "color": "#ad2a95",
+        "description": "description"
+    }
+]
+
+
+def parse_dfd_csv(file_contents):
+    """
+    This function parses a Data Flow Diagram from the contents of a CSV file,
+    in the format of the DFD tab downloads (see examples/dfd_authentication.csv).
+
+    Args:
+        file_contents (str): The contents of the CSV file, with a header row with the keys from, typefrom, to, typeto, trusted, boundary and description.
+
+    Returns:
+        list: The Data Flow Diagram, a list of dictionaries with the keys of the header. The "trusted" field is converted to a boolean.
+    """
+    # Files saved by spreadsheet programs often start with a byte order mark
+    reader = csv.DictReader(StringIO(file_contents.lstrip("\ufeff")), delimiter=",")
+    dfd = list(reader)
+    for edge in dfd:
+        if "trusted" in edge:
+            edge["trusted"] = edge["trusted"].lower() == "true"
+    return dfd
+
+
+def add_missing_boundaries(dfd, boundaries):
+    """
+    This function adds the trust boundaries used by the edges of a Data Flow
+    Diagram which are not in the list of boundaries yet, with a default name,
+    description and color.
+
+    Args:
+        dfd (list): The Data Flow Diagram, as returned by parse_dfd_csv.
+        boundaries (list): The known trust boundaries. Each boundary is a dictionary with the keys id, name, description and color.
+
+    Returns:
+        list: The known boundaries, followed by the missing ones in order of first use.
+    """
+    boundaries = list(boundaries)
+    # Build a dictionary for quick lookup using boundary ID as key
+    boundary_dict = {b["id"]: b for b in boundaries}
+    for edge in dfd:
+        b_id = edge.get("boundary")
+        if b_id and b_id not in boundary_dict:
+            # Generate a new boundary object with default values.
+            new_boundary = {
+                "id": b_id,
+                "name": f"Boundary {b_id.replace('boundary_','')}",
+                "description": "description",
+                "color": "#ff7f50"
+            }
+            boundaries.append(new_boundary)
+            boundary_dict[b_id] = new_boundary
+    return boundaries
+
+
+def index_dfd(dfd):
+    """
+    This function indexes the components of a Data Flow Diagram in a single
+    pass over its edges, so that drawing it takes linear time even for
+    thousands of data flows.
+
+    The boundary of a component is the one of the first edge it is the source
+    of. Components which are only destinations take the boundary of the
+    first edge they are the destination of.
+
+    Args:
+        dfd (list): The edges of the DFD, with the keys of the DFD tab.
+
+    Returns:
+        dict: The index of the DFD, with the following keys:
+            - edges: list. The indexed edges, to update the index incrementally with update_dfd_index.
+            - component_types: dict. The type of each component, from the last edge it appears in.
+            - first_source_boundary: dict. The boundary of the first edge each component is the source of.
+            - first_destination_boundary: dict. The boundary of the first edge each component is the destination of.
+            - source_boundaries: dict. For each component, the boundaries of the edges it is the source of, in order.
+            - outgoing: dict. For each component, the numbers of the edges it is the source of.
+            - incoming: dict. For each component, the numbers of the edges it is the destination of.
+    """
+    index = {
+        "edges": [],
+        "component_types": {},
+        "first_source_boundary": {},
+        "first_destination_boundary": {},
+        "source_boundaries": {},
+        "outgoing": {},
+        "incoming": {},
+    }
+    for edge in dfd:
+        index_edge(index, edge)
+    return index
+
+
+def index_edge(index, edge):
+    """
+    This function adds an edge at the end of a DFD index, see index_dfd.
+
+    Args:
+        index (dict): The index of the DFD, as returned by index_dfd. It is modified in place.
+        edge (dict): The edge to add.
+    """
+    i = len(index["edges"])
+    # A copy, so that edges edited in place are still seen as changed
+    index["edges"].append(dict(edge))
+    from_component = edge["from"]
+    to_component = edge["to"]
+    boundary = edge.get("boundary", "boundary_1")
+
+    # The types of both ends, the destination last as it comes later in the edge
+    index["component_types"][from_component] = edge["typefrom"]
+    index["component_types"][to_component] = edge["typeto"]
+
+    index["first_source_boundary"].setdefault(from_component, boundary)
+    index["first_destination_boundary"].setdefault(to_component, boundary)
+    # Dictionaries are used as ordered sets, so that the graph is always drawn the same way
+    index["source_boundaries"].setdefault(from_component, {})[boundary] = True
+    index["outgoing"].setdefault(from_component, []).append(i)
+    index["incoming"].setdefault(to_component, []).append(i)
+
+
+def update_dfd_index(index, dfd):
+    """
+    This function updates a DFD index after the edges have been edited. If
+    the previously indexed edges are unchanged and new ones have only been
+    added at the end, only the new edges are indexed. Otherwise the index is
+    built again from scratch.
+
+    Args:
+        index (dict): The index of the previous version of the DFD, as returned by index_dfd, or None.
+        dfd (list): The edges of the DFD, with the keys of the DFD tab.
+
+    Returns:
+        dict: The index of the DFD.
+    """
+    if index is None:
+        return index_dfd(dfd)
+    indexed = len(index["edges"])
+    if indexed > len(dfd) or any(old != new for (old, new) in zip(index["edges"], dfd)):
+        return index_dfd(dfd)
+    for edge in dfd[indexed:]:
+        index_edge(index, edge)
+    return index
+
+
+def component_boundary(index, component):
+    """Returns the boundary of a component of an indexed DFD, see index_dfd."""
+    if component in index["first_source_boundary"]:
+        return index["first_source_boundary"][component]
+    return index["first_destination_boundary"].get(component)
+
+
+def boundary_components(index):
+    """
+    This function groups the components of an indexed DFD by boundary. A
+    component is in the boundary of each edge it is the source of, and a
+    destination is also in its own boundary (see index_dfd).
+
+    Args:
+        index (dict): The index of the DFD, as returned by index_dfd.
+
+    Returns:
+        dict: The components of each boundary id, in order of first appearance, as dictionaries used as ordered sets.
+    """
+    groups = {}
+    for (component, boundaries) in index["source_boundaries"].items():
+        for boundary in boundaries:
+            groups.setdefault(boundary, {})[component] = True
+    for component in index["first_destination_boundary"]:
+        groups.setdefault(component_boundary(index, component), {})[component] = True
+    return groups
+
+
 def match_color(threat_type):
     """
     This function matches the letter of a LINDDUN category to a hex color value, based on the LINDDUN color scheme.
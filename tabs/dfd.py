@@ -13,44 +13,20 @@
 # limitations under the License.
 import streamlit as st
 import graphviz
-import csv
 import pandas as pd
 import base64
 import json
-from io import StringIO
 from llms.dfd import (
     get_dfd,
     get_image_analysis,
     update_graph,
 )
-
-# Default boundaries
-DEFAULT_BOUNDARIES = [
-    {
-        "id": "boundary_1",
-        "name": " Boundary 1",
-        "color": "#00a6fb",
-        "description": "description"
-    },
-    {
-        "id": "boundary_2",
-        "name": "Boundary 2",
-        "color": "#701796",
-        "description": "description"
-    },
-    {
-        "id": "boundary_3",
-        "name": "Boundary 3",
-        "color": "#9c5b28",
-        "description": "description"
-    },
-    {
-        "id": "boundary_4",
-        "name": "Boundary 4",
-        "color": "#ad2a95",
-        "description": "description"
-    }
-]
+from misc.utils import (
+    DEFAULT_BOUNDARIES,
+    add_missing_boundaries,
+    parse_dfd_csv,
+)
+from tabs.sidebar import cache_setting
 
 def synchronize_boundaries_from_csv(dfd_list):
     """
@@ -63,28 +39,7 @@ def synchronize_boundaries_from_csv(dfd_list):
     try:
         # Retrieve current boundaries from session state (or default if not set)
         current_boundaries = st.session_state.get("boundaries", DEFAULT_BOUNDARIES.copy())
-        # Build a dictionary for quick lookup using boundary ID as key
-        boundary_dict = {b["id"]: b for b in current_boundaries}
-
-        # Extract unique boundary IDs from the CSV DFD data
-        csv_boundaries = set()
-        for edge in dfd_list:
-            if "boundary" in edge and edge["boundary"]:
-                csv_boundaries.add(edge["boundary"])
-
-        # For each boundary ID found in CSV, add it if missing
-        for b_id in csv_boundaries:
-            if b_id not in boundary_dict:
-                # Generate a new boundary object with default values.
-                new_boundary = {
-                    "id": b_id,
-                    "name": f"Boundary {b_id.replace('boundary_','')}",
-                    "description": "description",
-                    "color": "#ff7f50"  
-                }
-                current_boundaries.append(new_boundary)
-                boundary_dict[b_id] = new_boundary
-                # st.write(f"Added new boundary: {new_boundary}")  
+        current_boundaries = add_missing_boundaries(dfd_list, current_boundaries)
 
         st.session_state["boundaries"] = current_boundaries
         print(f"Boundary synchronization complete. Total boundaries: {len(current_boundaries)}")
@@ -213,6 +168,7 @@ def dfd():
                     st.session_state["openai_model"],
                     st.session_state["temperature"],
                     st.session_state["input"],
+                    use_cache=cache_setting(),
                 )
                 if result and "dfd" in result:
                     st.session_state["input"]["dfd"] = result["dfd"]
@@ -303,11 +259,7 @@ def dfd():
                 
                 # Check if we've already processed this exact file
                 if "last_uploaded_csv_hash" not in st.session_state or st.session_state["last_uploaded_csv_hash"] != current_file_hash:
-                    reader = csv.DictReader(StringIO(file_contents), delimiter=",")
-                    dfd_list = list(reader)
-                    for edge in dfd_list:
-                        if "trusted" in edge:
-                            edge["trusted"] = edge["trusted"].lower() == "true"
+                    dfd_list = parse_dfd_csv(file_contents)
                     # Synchronize boundaries from CSV data before updating the graph
                     synchronize_boundaries_from_csv(dfd_list)
                     st.session_state["input"]["dfd"] = dfd_list
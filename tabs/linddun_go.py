@@ -13,14 +13,15 @@
 # limitations under the License.
 import streamlit as st
 from llms.linddun_go import (
-    get_linddun_go,
-    get_multiagent_linddun_go,
+    iter_linddun_go,
+    iter_multiagent_linddun_go,
     linddun_go_gen_markdown,
 )
-from tabs.sidebar import get_ollama_models
+from tabs.sidebar import get_ollama_models, cache_setting
 import lmstudio as lms
 import requests
 from llms.config import OLLAMA_CONFIG
+from llms.journal import RunJournal, cancel_run
 
 def linddun_go():
     st.markdown("""
@@ -183,6 +184,8 @@ is made by a judge LLM, which evaluates the opinions proposed by the experts.
     with c1:
         threats_to_analyze = st.slider("Number of cards to analyze", 1, st.session_state["max_threats"], 3)
         rounds = st.slider("Number of rounds", 1, 5, 3, disabled=not multi_agent)
+        cards_per_request = st.slider("Cards per request", 1, 8, 1, disabled=multi_agent or provider == "Google AI API", help="The number of cards analyzed with a single request in the single agent simulation. Packing several cards sends the application description only once for all of them, using fewer tokens and requests. Cards the model does not answer properly are analyzed again one by one.")
+        resume = st.checkbox("Resume interrupted runs", value=True, help="Each completed card (and each agent reply, in the multi-agent simulation) is recorded as soon as it is received. If a simulation with the same settings was interrupted or cancelled, it continues from where it stopped instead of starting from scratch.")
         
     with c2:
         # Check if judge model is loaded
@@ -213,7 +216,34 @@ is made by a judge LLM, which evaluates the opinions proposed by the experts.
         inputs = st.session_state["input"]
         inputs["boundaries"] = st.session_state["boundaries"]
         threats = []
+        st.session_state["linddun_go_threats"] = []
+        st.session_state["linddun_go_output"] = ""
+
+        # The run is identified by everything that determines its results
+        journal = RunJournal(
+            "linddun_go",
+            provider,
+            multi_agent,
+            llms_to_use,
+            [st.session_state.get(key) for key in ["openai_model", "mistral_model", "google_model", "ollama_model", "lmstudio_model"]],
+            selected_models if multi_agent and provider in ["Ollama", "Local LM Studio"] else None,
+            inputs,
+            st.session_state["temperature"],
+            threats_to_analyze,
+            rounds if multi_agent else cards_per_request,
+        )
+        if not resume:
+            journal.clear()
+        elif len(journal):
+            st.info(f"Resuming an interrupted simulation, {len(journal)} completed steps are reused.")
         
+        # Clicking the button reruns the script, which ends this run without
+        # reaching the code below, and the callback stops the requests still
+        # running in the workers. The cards analyzed so far are in the journal,
+        # so running the simulation again is how a stopped run continues.
+        st.button("Cancel", on_click=cancel_run, args=(journal.key,), help="Stop the simulation, keeping the results of the cards analyzed so far. Run it again with the same settings to resume it.")
+        progress_bar = st.progress(0, text="Answering questions...")
+        live_table = st.empty()
         with st.spinner("Answering questions..."):
             try:
                 # Check judge model before proceeding
@@ -246,7 +276,7 @@ is made by a judge LLM, which evaluates the opinions proposed by the experts.
                             "google_model": st.session_state.get("google_model")
                         }
 
-                    threats = get_multiagent_linddun_go(
+                    results = iter_multiagent_linddun_go(
                         st.session_state["keys"],
                         models_dict,
                         inputs,
@@ -255,27 +285,38 @@ is made by a judge LLM, which evaluates the opinions proposed by the experts.
                         threats_to_analyze,
                         llms_to_use,
                         lmstudio=(provider == "Local LM Studio"),
-                        ollama=(provider == "Ollama")
+                        ollama=(provider == "Ollama"),
+                        max_workers=st.session_state.get("max_workers"),
+                        journal=journal,
+                        use_cache=cache_setting(),
                     )
                 else:
                     # Single agent case
                     if provider == "Ollama":
-                        threats = get_linddun_go(
+                        results = iter_linddun_go(
                             None,  
                             selected_models[0] if selected_models else st.session_state["ollama_model"],
                             inputs,
                             threats_to_analyze,
                             st.session_state["temperature"],
-                            provider="Ollama"  
+                            provider="Ollama",
+                            max_workers=st.session_state.get("max_workers"),
+                            cards_per_request=cards_per_request,
+                            journal=journal,
+                            use_cache=cache_setting(),
                         )
                     elif provider == "Local LM Studio":
-                        threats = get_linddun_go(
+                        results = iter_linddun_go(
                             None,  
                             st.session_state["lmstudio_model"],
                             inputs,
                             threats_to_analyze,
                             st.session_state["temperature"],
-                            provider="Local LM Studio"
+                            provider="Local LM Studio",
+                            max_workers=st.session_state.get("max_workers"),
+                            cards_per_request=cards_per_request,
+                            journal=journal,
+                            use_cache=cache_setting(),
                         )
                     elif provider == "Google AI API":
                         google_api_key = st.session_state["keys"].get("google_api_key")
@@ -286,41 +327,64 @@ is made by a judge LLM, which evaluates the opinions proposed by the experts.
                         if not google_model:
                             raise Exception("Google model is not selected. Please select a model in the sidebar.")
                         
-                        threats = get_linddun_go(
+                        results = iter_linddun_go(
                             google_api_key,
                             google_model,
                             inputs,
                             threats_to_analyze,
                             st.session_state["temperature"],
-                            provider="Google AI API"
+                            provider="Google AI API",
+                            max_workers=st.session_state.get("max_workers"),
+                            journal=journal,
+                            use_cache=cache_setting(),
                         )
                     elif provider == "Mistral API":
-                        threats = get_linddun_go(
+                        results = iter_linddun_go(
                             st.session_state["keys"]["mistral_api_key"],
                             st.session_state["mistral_model"],
                             inputs,
                             threats_to_analyze,
                             st.session_state["temperature"],
-                            provider="Mistral API"
+                            provider="Mistral API",
+                            max_workers=st.session_state.get("max_workers"),
+                            cards_per_request=cards_per_request,
+                            journal=journal,
+                            use_cache=cache_setting(),
                         )
                     else:
-                        threats = get_linddun_go(
+                        results = iter_linddun_go(
                             st.session_state["keys"]["openai_api_key"],
                             st.session_state["openai_model"],
                             inputs,
                             threats_to_analyze,
                             st.session_state["temperature"],
-                            provider="OpenAI API"
+                            provider="OpenAI API",
+                            max_workers=st.session_state.get("max_workers"),
+                            cards_per_request=cards_per_request,
+                            journal=journal,
+                            use_cache=cache_setting(),
                         )
 
+                # The verdicts arrive in the order the cards complete, and
+                # are shown in the order of the deck
+                verdicts = {}
+                for index, threat in results:
+                    verdicts[index] = threat
+                    threats = [verdicts[i] for i in sorted(verdicts)]
+                    # Convert the threat model JSON to Markdown
+                    markdown_output = linddun_go_gen_markdown(threats)
+                    st.session_state["linddun_go_output"] = markdown_output
+                    st.session_state["linddun_go_threats"] = threats
+                    progress_bar.progress(min(1.0, len(threats) / threats_to_analyze), text=f"Analyzed {len(threats)} of {threats_to_analyze} cards")
+                    live_table.markdown(markdown_output, unsafe_allow_html=True)
+                journal.finish()
+
             except Exception as e:
                 st.error(f"Error generating simulation: {e}")
                 return
-
-        # Convert the threat model JSON to Markdown
-        markdown_output = linddun_go_gen_markdown(threats)
-        st.session_state["linddun_go_output"] = markdown_output
-        st.session_state["linddun_go_threats"] = threats
+            finally:
+                progress_bar.empty()
+                live_table.empty()
 
 
 
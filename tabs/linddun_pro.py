@@ -17,8 +17,29 @@ from llms.linddun_pro import (
     get_linddun_pro,
     linddun_pro_gen_markdown,
     get_linddun_pro_mistral,
-    get_linddun_pro_google
+    get_linddun_pro_google,
+    iter_linddun_pro_full,
+    LINDDUN_CATEGORIES,
 )
+from llms.journal import RunJournal, RunCancelled, cancel_run
+from tabs.sidebar import cache_setting
+
+
+def store_threat(edge_num, new_threat):
+    """
+    This function stores a threat in the list of threats of an edge. If a
+    threat of the same category already exists for the edge, it is replaced
+    instead of appending a new one.
+
+    Args:
+        edge_num (int): The number of the edge in the DFD.
+        new_threat (dict): The threat to store, with the same keys as the one returned by get_linddun_pro.
+    """
+    for (i, threat) in enumerate(st.session_state["linddun_pro_threats"][edge_num]):
+        if new_threat["category"] == threat["category"]:
+            st.session_state["linddun_pro_threats"][edge_num][i] = new_threat
+            return
+    st.session_state["linddun_pro_threats"][edge_num].append(new_threat)
 
 
 def linddun_pro():
@@ -86,6 +107,7 @@ def linddun_pro():
                 disabled=full_analyze_disabled,
                 help="Run LINDDUN PRO analysis for all edges and all categories. Only requires a DFD."
             )
+            resume = st.checkbox("Resume interrupted runs", value=True, help="Each edge-category pair is recorded as soon as it is analyzed. If a Full Analyze with the same DFD and settings was interrupted or cancelled, it continues from where it stopped instead of starting from scratch.")
 
         # Handle Analyze button logic
         if single_analyze_button:
@@ -130,7 +152,8 @@ def linddun_pro():
                             st.session_state["input"]["dfd"][st.session_state["edge_num"]],
                             category,
                             st.session_state["boundaries"],
-                            st.session_state["temperature"]
+                            st.session_state["temperature"],
+                            use_cache=cache_setting(),
                         )
                     elif provider == "Google AI API":
                         new_threat = get_linddun_pro_google(
@@ -140,7 +163,8 @@ def linddun_pro():
                             st.session_state["input"]["dfd"][st.session_state["edge_num"]],
                             category,
                             st.session_state["boundaries"],
-                            st.session_state["temperature"]
+                            st.session_state["temperature"],
+                            use_cache=cache_setting(),
                         )
                     else:  # OpenAI, Ollama, or LM Studio
                         new_threat = get_linddun_pro(
@@ -151,17 +175,11 @@ def linddun_pro():
                             category,
                             st.session_state["boundaries"],
                             st.session_state["temperature"],
-                            provider
+                            provider,
+                            use_cache=cache_setting(),
                         )
                     new_threat["edge"] = st.session_state["input"]["dfd"][st.session_state["edge_num"]]
-                    # Check if the threat category already exists in the list of threats for the edge, and update it if it does instead of appending
-                    flag = False
-                    for (i, threat) in enumerate(st.session_state["linddun_pro_threats"][st.session_state["edge_num"]]):
-                        if new_threat["category"] == threat["category"]:
-                            flag = True
-                            st.session_state["linddun_pro_threats"][st.session_state["edge_num"]][i] = new_threat
-                    if not flag:
-                        st.session_state["linddun_pro_threats"][st.session_state["edge_num"]].append(new_threat)
+                    store_threat(st.session_state["edge_num"], new_threat)
 
 
 
@@ -176,10 +194,6 @@ def linddun_pro():
     if full_analyze_button:
         with st.spinner("Running LINDDUN PRO for all edges and categories..."):
             all_threats = []
-            linddun_categories = [
-                "Linking", "Identifying", "Non-repudiation", "Detecting", 
-                "Data disclosure", "Unawareness and unintervenability", "Non-compliance"
-            ]
             provider = st.session_state.get("model_provider", "OpenAI API")
             
             # Select appropriate API key and model based on provider
@@ -209,47 +223,62 @@ def linddun_pro():
                 api_key = st.session_state["keys"]["openai_api_key"]
                 model_name = st.session_state["openai_model"]
             
-            # Collect threats
-            for edge_num, edge in enumerate(st.session_state["input"]["dfd"]):
-                for category in linddun_categories:
-                    try:
-                        # Use appropriate function based on provider
-                        if provider == "Mistral API":
-                            threat = get_linddun_pro_mistral(
-                                api_key,
-                                model_name,
-                                st.session_state["input"]["dfd"],
-                                edge,
-                                category,
-                                st.session_state["boundaries"],
-                                st.session_state["temperature"]
-                            )
-                        elif provider == "Google AI API":
-                            threat = get_linddun_pro_google(
-                                api_key,
-                                model_name,
-                                st.session_state["input"]["dfd"],
-                                edge,
-                                category,
-                                st.session_state["boundaries"],
-                                st.session_state["temperature"]
-                            )
-                        else:  # OpenAI, Ollama, or LM Studio
-                            threat = get_linddun_pro(
-                                api_key,
-                                model_name,
-                                st.session_state["input"]["dfd"],
-                                edge,
-                                category,
-                                st.session_state["boundaries"],
-                                st.session_state["temperature"],
-                                provider
-                            )
-                        threat["edge"] = edge
-                        threat["category"] = category
-                        all_threats.append(threat)
-                    except Exception as e:
-                        st.warning(f"Error for edge {edge_num}, category {category}: {e}")
+            # Collect threats. The calls for all edges and categories run in
+            # parallel, and each threat is stored as soon as its call finishes,
+            # so that the completed ones are kept even if others fail.
+            dfd = st.session_state["input"]["dfd"]
+            total = len(dfd) * len(LINDDUN_CATEGORIES)
+
+            # The run is identified by everything that determines its results
+            journal = RunJournal(
+                "linddun_pro",
+                provider,
+                model_name,
+                dfd,
+                st.session_state["boundaries"],
+                st.session_state["temperature"],
+                LINDDUN_CATEGORIES,
+            )
+            if not resume:
+                journal.clear()
+            elif len(journal):
+                st.info(f"Resuming an interrupted analysis, {len(journal)} completed calls are reused.")
+            # Clicking the button reruns the script, which ends this loop, and
+            # the callback stops the requests still running in the workers. The
+            # completed calls are in the journal, so running the analysis again
+            # is how a stopped run continues.
+            st.button("Cancel", on_click=cancel_run, args=(journal.key,), help="Stop the analysis, keeping the threats found so far. Run it again with the same DFD and settings to resume it.")
+
+            progress_bar = st.progress(0, text=f"Analyzed 0 of {total} edge-category pairs")
+            failed = 0
+            for (done, (edge_num, category, threat, error)) in enumerate(iter_linddun_pro_full(
+                provider,
+                api_key,
+                model_name,
+                dfd,
+                st.session_state["boundaries"],
+                st.session_state["temperature"],
+                max_workers=st.session_state.get("max_workers"),
+                journal=journal,
+                use_cache=cache_setting(),
+            ), start=1):
+                if error is not None:
+                    failed += 1
+                    # The calls stopped by the Cancel button, before the rerun
+                    # ends this loop, are not errors, they are resumed later
+                    if not isinstance(error, RunCancelled):
+                        st.warning(f"Error for edge {edge_num}, category {category}: {error}")
+                else:
+                    store_threat(edge_num, threat)
+                    all_threats.append((edge_num, LINDDUN_CATEGORIES.index(category), threat))
+                progress_bar.progress(done / total, text=f"Analyzed {done} of {total} edge-category pairs")
+            progress_bar.empty()
+            # The journal is kept if some calls failed, so that only those are retried
+            if not failed:
+                journal.finish()
+
+            # Show the threats in DFD order, regardless of the order in which the calls finished
+            all_threats = [threat for (_, _, threat) in sorted(all_threats, key=lambda item: item[:2])]
 
             # Display results outside columns
             if all_threats:
@@ -12,29 +12,19 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import streamlit as st
-import streamlit.components.v1 as components
-import base64
-import markdown 
-import pdfkit
-import urllib.parse
-import graphviz
 import os
-import platform
-from misc.utils import (
-    match_color,
-    match_number_color,
-    match_letter,
-    match_number_category,
-    match_category_number,
-)
-from tabs.risk_assessment import measures_gen_markdown
+import tempfile
+from misc.report import PDF_ENGINES
+from misc.export import EXPORT_FORMATS, export_format, export_report
 
 def report():
 
     st.markdown("""
     In this tab you can download the complete report of the privacy threat modeling
     and risk assessment, after the previous steps have been completed. Just fill in
-    the required general information and you will be able to download the PDF report.
+    the required general information, generate the report and download it. Besides
+    the PDF report, the report can be exported as HTML or Markdown, as JSON or SARIF
+    for other tools, or as an XLSX spreadsheet.
 
     ---
     """)
@@ -66,42 +56,82 @@ def report():
         font_options = ["Arial", "Courier", "Times New Roman", "Verdana"]
         st.selectbox("Font face", options=font_options, key="font")
         st.slider("Font size", 8, 24, 16, key="font_size")
+        st.selectbox("Format", options=list(EXPORT_FORMATS), key="report_format", help="The format of the report. Font face and size only apply to PDF and HTML.")
+        if st.session_state["report_format"] == "PDF":
+            st.selectbox(
+                "PDF engine",
+                options=PDF_ENGINES,
+                key="pdf_engine",
+                help="The built-in engine is faster and needs no external program, but shows the DFD as a table. wkhtmltopdf must be installed, and also draws the graph of the DFD.",
+            )
     
-    if st.button("Download report", disabled=not (st.session_state.app_name and st.session_state.author and st.session_state.app_version and st.session_state.date)):
-        download_file()
+    if st.button("Generate report", disabled=not (st.session_state.app_name and st.session_state.author and st.session_state.app_version and st.session_state.date)):
+        generate_file()
+
+    report_file = st.session_state.get("report_file")
+    if report_file and os.path.exists(report_file):
+        export = EXPORT_FORMATS[export_format(report_file)]
+        # The download button reads the whole file to serve it, only the
+        # generation of the report is bounded in memory
+        with open(report_file, "rb") as f:
+            st.download_button(
+                "Download report",
+                data=f,
+                file_name=f"report{export['extension']}",
+                mime=export["mime"],
+                on_click="ignore",
+            )
 
     
 
-def download_file():
+def report_directory():
     """
-    This function triggers the download of the PDF report, generating it just
-    before. The download is done through a hidden HTML element that is
-    triggered when the function is called.
+    This function returns the temporary directory of the reports of the
+    session, creating it if needed. The directory is kept in the session state
+    as a TemporaryDirectory, which deletes it with its content when the session
+    ends and its state is released, or at the latest when the server stops.
+
+    Returns:
+        str: The path of the directory.
     """
-    try:
-        file = generate_report()
-        b64 = base64.b64encode(file).decode()
+    if st.session_state.get("report_directory") is None:
+        st.session_state["report_directory"] = tempfile.TemporaryDirectory(prefix="pillar-report-")
+    return st.session_state["report_directory"].name
+
 
-        download_html = f"""
-        <html>
-        <head>
-        <title>Auto Download File</title>
-        <script>
-        document.addEventListener('DOMContentLoaded', function() {{
-            var link = document.createElement('a');
-            link.href = 'data:application/pdf;base64,{b64}';
-            link.download = 'report.pdf';
-            link.click();
-        }});
-        </script>
-        </head>
-        </html>
-        """
+def remove_report_file():
+    """
+    This function removes the temporary file of the last generated report, if any.
+    """
+    report_file = st.session_state.get("report_file")
+    st.session_state["report_file"] = None
+    if report_file:
+        try:
+            os.remove(report_file)
+        except OSError:
+            pass
 
-        components.html(
-            download_html,
-            height=0,
-        )
+
+def generate_file():
+    """
+    This function generates the report, in the selected format, in a file of
+    the temporary directory of the session (see report_directory), which is
+    then served by the download button. The report is written to the file as
+    it is generated, so that it is not held in memory as a whole while it is
+    being generated. The previous report of the session is deleted first.
+    """
+    remove_report_file()
+    export = st.session_state["report_format"]
+    path = os.path.join(report_directory(), f"report{EXPORT_FORMATS[export]['extension']}")
+    try:
+        if EXPORT_FORMATS[export]["binary"]:
+            f = open(path, "wb")
+        else:
+            f = open(path, "w", encoding="utf-8")
+        with f:
+            export_report(st.session_state, export, f)
+        st.session_state["report_file"] = path
+        return
     except OSError as e:
         if "wkhtmltopdf" in str(e):
             st.error("""
@@ -161,283 +191,12 @@ def download_file():
             """)
         else:
             st.error(f"Unexpected error generating report: {str(e)}")
-    
-def generate_report():
-    """
-    This function generates the PDF report based on the information provided by the user.
-    Returns:
-        PDF file: The PDF file with the report.
-    """
+    # The report could not be generated, do not leave a partial file behind
     try:
-        # Try to find wkhtmltopdf automatically
-        wkhtmltopdf_path = find_wkhtmltopdf()
-        
-        # Start the markdown text with the general information
-        text="""# Privacy Threat Modeling and Risk Assessment Report\n"""
-        text += "## Report Details \n\n"
-        
-        # Make this into a variable, because it is later used in the replace function to add CSS styles to the table
-        description_message = "High-level Description"
-
-        # Add the general information to the report as a table
-        text += f"| | | | |\n"
-        text += f"|------|-------|-----|-----|\n"
-        text += f"| **Application Name** | {st.session_state['app_name']} | **Application Version** | {st.session_state['app_version']} |\n"
-        text += f"| **Report author** | {st.session_state['author']} | **Date** | {st.session_state['date']} |\n"
-        if st.session_state["high_level_description"]: # the high-level description is optional
-            text += f"| **{description_message}** | {st.session_state['high_level_description']} | | |\n\n"
-        else:
-            text += f"\n\n"
-
-            
-            
-        # if st.session_state["include_graph"] and st.session_state["is_graph_generated"]:
-        if (st.session_state["include_graph"] and 
-            st.session_state.get("input") and 
-            st.session_state["input"].get("dfd") and 
-            len(st.session_state["input"]["dfd"]) > 0):
-            text+="## Data Flow Diagram\n\n"
-            text+="The Data Flow Diagram (DFD) is a graphical representation of the data flow within the application. To reduce ambiguity, the labels are close to the **tail** of the arrow they refer to.\n\n"
-            
-            try:
-                graph = graphviz.Digraph(engine='fdp', format='svg')
-                graph.attr(
-                    bgcolor="white",
-                    overlap="false",
-                    K="5",
-                    start=st.session_state["graph_seed"],
-                    splines="ortho",
-                )
-                graph.node_attr.update(
-                    color="black",
-                    fontcolor="black",
-                )
-                graph.edge_attr.update(
-                    color="grey",
-                    fontcolor="fuchsia",
-                    arrowsize="0.5",
-                )
-                with graph.subgraph(name='cluster_0') as c:
-                    c.attr(
-                        color="#00a6fb",
-                        label="Trusted",
-                        fontcolor="#00a6fb",
-                        style="dashed"
-                    )
-                    for object in st.session_state["input"]["dfd"]:
-                        if object["trusted"]:
-                            c.node(object["from"])
-                        if object["trusted"]:
-                            c.node(object["to"])
-                for (i, object) in enumerate(st.session_state["input"]["dfd"]):
-                    graph.node(object["from"], shape=f"{'box' if object['typefrom'] == 'Entity' else 'ellipse' if object['typefrom'] == 'Process' else 'cylinder'}")
-                    graph.node(object["to"], shape=f"{{'box' if object['typeto'] == 'Entity' else 'ellipse' if object['typeto'] == 'Process' else 'cylinder'}}")
-                    graph.edge(object["from"], object["to"], taillabel=f"DF{i}", constraint="false")
-
-                # Add the graph to the report as an SVG image
-                text += f"![Data Flow Diagram](data:image/svg+xml,{urllib.parse.quote(graph.pipe(encoding='utf-8'))})\n"
-            except Exception as e:
-                # If Graphviz fails (common in cloud deployments), provide a textual representation instead
-                text += "**Note**: Graphical DFD rendering is not available in this deployment environment. Showing textual representation instead:\n\n"
-                text += "| Data Flow | From | Type | To | Type | Trusted | Boundary |\n"
-                text += "|-----------|------|------|----|----- |---------|----------|\n"
-                for (i, object) in enumerate(st.session_state["input"]["dfd"]):
-                    trusted_text = "Yes" if object.get("trusted", False) else "No"
-                    boundary = object.get("boundary", "N/A")
-                    text += f"| DF{i} | {object['from']} | {object['typefrom']} | {object['to']} | {object['typeto']} | {trusted_text} | {boundary} |\n"
-                text += "\n"
-        
-        # Add the threats found with the selected methodology to the report
-        if st.session_state["threat_source"] == "threat_model":
-            text = from_threat_model(text)
-        elif st.session_state["threat_source"] == "linddun_go":
-            text = from_linddun_go(text)
-        elif st.session_state["threat_source"] == "linddun_pro":
-            text = from_linddun_pro(text)
-        
-        # Convert the markdown text to HTML
-        html = markdown.markdown(text, extensions=["markdown.extensions.tables"])
-        
-        
-        
-        column_widths = [10, 40, 10, 40]
-        colgroup_html = "<colgroup>" + "".join([f"<col style='width: {width}%;'>" for width in column_widths]) + "</colgroup>"
-        html = html.replace("<table>", f"<table table-layout='fixed'>{colgroup_html}", 1)
-        html = html.replace(f"<td><strong>{description_message}</strong></td>\n<td>{st.session_state['high_level_description']}</td>\n<td></td>\n<td></td>", 
-                            f"<td><strong>{description_message}</strong></td>\n<td colspan='3'>{st.session_state['high_level_description']}</td>\n", 1)
-
-
-        # Add the CSS styles to the HTML
-        html_with_style = f"""
-    <html>
-    <head>
-    <style type="text/css">
-    body {{
-        font-family: {st.session_state["font"]};
-        font-size: {st.session_state["font_size"]}px;
-    }}
-    table {{
-        width: 100%;
-    }}
-    table, th, td {{
-        border: 1px solid black;
-        border-collapse: collapse;
-    }}
-    th, td {{
-        padding: 10px;
-        text-align: left;
-    }}
-    th {{
-        background-color: #f2f2f2;
-    }}
-    </style>
-    </head>
-    <body>
-        {colgroup_html}
-        {html}
-    </body>
-    </html>
-        """
-        
-        options = {
-            'page-size': 'Letter',
-            'margin-top': '0.75in',
-            'margin-right': '0.75in',
-            'margin-bottom': '0.75in',
-            'margin-left': '0.75in',
-            'encoding': "UTF-8",
-            'no-outline': None,
-        }
-
-        # Configure pdfkit with the found path if available
-        config = None
-        if wkhtmltopdf_path:
-            import pdfkit
-            config = pdfkit.configuration(wkhtmltopdf=wkhtmltopdf_path)
-
-        # Generate the PDF report with the styled HTML content and the specified options
-        if config:
-            return pdfkit.from_string(html_with_style, False, options=options, configuration=config)
-        else:
-            return pdfkit.from_string(html_with_style, False, options=options)
-        
-    except OSError as e:
-        if "wkhtmltopdf" in str(e):
-            raise OSError("wkhtmltopdf executable not found. Please install wkhtmltopdf to generate PDF reports.")
-        else:
-            raise e
-    except Exception as e:
-        raise Exception(f"Error generating PDF report: {str(e)}")
-
-
-def from_threat_model(text):
-    """
-    This function generates the markdown text for the threats found with the simple threat model.
-    """
-    text += "## Threats found with the simple threat model\n"
-    for (i, threat) in enumerate(st.session_state["to_assess"]):
-        if st.session_state["to_report"][i]:
-            text += f"## Threat {i+1}: {threat['title']}\n\n"
-            color = match_color(threat["threat_type"])
-            color_html = f"<span style='background-color:{color};color:#ffffff;'>"
-            text += f"**Category**: {color_html}{threat['threat_type']}</span>\n\n"
-            text += f"**Reason for detection**: {threat['Reason']}\n\n"
-            text += f"**Scenario**: {threat['Scenario']}\n\n"
-            if st.session_state["assessments"][i]["impact"]:
-                text += f"**Impact assessment**: {st.session_state['assessments'][i]['impact']}\n\n"
-            if st.session_state["control_measures"][i]:
-                text += f"**Suggested control measures**: \n\n{measures_gen_markdown(st.session_state['control_measures'][i])}\n\n"
-
-    return text
-
-def from_linddun_go(text):
-    """
-    This function generates the markdown text for the threats found with the LINDDUN Go methodology.
-    """
-    text += "## Threats found with the LINDDUN Go methodology\n"
-    for (i, threat) in enumerate(st.session_state["to_assess"]):
-        if st.session_state["to_report"][i]:
-            text += f"## Threat {i+1}: {threat['threat_title']}\n\n"
-            color = match_number_color(threat["threat_type"])
-            color_html = f"<span style='background-color:{color};color:#ffffff;'>"
-            text += f"**Category**: {color_html}{match_letter(threat['threat_type'])} - {match_number_category(threat['threat_type'])}</span>\n\n"
-            text += f"**Threat description**: {threat['threat_description']}\n\n"
-            text += f"**Reason for detection**: {threat['reason']}\n\n"
-            if st.session_state["assessments"][i]["impact"]:
-                text += f"**Impact assessment**: {st.session_state['assessments'][i]['impact']}\n\n"
-            if st.session_state["control_measures"][i]:
-                text += f"**Suggested control measures**: \n\n{measures_gen_markdown(st.session_state['control_measures'][i])}\n\n"
-
-    return text
-
-def from_linddun_pro(text):
-    """
-    This function generates the markdown text for the threats found with the LINDDUN Pro methodology.
-    """
-    text += "## Threats found with the LINDDUN Pro methodology\n"
-    for (i, threat) in enumerate(st.session_state["to_assess"]):
-        if st.session_state["to_report"][i]:
-            text += f"## Threat {i+1}: {threat['threat_title']}\n\n"
-            color = match_number_color(match_category_number(threat["category"]))
-            color_html = f"<span style='background-color:{color};color:#ffffff;'>"
-            text += f"**Category**: {color_html}{match_letter(match_category_number(threat['category']))} - {threat['category']}</span>\n\n"
-            text += f"**DFD edge**:         "
-            # Underline the source, data flow, or destination node in the edge, depending on the threat location
-            if threat["threat_location"] == "source":
-                text += f"<u>{threat['edge']['from']}</u>, DF{threat['data_flow_number']}, {threat['edge']['to']}\n\n"
-            elif threat["threat_location"] == "data_flow":
-                text += f"{threat['edge']['from']}, <u>DF{threat['data_flow_number']}</u>, {threat['edge']['to']}\n\n"
-            elif threat["threat_location"] == "destination":
-                text += f"{threat['edge']['from']}, DF{threat['data_flow_number']}, <u>{threat['edge']['to']}</u>\n\n"
-            text += f"**Threat tree involved nodes**: {threat['threat_tree_node']}\n\n"
-            text += f"**Threat description**: {threat['description']}\n\n"
-            if st.session_state["assessments"][i]["impact"]:
-                text += f"**Impact assessment**: {st.session_state['assessments'][i]['impact']}\n\n"
-            if st.session_state["control_measures"][i]:
-                text += f"**Suggested control measures**: \n\n{measures_gen_markdown(st.session_state['control_measures'][i])}\n\n"
-
-    return text
-
-def find_wkhtmltopdf():
-    """
-    Try to find wkhtmltopdf executable in common installation paths
-    """
-    system = platform.system().lower()
+        os.remove(path)
+    except OSError:
+        pass
     
-    if system == "windows":
-        # Common Windows installation paths
-        common_paths = [
-            r"C:\Program Files\wkhtmltopdf\bin\wkhtmltopdf.exe",
-            r"C:\Program Files (x86)\wkhtmltopdf\bin\wkhtmltopdf.exe",
-            r"C:\wkhtmltopdf\bin\wkhtmltopdf.exe",
-        ]
-        
-        for path in common_paths:
-            if os.path.exists(path):
-                return path
-                
-    elif system == "darwin":  # macOS
-        common_paths = [
-            "/usr/local/bin/wkhtmltopdf",
-            "/opt/homebrew/bin/wkhtmltopdf",
-        ]
-        
-        for path in common_paths:
-            if os.path.exists(path):
-                return path
-                
-    elif system == "linux":
-        common_paths = [
-            "/usr/bin/wkhtmltopdf",
-            "/usr/local/bin/wkhtmltopdf",
-        ]
-        
-        for path in common_paths:
-            if os.path.exists(path):
-                return path
-    
-    return None
-
 def is_cloud_environment():
     """
     Detect if running in a cloud environment like Streamlit Cloud
@@ -15,11 +15,43 @@ import streamlit as st
 from llms.linddun_go import linddun_go_gen_markdown
 from llms.simple import threat_model_gen_markdown
 from llms.risk_assessment import (
-    get_assessment,
+    stream_assessment,
+    parse_assessment,
+    iter_assessments,
     get_control_measures,
+    iter_control_measures,
     measures_gen_markdown,
     linddun_pro_gen_individual_markdown,
+    linddun_pro_to_assess,
+    is_threat,
 )
+from tabs.sidebar import cache_setting
+
+
+def get_provider_settings():
+    """
+    This function returns the provider selected in the sidebar, with its API key and model.
+
+    Returns:
+        tuple: A tuple (provider, api_key, model). The API key is None for the local providers.
+    """
+    provider = st.session_state.get("model_provider", "OpenAI API")
+    if provider == "Ollama":
+        api_key = None  
+        model = st.session_state.get("ollama_model")
+    elif provider == "Local LM Studio":
+        api_key = None  
+        model = st.session_state.get("lmstudio_model")
+    elif provider == "Google AI API":
+        api_key = st.session_state["keys"].get("google_api_key")
+        model = st.session_state.get("google_model")
+    elif provider == "Mistral API":
+        api_key = st.session_state["keys"].get("mistral_api_key")
+        model = st.session_state.get("mistral_model")
+    else: 
+        api_key = st.session_state["keys"].get("openai_api_key")
+        model = st.session_state.get("openai_model")
+    return provider, api_key, model
 
 
 def risk_assessment():
@@ -66,42 +98,9 @@ control measures for each one.
                 break
         
         if st.button("Import LINDDUN PRO", help="Import the output of the LINDDUN PRO (Single Analyze) threat modeling to assess the risks.", disabled=empty):
-            analyzed_edges = st.session_state["linddun_pro_threats"]
-            to_assess = []
-            
             # For each edge in the DFD, the LINDDUN PRO tab finds a threat at the source, data flow, and destination.
             # For the risk assessment, we want to assess each of these threats separately.
-            # Thus, we create three separate threats for each edge, one for each location.
-            for (i, edge) in enumerate(analyzed_edges):
-                for threats_of_categories in edge:
-                    to_assess.append({
-                        "category": threats_of_categories["category"], 
-                        "description": threats_of_categories["source"], 
-                        "edge": threats_of_categories["edge"], 
-                        "threat_tree_node": threats_of_categories["source_id"],
-                        "threat_title": threats_of_categories["source_title"],
-                        "threat_location": "source",
-                        "data_flow_number": i,
-                    })
-                    to_assess.append({
-                        "category": threats_of_categories["category"], 
-                        "description": threats_of_categories["data_flow"], 
-                        "edge": threats_of_categories["edge"], 
-                        "threat_tree_node": threats_of_categories["data_flow_id"],
-                        "threat_title": threats_of_categories["data_flow_title"],
-                        "threat_location": "data_flow",
-                        "data_flow_number": i,
-                    })
-                    to_assess.append({
-                        "category": threats_of_categories["category"], 
-                        "description": threats_of_categories["destination"],
-                        "edge": threats_of_categories["edge"], 
-                        "threat_tree_node": threats_of_categories["destination_id"],
-                        "threat_title": threats_of_categories["destination_title"],
-                        "threat_location": "destination",
-                        "data_flow_number": i,
-                    })
-
+            to_assess = linddun_pro_to_assess(st.session_state["linddun_pro_threats"])
 
             st.session_state["to_assess"] = to_assess
             st.session_state["threat_source"] = "linddun_pro"
@@ -146,36 +145,61 @@ control measures for each one.
     with col1:
         if st.button("Impact assessment", help="Generate an assessment of the impact of the current threat, which can then be modified.", disabled=not st.session_state["to_assess"]):
             with st.spinner("Assessing impact..."):
-                provider = st.session_state.get("model_provider", "OpenAI API")
-                
-                if provider == "Ollama":
-                    api_key = None  
-                    model = st.session_state.get("ollama_model")
-                elif provider == "Local LM Studio":
-                    api_key = None  
-                    model = st.session_state.get("lmstudio_model")
-                elif provider == "Google AI API":
-                    api_key = st.session_state["keys"].get("google_api_key")
-                    model = st.session_state.get("google_model")
-                elif provider == "Mistral API":
-                    api_key = st.session_state["keys"].get("mistral_api_key")
-                    model = st.session_state.get("mistral_model")
-                else: 
-                    api_key = st.session_state["keys"].get("openai_api_key")
-                    model = st.session_state.get("openai_model")
+                provider, api_key, model = get_provider_settings()
+                # The response is shown while it is being generated, in place
+                # of the impact text area
+                preview = col2.empty()
                 
                 try:
-                    assessment = get_assessment(
+                    text = ""
+                    for piece in stream_assessment(
                         api_key, 
                         model, 
                         st.session_state["to_assess"][st.session_state["current_threat"]],
                         st.session_state["input"],
                         st.session_state["temperature"],
-                        provider
-                    )
-                    st.session_state["assessments"][st.session_state["current_threat"]] = assessment
+                        provider,
+                        use_cache=cache_setting(),
+                    ):
+                        text += piece
+                        preview.code(text, language="json")
+                    st.session_state["assessments"][st.session_state["current_threat"]] = parse_assessment(text)
                 except Exception as e:
                     st.error(f"Error generating impact assessment: {str(e)}")
+                preview.empty()
+
+        if st.button("Assess all", help="Generate the impact assessment of all the imported threats which do not have one yet, skipping the LINDDUN GO cards deemed absent and the LINDDUN PRO locations which do not apply, sending the requests in parallel. Failed requests are retried.", disabled=not st.session_state["to_assess"]):
+            provider, api_key, model = get_provider_settings()
+            # Only the threats without an assessment are sent, so that running
+            # it again after some failures only retries the missing ones. The
+            # results which are not threats are skipped, as in the CLI
+            pending = [
+                i for i, assessment in enumerate(st.session_state["assessments"])
+                if not assessment["impact"] and is_threat(st.session_state["threat_source"], st.session_state["to_assess"][i])
+            ]
+            progress_bar = st.progress(0, text="Assessing impact...")
+            failed = 0
+            for done, (index, assessment, error) in enumerate(iter_assessments(
+                api_key,
+                model,
+                [st.session_state["to_assess"][i] for i in pending],
+                st.session_state["input"],
+                st.session_state["temperature"],
+                provider,
+                st.session_state.get("max_workers"),
+                use_cache=cache_setting(),
+            )):
+                if error is None:
+                    st.session_state["assessments"][pending[index]] = assessment
+                else:
+                    failed += 1
+                    print(f"Error assessing threat {pending[index]}: {str(error)}")
+                progress_bar.progress((done + 1) / len(pending), text=f"Assessed {done + 1} of {len(pending)} threats")
+            progress_bar.empty()
+            if failed:
+                st.warning(f"{failed} threats could not be assessed, click again to retry them.")
+            else:
+                st.success(f"Assessed {len(pending)} threats.")
     with col2:
         if st.session_state["assessments"]:
             st.text_area(
@@ -211,13 +235,49 @@ control measures for each one.
                             st.session_state["to_assess"][st.session_state["current_threat"]],
                             st.session_state["input"],
                             st.session_state["temperature"],
-                            provider
+                            provider,
+                            use_cache=cache_setting(),
                         )
                         st.session_state["control_measures"][st.session_state["current_threat"]] = control_measures
                     except Exception as e:
                         st.error(f"Error generating control measures: {str(e)}")
                 else:
                     st.error("Control suggestions are only available with OpenAI API. Please select OpenAI API as your model provider.")
+
+        if st.button("Suggest for all",
+                    help="Get control measures for all the imported threats which do not have them yet, skipping the ones which are not threats as in Assess all. Threats of the same LINDDUN category, and for LINDDUN PRO of the same threat tree node, share the same choice of privacy patterns, and their explanations are requested together. This feature only works with OpenAI API.",
+                    disabled=control_suggestions_disabled):
+            provider, api_key, model = get_provider_settings()
+            # The results which are not threats, such as the LINDDUN PRO
+            # locations marked "Not applicable", are skipped as in the CLI
+            pending = [
+                i for i, measures in enumerate(st.session_state["control_measures"])
+                if not measures and is_threat(st.session_state["threat_source"], st.session_state["to_assess"][i])
+            ]
+            progress_bar = st.progress(0, text="Generating control measures...")
+            failed = 0
+            try:
+                for done, (index, measures, error) in enumerate(iter_control_measures(
+                    api_key,
+                    model,
+                    [st.session_state["to_assess"][i] for i in pending],
+                    st.session_state["input"],
+                    st.session_state["temperature"],
+                    provider,
+                    st.session_state.get("max_workers"),
+                    use_cache=cache_setting(),
+                )):
+                    if error is None:
+                        st.session_state["control_measures"][pending[index]] = measures
+                    else:
+                        failed += 1
+                        print(f"Error generating control measures for threat {pending[index]}: {str(error)}")
+                    progress_bar.progress((done + 1) / len(pending), text=f"Generated control measures for {done + 1} of {len(pending)} threats")
+            except Exception as e:
+                st.error(f"Error generating control measures: {str(e)}")
+            progress_bar.empty()
+            if failed:
+                st.warning(f"Control measures could not be generated for {failed} threats, click again to retry them.")
     with col2:
         control_measures = st.session_state.get("control_measures")
         if (control_measures and 
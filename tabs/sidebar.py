@@ -16,7 +16,7 @@ import lmstudio as lms
 from lmstudio import DownloadedLlm
 import requests
 import json
-from llms.config import OLLAMA_CONFIG
+from llms.config import OLLAMA_CONFIG, CONCURRENCY_CONFIG, CACHE_CONFIG
 
 def get_ollama_models():
     """Get list of available Ollama models from remote VM through SSH tunnel"""
@@ -43,6 +43,19 @@ def get_ollama_models():
         st.error(f"Unexpected error connecting to remote Ollama: {str(e)}")
         return []
 
+def cache_setting():
+    """
+    This function returns the choice of the user about the cache of the LLM
+    responses, to pass as use_cache to the functions calling the models. With
+    temperature 0 the cache is always used, otherwise only if "Reuse cached
+    responses" is checked in the sidebar. The choice is kept in the session
+    state, so that it only applies to the requests of this session.
+
+    Returns:
+        bool: Whether the requests of this session should use the cache, see should_use_cache in llms/cache.py.
+    """
+    return bool(st.session_state.get("use_cache_with_temperature")) or not st.session_state.get("temperature")
+
 def sidebar():
         
         
@@ -285,6 +298,12 @@ def sidebar():
         # Global temperature setting for the LLM interactions
         st.slider("Temperature setting", 0.0, 1.0, 0.7, key="temperature", help="The randomness of the model's responses. Lower values lead to more deterministic answers, higher values make the model more creative, but also more prone to hallucination.")
 
+        # Global limit on the number of LLM requests sent in parallel by the analyses
+        st.slider("Parallel requests", 1, 16, CONCURRENCY_CONFIG["max_workers"], key="max_workers", help="The maximum number of requests sent to the model provider at the same time. Higher values make long analyses faster, lower values help with rate limits and local models.")
+
+        # Responses are cached on disk; with temperature 0 the cache is always used
+        st.checkbox("Reuse cached responses", value=CACHE_CONFIG["use_with_temperature"], key="use_cache_with_temperature", help="Reuse the saved response when the exact same request is sent again, also when the temperature is above 0. With temperature 0 cached responses are always reused. Only complete and well-formed responses are saved, so a truncated or unparsable answer is always asked again to the model.")
+
         st.markdown("""---""")
         
         st.markdown("""
@@ -14,12 +14,13 @@
 
 import streamlit as st
 from llms.simple import (
-    get_threat_model_openai,
-    get_threat_model_google,
-    get_threat_model_mistral,
+    stream_threat_model,
+    parse_threat_model,
     threat_model_gen_markdown,
 )
+from llms.streaming import JsonArrayParser
 from llms.prompts import THREAT_MODEL_USER_PROMPT
+from tabs.sidebar import cache_setting
 
 
 def threat_model():
@@ -51,71 +52,64 @@ def threat_model():
             inputs
         )
 
-        with st.spinner("Analysing potential threats..."):
-            max_retries = 3
-            retry_count = 0
-            while retry_count < max_retries:
-                try:
-                    # Call the relevant get_threat_model function with the generated prompt
-                    if model_provider == "OpenAI API":
-                        model_output = get_threat_model_openai(
-                            st.session_state["keys"]["openai_api_key"],
-                            st.session_state["openai_model"], 
-                            threat_model_prompt,
-                            st.session_state["temperature"],
-                        )
-                    elif model_provider == "Google AI API":
-                        model_output = get_threat_model_google(
-                            st.session_state["keys"]["google_api_key"], 
-                            st.session_state["google_model"], 
-                            threat_model_prompt,
-                            st.session_state["temperature"],
-                        )
-                    elif model_provider == "Mistral API":
-                        model_output = get_threat_model_mistral(
-                            st.session_state["keys"]["mistral_api_key"], 
-                            st.session_state["mistral_model"], 
-                            threat_model_prompt,
-                            st.session_state["temperature"],
-                        )
-                    elif model_provider == "Local LM Studio":
-                        if st.session_state["lmstudio_loaded"]:
-                            model_output = get_threat_model_openai(
-                                st.session_state["keys"]["openai_api_key"],
-                                st.session_state["openai_model"], 
-                                threat_model_prompt,
-                                st.session_state["temperature"],
-                                lmstudio=True,
-                            )
-                    elif model_provider == "Ollama":
-                        if st.session_state.get("ollama_loaded"):
-                            model_output = get_threat_model_openai(
-                                api_key="ollama",
-                                model_name=st.session_state["ollama_model"],
-                                prompt=threat_model_prompt,
-                                temperature=st.session_state["temperature"],
-                                ollama=True
-                            )
-                        else:
-                            raise Exception("No Ollama model loaded. Please load a model from the sidebar first.")
+        if model_provider == "OpenAI API":
+            api_key, model_name = st.session_state["keys"]["openai_api_key"], st.session_state["openai_model"]
+        elif model_provider == "Google AI API":
+            api_key, model_name = st.session_state["keys"]["google_api_key"], st.session_state["google_model"]
+        elif model_provider == "Mistral API":
+            api_key, model_name = st.session_state["keys"]["mistral_api_key"], st.session_state["mistral_model"]
+        elif model_provider == "Local LM Studio":
+            api_key, model_name = st.session_state["keys"]["openai_api_key"], st.session_state["openai_model"]
+        else:
+            api_key, model_name = "ollama", st.session_state.get("ollama_model")
 
-                    # Access the threat model from the parsed content, or set it to an empty list if not found
-                    threat_model = model_output.get("threat_model", [])
+        # The response is streamed: the raw text is shown while it arrives,
+        # and each threat is added to the table as soon as it is complete
+        status = st.empty()
+        raw_output = st.empty()
+        table = st.empty()
+        max_retries = 3
+        retry_count = 0
+        while retry_count < max_retries:
+            try:
+                if model_provider == "Local LM Studio" and not st.session_state["lmstudio_loaded"]:
+                    raise Exception("No LM Studio model loaded. Please load a model from the sidebar first.")
+                if model_provider == "Ollama" and not st.session_state.get("ollama_loaded"):
+                    raise Exception("No Ollama model loaded. Please load a model from the sidebar first.")
 
-                    # Save the threat model to the session state for later use.
-                    st.session_state["threat_model_threats"] = threat_model
-                    break  
-                except Exception as e:
-                    retry_count += 1
-                    if retry_count == max_retries:
-                        st.error(
-                            f"Error generating threat model after {max_retries} attempts: {e}"
-                        )
-                        threat_model = []
-                    else:
-                        st.warning(
-                            f"Error generating threat model. Retrying attempt {retry_count+1}/{max_retries}..."
-                        )
+                status.info("Analysing potential threats...")
+                parser = JsonArrayParser("threat_model")
+                threat_model = []
+                response_text = ""
+                for piece in stream_threat_model(model_provider, api_key, model_name, threat_model_prompt, st.session_state["temperature"], use_cache=cache_setting()):
+                    response_text += piece
+                    new_threats = parser.feed(piece)
+                    if new_threats:
+                        threat_model += new_threats
+                        table.markdown(threat_model_gen_markdown(threat_model), unsafe_allow_html=True)
+                    raw_output.code(response_text[-2000:], language="json")
+
+                # If the threats could not be parsed while streaming, parse the whole response
+                if not parser.done:
+                    threat_model = parse_threat_model(response_text).get("threat_model", [])
+
+                # Save the threat model to the session state for later use.
+                st.session_state["threat_model_threats"] = threat_model
+                break  
+            except Exception as e:
+                retry_count += 1
+                if retry_count == max_retries:
+                    st.error(
+                        f"Error generating threat model after {max_retries} attempts: {e}"
+                    )
+                    threat_model = []
+                else:
+                    st.warning(
+                        f"Error generating threat model. Retrying attempt {retry_count+1}/{max_retries}..."
+                    )
+        status.empty()
+        raw_output.empty()
+        table.empty()
 
         # Convert the threat model JSON to Markdown
         markdown_output = threat_model_gen_markdown(threat_model)